@@ -1,9 +1,19 @@
 #!/usr/bin/env python3
 """
 Generate icons and banner for TV application
+
+Gradients are rendered as NumPy arrays, independent sizes are rendered in a
+process pool, and outputs whose inputs did not change since the last run are
+skipped (see MANIFEST_PATH; pass --force to regenerate everything).
 """
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image, ImageDraw, ImageFont
+import argparse
+import hashlib
+import json
+import numpy as np
 import os
+import PIL
 
 # Define colors
 PRIMARY_COLOR = (41, 128, 185)  # Blue
@@ -11,6 +21,11 @@ SECONDARY_COLOR = (52, 152, 219)  # Lighter blue
 ACCENT_COLOR = (255, 255, 255)  # White
 BACKGROUND_COLOR = (44, 62, 80)  # Dark blue-gray
 
+FONT_PATH = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
+
+# Input hashes of the generated files, used to skip unchanged outputs
+MANIFEST_PATH = '.generate_assets.json'
+
 def create_rounded_rectangle_mask(size, radius):
     """Create a rounded rectangle mask"""
     mask = Image.new('L', size, 0)
@@ -18,27 +33,27 @@ def create_rounded_rectangle_mask(size, radius):
     draw.rounded_rectangle([(0, 0), size], radius=radius, fill=255)
     return mask
 
+def radial_gradient(size):
+    """RGBA array of a circle shaded from PRIMARY (center) to SECONDARY (edge), transparent outside"""
+    y, x = np.mgrid[0:size, 0:size]
+    distance = np.hypot(x - size/2, y - size/2)
+    inside = distance < size/2
+
+    ratio = (distance / (size/2))[..., None]
+    primary = np.array(PRIMARY_COLOR, dtype=np.float64)
+    secondary = np.array(SECONDARY_COLOR, dtype=np.float64)
+
+    pixels = np.zeros((size, size, 4), dtype=np.uint8)
+    pixels[..., :3] = np.where(inside[..., None], primary + (secondary - primary) * ratio, 0).astype(np.uint8)
+    pixels[..., 3] = np.where(inside, 255, 0)
+    return pixels
+
 def create_icon(size, rounded=False):
     """Create a TV icon"""
-    img = Image.new('RGBA', (size, size), (0, 0, 0, 0))
+    # Gradient background circle
+    img = Image.fromarray(radial_gradient(size))
     draw = ImageDraw.Draw(img)
 
-    # Create gradient background circle
-    for i in range(size):
-        for j in range(size):
-            # Calculate distance from center
-            dx = i - size/2
-            dy = j - size/2
-            distance = (dx*dx + dy*dy) ** 0.5
-
-            if distance < size/2:
-                # Gradient from PRIMARY to SECONDARY
-                ratio = distance / (size/2)
-                r = int(PRIMARY_COLOR[0] + (SECONDARY_COLOR[0] - PRIMARY_COLOR[0]) * ratio)
-                g = int(PRIMARY_COLOR[1] + (SECONDARY_COLOR[1] - PRIMARY_COLOR[1]) * ratio)
-                b = int(PRIMARY_COLOR[2] + (SECONDARY_COLOR[2] - PRIMARY_COLOR[2]) * ratio)
-                img.putpixel((i, j), (r, g, b, 255))
-
     # Draw TV screen
     padding = size // 5
     screen_width = size - 2 * padding
@@ -86,22 +101,22 @@ def create_icon(size, rounded=False):
 
     return img
 
+def banner_background(width, height):
+    """RGBA array of the banner background, brightened towards the top"""
+    alpha = (30 * (1 - np.arange(height) / height)).astype(np.int32)
+    rgb = np.minimum(255, np.array(BACKGROUND_COLOR, dtype=np.int32) + alpha[:, None])
+
+    pixels = np.empty((height, width, 4), dtype=np.uint8)
+    pixels[..., :3] = rgb[:, None, :]
+    pixels[..., 3] = 255
+    return pixels
+
 def create_banner(width, height):
     """Create a TV banner"""
-    img = Image.new('RGBA', (width, height), BACKGROUND_COLOR)
+    # Background with gradient overlay
+    img = Image.fromarray(banner_background(width, height))
     draw = ImageDraw.Draw(img)
 
-    # Draw gradient overlay
-    for y in range(height):
-        ratio = y / height
-        alpha = int(30 * (1 - ratio))
-        for x in range(width):
-            r, g, b, _ = img.getpixel((x, y))
-            new_r = min(255, r + alpha)
-            new_g = min(255, g + alpha)
-            new_b = min(255, b + alpha)
-            img.putpixel((x, y), (new_r, new_g, new_b, 255))
-
     # Draw TV icon on the left
     icon_size = int(height * 0.6)
     icon_x = int(width * 0.05)
@@ -117,7 +132,7 @@ def create_banner(width, height):
     try:
         # Try to use a default font
         font_size = height // 4
-        font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", font_size)
+        font = ImageFont.truetype(FONT_PATH, font_size)
     except:
         # Fallback to default
         font = ImageFont.load_default()
@@ -141,10 +156,11 @@ def create_banner(width, height):
 
     return img
 
-def main():
-    print("Generating TV app icons and banner...")
+def plan_assets():
+    """List every asset as (path, kind, parameters, description)"""
+    assets = []
 
-    # Define Android icon sizes
+    # Android icon sizes
     android_sizes = {
         'mdpi': 48,
         'hdpi': 72,
@@ -152,48 +168,113 @@ def main():
         'xxhdpi': 144,
         'xxxhdpi': 192
     }
-
-    # Create Android icons
     for density, size in android_sizes.items():
         output_dir = f'android/app/src/main/res/mipmap-{density}'
-        os.makedirs(output_dir, exist_ok=True)
-
-        # Create square icon
-        icon = create_icon(size, rounded=False)
-        icon.save(f'{output_dir}/ic_launcher.png', 'PNG', optimize=True)
-        print(f"Created {output_dir}/ic_launcher.png ({size}x{size})")
-
-        # Create round icon
-        round_icon = create_icon(size, rounded=True)
-        round_icon.save(f'{output_dir}/ic_launcher_round.png', 'PNG', optimize=True)
-        print(f"Created {output_dir}/ic_launcher_round.png ({size}x{size})")
-
-    # Create Android TV banner (320x180 recommended, but 400x240 is also common)
-    banner = create_banner(400, 240)
-    drawable_dir = 'android/app/src/main/res/drawable'
-    os.makedirs(drawable_dir, exist_ok=True)
-    banner.save(f'{drawable_dir}/tv_banner.png', 'PNG', optimize=True)
-    print(f"Created {drawable_dir}/tv_banner.png (400x240)")
-
-    # Create iOS icons
+        assets.append((f'{output_dir}/ic_launcher.png', 'icon', [size, False], f'{size}x{size}'))
+        assets.append((f'{output_dir}/ic_launcher_round.png', 'icon', [size, True], f'{size}x{size}'))
+
+    # Android TV banner (320x180 recommended, but 400x240 is also common)
+    assets.append(('android/app/src/main/res/drawable/tv_banner.png', 'banner', [400, 240], '400x240'))
+
+    # iOS icons
     ios_sizes = [20, 29, 40, 60, 76, 83.5, 1024]
     ios_dir = 'ios/tv/Images.xcassets/AppIcon.appiconset'
-
     if os.path.exists(ios_dir):
         for size in ios_sizes:
             # iOS needs exact pixel sizes
             pixel_sizes = [int(size), int(size * 2), int(size * 3)]
             for pixel_size in pixel_sizes[:2]:  # Most common are @1x and @2x
                 if pixel_size <= 1024:
-                    icon = create_icon(pixel_size, rounded=False)
                     scale = pixel_size // size
-                    icon.save(f'{ios_dir}/icon_{size}x{size}@{scale}x.png', 'PNG', optimize=True)
-                    print(f"Created {ios_dir}/icon_{size}x{size}@{scale}x.png ({pixel_size}x{pixel_size})")
+                    assets.append((f'{ios_dir}/icon_{size}x{size}@{scale}x.png', 'icon', [pixel_size, False],
+                                   f'{pixel_size}x{pixel_size}'))
+
+    return assets
+
+def render_asset(path, kind, params):
+    """Render one asset and save it (runs in a worker process)"""
+    img = create_icon(*params) if kind == 'icon' else create_banner(*params)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    img.save(path, 'PNG', optimize=True)
+    return path
+
+def file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def inputs_hash():
+    """Hash of everything that affects the pixels: this script, the font and the library versions"""
+    digest = hashlib.sha256()
+    digest.update(file_hash(os.path.abspath(__file__)).encode())
+    digest.update(f'{PIL.__version__} {np.__version__}'.encode())
+    if os.path.exists(FONT_PATH):
+        digest.update(file_hash(FONT_PATH).encode())
+    return digest.hexdigest()
+
+def asset_hash(base_hash, kind, params):
+    return hashlib.sha256(json.dumps([base_hash, kind, params]).encode()).hexdigest()
+
+def load_manifest():
+    try:
+        with open(MANIFEST_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def is_current(manifest, path, expected):
+    """Whether the output exists and was generated from the same inputs (and not edited since)"""
+    entry = manifest.get(path)
+    return (
+        entry is not None
+        and entry.get('inputs') == expected
+        and os.path.exists(path)
+        and file_hash(path) == entry.get('output')
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--force', action='store_true', help='Regenerate all assets, even unchanged ones')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='Worker processes (default: CPU count)')
+    args = parser.parse_args()
+
+    print("Generating TV app icons and banner...")
+
+    base_hash = inputs_hash()
+    manifest = {} if args.force else load_manifest()
+    assets = plan_assets()
+
+    pending = []
+    for path, kind, params, description in assets:
+        expected = asset_hash(base_hash, kind, params)
+        if is_current(manifest, path, expected):
+            continue
+        pending.append((path, kind, params, description, expected))
+
+    if pending:
+        # Each size is independent; render them in parallel
+        with ProcessPoolExecutor(max_workers=max(1, min(args.jobs, len(pending)))) as pool:
+            futures = [pool.submit(render_asset, path, kind, params) for path, kind, params, _, _ in pending]
+            for future, (path, _, _, description, expected) in zip(futures, pending):
+                future.result()
+                manifest[path] = {'inputs': expected, 'output': file_hash(path)}
+                print(f"Created {path} ({description})")
+
+        with open(MANIFEST_PATH, 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    skipped = len(assets) - len(pending)
+    if not pending:
+        print("\nAll icons and banner are up to date.")
+        return
+    if skipped:
+        print(f"\nSkipped {skipped} unchanged asset(s).")
 
     print("\nAll icons and banner generated successfully!")
     print("\nAndroid assets:")
     print("  - Icons: android/app/src/main/res/mipmap-*/ic_launcher*.png")
     print("  - Banner: android/app/src/main/res/drawable/tv_banner.png")
+    ios_dir = 'ios/tv/Images.xcassets/AppIcon.appiconset'
     if os.path.exists(ios_dir):
         print("\niOS assets:")
         print(f"  - Icons: {ios_dir}/icon_*.png")
@@ -0,0 +1,287 @@
+"""
+Admission control, priorities and deadlines for the inference path.
+
+The HTTP process admits at most ADMISSION_CONCURRENCY inference requests at a
+time. Others wait in a bounded queue where interactive requests are served
+before background ones, and are rejected with Retry-After when the queue is
+full. A request deadline ends the wait early and is checked again between
+pipeline stages where the work runs, so expired requests stop computing.
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Optional
+
+from . import config, executor
+
+# Priority classes; lower values are admitted first
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+PRIORITIES = {INTERACTIVE: 0, BACKGROUND: 1}
+
+# Rejection reasons (also used as metric labels)
+REASON_QUEUE_FULL = "queue_full"
+REASON_BACKGROUND_LIMIT = "background_limit"
+REASON_DEADLINE = "deadline"
+
+_SERVICE_TIME_SMOOTHING = 0.2
+
+
+class Rejected(Exception):
+    """The request was not admitted; answered with status and a Retry-After hint."""
+
+    def __init__(self, status_code: int, reason: str, detail: str, retry_after: int = None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.reason = reason
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    """The request deadline passed before the work finished."""
+
+
+@dataclass(frozen=True)
+class RequestPolicy:
+    """Priority class and absolute deadline (epoch seconds) of a request; None means the default."""
+    priority: Optional[str] = None
+    deadline: Optional[float] = None
+
+
+def resolve_policy(priority: str = None, deadline_ms: int = None) -> RequestPolicy:
+    """
+    Build the policy of a request from its query parameters or headers.
+
+    Args:
+        priority: "interactive", "background" or None for the endpoint default
+        deadline_ms: time budget in milliseconds from now (None or 0: DEFAULT_DEADLINE_MS)
+
+    Returns:
+        RequestPolicy
+
+    Raises:
+        ValueError: for an unknown priority or a negative deadline
+    """
+    if priority is not None:
+        priority = priority.strip().lower()
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority '{priority}'. Allowed: {', '.join(PRIORITIES)}")
+    if deadline_ms is not None and deadline_ms < 0:
+        raise ValueError("deadline must not be negative")
+
+    budget_ms = deadline_ms or config.DEFAULT_DEADLINE_MS
+    return RequestPolicy(priority=priority, deadline=time.time() + budget_ms / 1000 if budget_ms else None)
+
+
+class AdmissionController:
+    """
+    Priority-ordered admission with a bounded waiting queue.
+
+    Runs on the event loop of the HTTP process; not thread-safe.
+    """
+
+    def __init__(self, concurrency: int, queue_depth: int, background_depth: int):
+        """
+        Args:
+            concurrency: requests executing at the same time
+            queue_depth: waiting requests before new ones are rejected with 503
+            background_depth: waiting background requests before new ones are rejected with 429
+        """
+        self.concurrency = max(1, concurrency)
+        self.queue_depth = queue_depth
+        self.background_depth = background_depth
+
+        self._active = 0
+        self._waiters = []
+        self._waiting = {priority: 0 for priority in PRIORITIES}
+        # Waiters admitted without the depth checks (/ingest photos); they do not
+        # take queue room from bounded requests
+        self._unbounded = {priority: 0 for priority in PRIORITIES}
+        self._sequence = itertools.count()
+        self._service_time = 1.0
+
+        self._admitted = 0
+        self._rejected = {REASON_QUEUE_FULL: 0, REASON_BACKGROUND_LIMIT: 0, REASON_DEADLINE: 0}
+
+    def retry_after(self) -> int:
+        """Seconds until a new request would likely be admitted."""
+        waiting = sum(self._waiting.values())
+        return max(1, math.ceil((waiting + 1) * self._service_time / self.concurrency))
+
+    def _queued(self, *priorities) -> int:
+        """Bounded waiters of the given priority classes."""
+        return sum(self._waiting[priority] - self._unbounded[priority] for priority in priorities)
+
+    def _add_waiter(self, priority: str, bounded: bool, count: int):
+        self._waiting[priority] += count
+        if not bounded:
+            self._unbounded[priority] += count
+
+    def _reject(self, status_code: int, reason: str, detail: str):
+        self._rejected[reason] += 1
+        raise Rejected(status_code, reason, detail, self.retry_after())
+
+    async def acquire(self, priority: str = INTERACTIVE, deadline: float = None, bounded: bool = True):
+        """
+        Wait for an execution slot.
+
+        Args:
+            priority: priority class
+            deadline: absolute deadline (epoch seconds) or None
+            bounded: reject instead of waiting when the queue is full (False for
+                work that is already throttled, such as /ingest photos)
+
+        Returns:
+            seconds spent waiting
+
+        Raises:
+            Rejected: the queue is full or the deadline passed while waiting
+        """
+        if self._active < self.concurrency and not any(self._waiting.values()):
+            self._active += 1
+            self._admitted += 1
+            return 0.0
+
+        if bounded:
+            if self._queued(*PRIORITIES) >= self.queue_depth:
+                self._reject(503, REASON_QUEUE_FULL, "Server is busy, inference queue is full")
+            if priority == BACKGROUND and self._queued(BACKGROUND) >= self.background_depth:
+                self._reject(429, REASON_BACKGROUND_LIMIT, "Too many background requests queued")
+
+        started = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (PRIORITIES[priority], next(self._sequence), priority, bounded, future))
+        self._add_waiter(priority, bounded, 1)
+        timeout = None if deadline is None else max(0.0, deadline - time.time())
+        try:
+            await asyncio.wait_for(future, timeout)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as the wait ended: pass it on
+                self.release()
+            else:
+                # Left in the heap; release() skips cancelled waiters
+                future.cancel()
+                self._add_waiter(priority, bounded, -1)
+            if isinstance(e, asyncio.TimeoutError):
+                self._reject(504, REASON_DEADLINE, "Deadline exceeded while queued")
+            raise
+
+        self._admitted += 1
+        return time.perf_counter() - started
+
+    def release(self, service_time: float = None):
+        """
+        Free a slot and hand it to the highest-priority waiter.
+
+        Args:
+            service_time: how long the request ran, for the Retry-After estimate
+        """
+        if service_time is not None:
+            self._service_time += _SERVICE_TIME_SMOOTHING * (service_time - self._service_time)
+
+        while self._waiters:
+            _, _, priority, bounded, future = heapq.heappop(self._waiters)
+            if future.cancelled():
+                continue
+            self._add_waiter(priority, bounded, -1)
+            future.set_result(None)
+            return
+        self._active -= 1
+
+    async def run(self, priority: str, deadline: float, fn, *args, bounded: bool = True):
+        """
+        Wait for a slot, then run fn on the inference executor.
+
+        The slot is released when the executor job finishes, not when the caller
+        stops waiting: a request cancelled by a client disconnect keeps its slot
+        while its job still occupies a worker, so the concurrency limit holds.
+
+        Args:
+            priority: priority class
+            deadline: absolute deadline (epoch seconds) or None
+            fn, *args: function and arguments for executor.submit_inference
+            bounded: see acquire
+
+        Returns:
+            (seconds spent waiting for the slot, result of fn)
+
+        Raises:
+            Rejected: see acquire
+        """
+        waited = await self.acquire(priority, deadline, bounded)
+        started = time.perf_counter()
+        try:
+            job = executor.submit_inference(fn, *args)
+        except BaseException:
+            self.release()
+            raise
+
+        loop = asyncio.get_running_loop()
+
+        def job_done(_):
+            service_time = time.perf_counter() - started
+            try:
+                loop.call_soon_threadsafe(self.release, service_time)
+            except RuntimeError:
+                pass  # event loop already closed at shutdown
+
+        job.add_done_callback(job_done)
+        return waited, await asyncio.wrap_future(job)
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "active": self._active,
+            "waiting": dict(self._waiting),
+            "waiting_unbounded": dict(self._unbounded),
+            "queue_depth": self.queue_depth,
+            "background_depth": self.background_depth,
+            "admitted": self._admitted,
+            "rejected": dict(self._rejected),
+            "service_time_ms": round(self._service_time * 1000, 1),
+            "retry_after": self.retry_after(),
+        }
+
+
+controller = AdmissionController(
+    config.ADMISSION_CONCURRENCY,
+    config.ADMISSION_QUEUE_DEPTH,
+    config.ADMISSION_BACKGROUND_QUEUE_DEPTH,
+)
+
+
+# Deadline of the request running on the current thread (set in the inference thread or process)
+_local = threading.local()
+
+
+@contextmanager
+def deadline_scope(deadline: float = None):
+    """Make a request deadline visible to check_deadline() for the code run inside the block."""
+    previous = getattr(_local, "deadline", None)
+    _local.deadline = deadline
+    try:
+        yield
+    finally:
+        _local.deadline = previous
+
+
+def check_deadline(stage: str):
+    """
+    Stop the current request if its deadline has passed.
+
+    Args:
+        stage: the stage about to start (for the error message)
+
+    Raises:
+        DeadlineExceeded
+    """
+    deadline = getattr(_local, "deadline", None)
+    if deadline is not None and time.time() > deadline:
+        raise DeadlineExceeded(f"Deadline exceeded before {stage}")
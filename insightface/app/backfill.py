@@ -0,0 +1,429 @@
+"""
+Offline, resumable face extraction over a photo directory.
+
+Runs the /detect pipeline directly on files (no HTTP) in a pool of forked
+processes and writes the faces as columnar .npy shards plus a SQLite index.
+Progress is committed after every chunk, so an interrupted run continues where
+it stopped; photos whose content hash is already in the index are skipped,
+including copies of the same photo under another path.
+
+Usage (from the insightface directory):
+    python -m app.backfill run /photos /data/faces --stages det,ga,rec,emotion
+    python -m app.backfill status /data/faces
+
+Output directory:
+    index.sqlite            files(path, size, mtime, sha256)
+                            photos(sha256, status, error, shard, face_offset, face_count)
+    shards/000001/*.npy     one array per column, one row per face:
+        bbox (N, 4) float32, landmark (N, 5, 2) float32, score (N,) float32,
+        age (N,) int16 and gender (N,) int8 (-1 if missing) with the ga stage,
+        emotion (N,) int8 index into EMOTION_LABELS and emotion_scores (N, 8) float32 with the emotion stage,
+        embedding (N, 512) float32/float16 (NaN if missing) with the rec stage
+
+The faces of a photo are rows [face_offset, face_offset + face_count) of its shard;
+load_shard() opens a shard as memory maps.
+"""
+import argparse
+import concurrent.futures
+import hashlib
+import logging
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import sys
+import time
+
+import numpy as np
+
+from . import config
+from .face_service import (
+    EMOTION_LABELS,
+    STAGE_EMOTION,
+    STAGE_GENDERAGE,
+    STAGE_RECOGNITION,
+    detect_photos,
+    resolve_stages,
+)
+from .models import EMOTION, registry
+
+logger = logging.getLogger("face_service")
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff")
+
+EMBEDDING_DTYPES = {
+    "float32": np.float32,
+    "float16": np.float16,
+}
+
+STATUS_DONE = "done"
+STATUS_ERROR = "error"
+STATUS_DUPLICATE = "duplicate"  # worker side only: content already in the index
+
+_INDEX_FILE = "index.sqlite"
+_SHARDS_DIR = "shards"
+
+# Read-only index connection of a worker process
+_index = None
+
+
+def _open_index(path: str):
+    db = sqlite3.connect(path, isolation_level=None)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    db.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, sha256 TEXT)")
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS photos (sha256 TEXT PRIMARY KEY, status TEXT, error TEXT, "
+        "shard INTEGER, face_offset INTEGER, face_count INTEGER)"
+    )
+    return db
+
+
+def _check_meta(db, settings: dict):
+    """Store the run settings on the first run; refuse to mix results of different settings."""
+    stored = dict(db.execute("SELECT key, value FROM meta").fetchall())
+    for key, value in settings.items():
+        if key in stored and stored[key] != value:
+            raise SystemExit(f"The output was written with {key}={stored[key]}, not {value}; use another output directory")
+        db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+
+def _walk(root: str):
+    """Image paths under root, relative to it, in a stable order."""
+    for directory, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith(IMAGE_EXTENSIONS) and not name.startswith("."):
+                yield os.path.relpath(os.path.join(directory, name), root)
+
+
+def _pending(root: str, db, retry_errors: bool):
+    """
+    Yield (path, size, mtime) of photos that still need processing.
+
+    Files whose path, size and mtime are unchanged since they were indexed are
+    skipped without reading them.
+    """
+    known = {
+        path: (size, mtime, status)
+        for path, size, mtime, status in db.execute(
+            "SELECT f.path, f.size, f.mtime, p.status FROM files f JOIN photos p ON p.sha256 = f.sha256"
+        )
+    }
+    skipped = 0
+    for path in _walk(root):
+        try:
+            stat = os.stat(os.path.join(root, path))
+        except OSError as e:
+            logger.warning(f"Skipping {path}: {str(e)}")
+            continue
+        entry = known.get(path)
+        if entry is not None and entry[:2] == (stat.st_size, int(stat.st_mtime)):
+            if entry[2] == STATUS_DONE or not retry_errors:
+                skipped += 1
+                continue
+        yield path, stat.st_size, int(stat.st_mtime)
+    if skipped:
+        logger.info(f"{skipped} photo(s) unchanged since the last run")
+
+
+def _chunks(iterable, size: int):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _init_worker(index_path: str, threads: int):
+    """Initializer of each forked worker: one model set and a few ORT threads per process."""
+    global _index
+    config.ORT_INTRA_OP_THREADS = threads
+    # A worker runs one chunk at a time and the faces of a chunk already share one
+    # ArcFace batch, so waiting for other requests would only add latency
+    config.EMBED_BATCH_MAX_SIZE = 1
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(threads)
+    _index = sqlite3.connect(f"file:{index_path}?mode=ro", uri=True)
+
+
+def _is_done(sha256: str) -> bool:
+    row = _index.execute("SELECT status FROM photos WHERE sha256 = ?", (sha256,)).fetchone()
+    return row is not None and row[0] == STATUS_DONE
+
+
+def _face_columns(faces, stages, embedding_dtype):
+    """Turn /detect face dicts into column arrays."""
+    count = len(faces)
+    columns = {
+        "bbox": np.array([face["bbox"] for face in faces], dtype=np.float32).reshape(count, 4),
+        "landmark": np.full((count, 5, 2), np.nan, dtype=np.float32),
+        "score": np.array([face["score"] for face in faces], dtype=np.float32),
+    }
+    for row, face in enumerate(faces):
+        if face["landmark"] is not None:
+            columns["landmark"][row] = face["landmark"]
+
+    if STAGE_GENDERAGE in stages:
+        columns["age"] = np.array([-1 if face["age"] is None else face["age"] for face in faces], dtype=np.int16)
+        columns["gender"] = np.array(
+            [{"male": 1, "female": 0}.get(face["gender"], -1) for face in faces], dtype=np.int8
+        )
+
+    if STAGE_EMOTION in stages:
+        columns["emotion"] = np.full(count, -1, dtype=np.int8)
+        columns["emotion_scores"] = np.full((count, len(EMOTION_LABELS)), np.nan, dtype=np.float32)
+        for row, face in enumerate(faces):
+            if "emotion" in face:
+                columns["emotion"][row] = EMOTION_LABELS.index(face["emotion"])
+                columns["emotion_scores"][row] = [face["emotion_scores"][label] for label in EMOTION_LABELS]
+
+    if STAGE_RECOGNITION in stages:
+        columns["embedding"] = np.full((count, 512), np.nan, dtype=embedding_dtype)
+        for row, face in enumerate(faces):
+            if face.get("embedding") is not None:
+                columns["embedding"][row] = face["embedding"]
+
+    return columns
+
+
+def process_chunk(root: str, files, stages, embedding_dtype: str):
+    """
+    Read, hash and process a chunk of photos (runs in a worker process).
+
+    Args:
+        root: photo directory
+        files: list of (relative path, size, mtime)
+        stages: stage plan from resolve_stages
+        embedding_dtype: float32 or float16
+
+    Returns:
+        dict with "photos" (one record per file, in order) and "columns" (face arrays
+        of the processed photos, concatenated in the same order)
+    """
+    photos = []
+    items = []
+    for path, size, mtime in files:
+        record = {"path": path, "size": size, "mtime": mtime, "sha256": None, "error": None, "face_count": 0}
+        photos.append(record)
+        try:
+            with open(os.path.join(root, path), "rb") as f:
+                data = f.read()
+        except OSError as e:
+            record.update(status=STATUS_ERROR, error=str(e))
+            continue
+
+        record["sha256"] = hashlib.sha256(data).hexdigest()
+        if _is_done(record["sha256"]):
+            record["status"] = STATUS_DUPLICATE
+            continue
+        items.append((record, data))
+
+    results = detect_photos([(record["path"], data) for record, data in items], stages) if items else []
+
+    faces = []
+    for (record, _), result in zip(items, results):
+        if "error" in result:
+            record.update(status=STATUS_ERROR, error=result["error"])
+            continue
+        record.update(status=STATUS_DONE, face_count=len(result["faces"]))
+        faces.extend(result["faces"])
+
+    return {"photos": photos, "columns": _face_columns(faces, stages, EMBEDDING_DTYPES[embedding_dtype])}
+
+
+def _write_shard(output: str, shard: int, columns: dict):
+    """Write the columns of a shard into a temporary directory and move it into place."""
+    final = os.path.join(output, _SHARDS_DIR, f"{shard:06d}")
+    partial = f"{final}.tmp"
+    # Left over from a run interrupted before its index commit
+    for path in (partial, final):
+        if os.path.exists(path):
+            shutil.rmtree(path)
+    os.makedirs(partial)
+    for name, array in columns.items():
+        np.save(os.path.join(partial, f"{name}.npy"), array)
+    os.replace(partial, final)
+
+
+def _commit(db, output: str, result: dict, next_shard: int) -> int:
+    """
+    Store the result of a chunk: shard files first, then the index in one transaction.
+
+    Returns:
+        the next free shard number
+    """
+    shard = None
+    if len(result["columns"]["bbox"]):
+        shard = next_shard
+        _write_shard(output, shard, result["columns"])
+        next_shard += 1
+
+    offset = 0
+    db.execute("BEGIN")
+    try:
+        for record in result["photos"]:
+            if record["sha256"] is None:
+                logger.warning(f"Failed to read {record['path']}: {record['error']}")
+                continue
+            if record["status"] != STATUS_DUPLICATE:
+                db.execute(
+                    "INSERT OR REPLACE INTO photos (sha256, status, error, shard, face_offset, face_count) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (record["sha256"], record["status"], record["error"],
+                     shard if record["face_count"] else None, offset, record["face_count"])
+                )
+                offset += record["face_count"]
+            db.execute(
+                "INSERT OR REPLACE INTO files (path, size, mtime, sha256) VALUES (?, ?, ?, ?)",
+                (record["path"], record["size"], record["mtime"], record["sha256"])
+            )
+        db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('next_shard', ?)", (str(next_shard),))
+        db.execute("COMMIT")
+    except Exception:
+        db.execute("ROLLBACK")
+        raise
+    return next_shard
+
+
+def run(root: str, output: str, stages, workers: int, chunk_size: int = 16,
+        embedding_dtype: str = "float32", retry_errors: bool = False):
+    """
+    Process every photo under root that is not in the output index yet.
+
+    Args:
+        root: photo directory (walked recursively)
+        output: output directory (created if missing)
+        stages: stage plan from resolve_stages
+        workers: number of worker processes
+        chunk_size: photos per task; the faces of a chunk share model batches
+        embedding_dtype: float32 or float16 storage for embeddings
+        retry_errors: process photos again that failed in an earlier run
+    """
+    os.makedirs(os.path.join(output, _SHARDS_DIR), exist_ok=True)
+    index_path = os.path.join(output, _INDEX_FILE)
+    db = _open_index(index_path)
+    _check_meta(db, {"stages": ",".join(sorted(stages)), "embedding_dtype": embedding_dtype})
+    row = db.execute("SELECT value FROM meta WHERE key = 'next_shard'").fetchone()
+    next_shard = int(row[0]) if row else 1
+
+    # Download the model pack once before forking
+    registry.preload((EMOTION,) if STAGE_EMOTION in stages else ())
+
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    logger.info(f"Processing {root} with {workers} worker(s) x {threads} thread(s), stages={','.join(sorted(stages))}")
+
+    pool = concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("fork"),
+        initializer=_init_worker,
+        initargs=(index_path, threads),
+    )
+    started = time.perf_counter()
+    photos = faces = errors = 0
+    in_flight = set()
+    chunks = _chunks(_pending(root, db, retry_errors), chunk_size)
+    try:
+        exhausted = False
+        while True:
+            # Keep a bounded number of chunks queued so that results are committed steadily
+            while not exhausted and len(in_flight) < 2 * workers:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    exhausted = True
+                    break
+                in_flight.add(pool.submit(process_chunk, root, chunk, stages, embedding_dtype))
+            if not in_flight:
+                break
+
+            done, in_flight = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                next_shard = _commit(db, output, result, next_shard)
+                photos += len(result["photos"])
+                faces += len(result["columns"]["bbox"])
+                errors += sum(record["status"] == STATUS_ERROR for record in result["photos"])
+
+            elapsed = time.perf_counter() - started
+            logger.info(f"{photos} photo(s), {faces} face(s), {errors} error(s), {photos / max(elapsed, 1e-9):.1f} photos/s")
+    except KeyboardInterrupt:
+        logger.info("Interrupted; finished chunks are saved, run the same command again to resume")
+        raise SystemExit(130)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        db.close()
+
+    logger.info(f"Done: {photos} photo(s), {faces} face(s), {errors} error(s) in {time.perf_counter() - started:.1f}s")
+
+
+def status(output: str) -> dict:
+    """
+    Summary of an output directory.
+
+    Returns:
+        dict with photo counts per status, the number of faces and of shards
+    """
+    db = sqlite3.connect(f"file:{os.path.join(output, _INDEX_FILE)}?mode=ro", uri=True)
+    try:
+        photos = dict(db.execute("SELECT status, COUNT(*) FROM photos GROUP BY status").fetchall())
+        return {
+            "files": db.execute("SELECT COUNT(*) FROM files").fetchone()[0],
+            "photos": photos,
+            "faces": db.execute("SELECT COALESCE(SUM(face_count), 0) FROM photos").fetchone()[0],
+            "shards": len([name for name in os.listdir(os.path.join(output, _SHARDS_DIR)) if not name.endswith(".tmp")]),
+            "settings": dict(db.execute("SELECT key, value FROM meta").fetchall()),
+        }
+    finally:
+        db.close()
+
+
+def load_shard(output: str, shard: int) -> dict:
+    """
+    Open the columns of a shard as read-only memory maps.
+
+    Returns:
+        dict of column name to array
+    """
+    directory = os.path.join(output, _SHARDS_DIR, f"{shard:06d}")
+    return {
+        name[:-len(".npy")]: np.load(os.path.join(directory, name), mmap_mode="r")
+        for name in os.listdir(directory) if name.endswith(".npy")
+    }
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="process a photo directory (resumes an earlier run)")
+    run_parser.add_argument("photos", help="photo directory, walked recursively")
+    run_parser.add_argument("output", help="output directory for the index and the shards")
+    run_parser.add_argument("--stages", default="det,ga,rec,emotion", help="comma-separated stages, as for /detect")
+    run_parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 1) // 2), help="worker processes")
+    run_parser.add_argument("--chunk", type=int, default=16, help="photos per task")
+    run_parser.add_argument("--dtype", choices=sorted(EMBEDDING_DTYPES), default="float32", help="embedding storage type")
+    run_parser.add_argument("--retry-errors", action="store_true", help="process photos that failed before again")
+
+    status_parser = subparsers.add_parser("status", help="summarize an output directory")
+    status_parser.add_argument("output")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        for key, value in status(args.output).items():
+            print(f"{key}: {value}")
+        return
+
+    try:
+        stages = resolve_stages(args.stages)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    run(args.photos, args.output, stages, max(1, args.workers), max(1, args.chunk), args.dtype, args.retry_errors)
+
+
+if __name__ == "__main__":
+    main()
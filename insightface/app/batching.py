@@ -0,0 +1,136 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger("face_service")
+
+# Upper bounds of the batch-size histogram buckets
+_BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+class MicroBatcher:
+    """
+    Collects single items submitted from many threads into batched model calls.
+
+    A background thread takes the first queued item, then keeps collecting until
+    either max_batch_size items are gathered or max_wait_ms has passed since the
+    first one arrived. The batch function is called once and every caller's future
+    is resolved with its own row of the result.
+    """
+
+    def __init__(self, name: str, batch_fn, max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        """
+        Args:
+            name: batcher name used in logs and stats
+            batch_fn: callable taking a list of items and returning a sequence of results of the same length
+            max_batch_size: flush when this many items are collected
+            max_wait_ms: flush when the oldest item has waited this long
+        """
+        self.name = name
+        self._batch_fn = batch_fn
+        self._max_batch_size = max(1, max_batch_size)
+        self._max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue = queue.Queue()
+
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._max_queue_depth = 0
+        self._batch_size_counts = [0] * (len(_BATCH_SIZE_BUCKETS) + 1)
+
+        self._thread = threading.Thread(target=self._run, name=f"batcher-{name}", daemon=True)
+        self._thread.start()
+        logger.info(f"Micro-batcher '{name}' started: max_batch_size={self._max_batch_size}, max_wait_ms={max_wait_ms}")
+
+    def submit(self, item) -> Future:
+        """
+        Queue one item for the next batch.
+
+        Args:
+            item: a single model input
+
+        Returns:
+            Future resolved with the result row for this item
+        """
+        future = Future()
+        self._queue.put((item, future))
+
+        depth = self._queue.qsize()
+        with self._stats_lock:
+            if depth > self._max_queue_depth:
+                self._max_queue_depth = depth
+
+        return future
+
+    def submit_many(self, items) -> list:
+        """Queue several items; returns one future per item."""
+        return [self.submit(item) for item in items]
+
+    def _collect(self):
+        first = self._queue.get()
+        batch = [first]
+        deadline = time.monotonic() + self._max_wait
+
+        while len(batch) < self._max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            items = [item for item, _ in batch]
+
+            try:
+                results = self._batch_fn(items)
+            except Exception as e:
+                logger.exception(f"Micro-batcher '{self.name}' failed on a batch of {len(batch)}: {str(e)}")
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+
+            self._record(len(batch))
+
+    def _record(self, size: int):
+        with self._stats_lock:
+            self._batches += 1
+            self._items += size
+            for index, bound in enumerate(_BATCH_SIZE_BUCKETS):
+                if size <= bound:
+                    self._batch_size_counts[index] += 1
+                    break
+            else:
+                self._batch_size_counts[-1] += 1
+
+    def stats(self) -> dict:
+        """
+        Snapshot of queue and batch statistics.
+
+        Returns:
+            dict with current/max queue depth, totals and a batch-size histogram
+            (counts of batches whose size is <= each bucket bound, non-cumulative)
+        """
+        with self._stats_lock:
+            histogram = {str(bound): count for bound, count in zip(_BATCH_SIZE_BUCKETS, self._batch_size_counts)}
+            histogram["+Inf"] = self._batch_size_counts[-1]
+            return {
+                "queue_depth": self._queue.qsize(),
+                "max_queue_depth": self._max_queue_depth,
+                "batches": self._batches,
+                "items": self._items,
+                "avg_batch_size": (self._items / self._batches) if self._batches else 0.0,
+                "max_batch_size": self._max_batch_size,
+                "max_wait_ms": self._max_wait * 1000.0,
+                "batch_size_histogram": histogram,
+            }
@@ -0,0 +1,191 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger("face_service")
+
+
+class ResultCache:
+    """
+    Content-addressed cache for service results.
+
+    Keys combine a hash of the uploaded bytes with the endpoint, its parameters
+    and the model version, so byte-identical requests are answered without
+    running inference. Results live in a bounded in-memory LRU and, optionally,
+    in a SQLite file that survives restarts. The disk tier is wiped automatically
+    when it was written by a different model version.
+    """
+
+    def __init__(self, model_version: str, max_entries: int = 10000, path: str = None, disk_max_entries: int = 1000000):
+        """
+        Args:
+            model_version: identifier of the loaded models; part of every key
+            max_entries: size of the in-memory LRU (0 disables the memory tier)
+            path: SQLite file for the on-disk tier (None or "" disables it)
+            disk_max_entries: oldest rows beyond this count are pruned from the disk tier
+        """
+        self.model_version = model_version
+        self._max_entries = max(0, max_entries)
+        self._disk_max_entries = disk_max_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._hits_memory = 0
+        self._hits_disk = 0
+        self._misses = 0
+        self._stores = 0
+
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._puts_since_prune = 0
+        if path:
+            self._open_disk(path)
+
+    def _open_disk(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value BLOB, created REAL)")
+
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'model_version'").fetchone()
+        if row is None or row[0] != self.model_version:
+            if row is not None:
+                logger.info(f"Model version changed ({row[0]} -> {self.model_version}), clearing disk cache")
+            self._db.execute("DELETE FROM results")
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('model_version', ?)", (self.model_version,))
+
+        count = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        logger.info(f"Disk result cache opened at {path} with {count} entries")
+
+    def key(self, data: bytes, endpoint: str, params: dict) -> str:
+        """
+        Build the cache key for a request.
+
+        Args:
+            data: uploaded file bytes
+            endpoint: endpoint name (e.g. "detect", "embed")
+            params: parameters that affect the result
+
+        Returns:
+            hex digest identifying the result
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        suffix = json.dumps(params, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(f"{digest}|{endpoint}|{suffix}|{self.model_version}".encode()).hexdigest()
+
+    def get(self, key: str):
+        """
+        Look up a result in memory, then on disk.
+
+        Returns:
+            cached result dict, or None on a miss
+        """
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self._hits_memory += 1
+                return value
+
+        if self._db is not None:
+            with self._db_lock:
+                row = self._db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                value = pickle.loads(row[0])
+                self._remember(key, value)
+                with self._lock:
+                    self._hits_disk += 1
+                return value
+
+        with self._lock:
+            self._misses += 1
+        return None
+
+    def put(self, key: str, value):
+        """Store a result in both tiers."""
+        self._remember(key, value)
+
+        if self._db is not None:
+            blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            with self._db_lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO results (key, value, created) VALUES (?, ?, ?)",
+                    (key, blob, time.time())
+                )
+                self._puts_since_prune += 1
+                if self._puts_since_prune >= 1000:
+                    self._prune()
+
+        with self._lock:
+            self._stores += 1
+
+    def _remember(self, key: str, value):
+        if self._max_entries == 0:
+            return
+        with self._lock:
+            self._memory[key] = value
+            self._memory.move_to_end(key)
+            while len(self._memory) > self._max_entries:
+                self._memory.popitem(last=False)
+
+    def _prune(self):
+        """Drop the oldest disk entries beyond disk_max_entries (caller holds _db_lock)."""
+        self._puts_since_prune = 0
+        count = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        excess = count - self._disk_max_entries
+        if excess > 0:
+            self._db.execute(
+                "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY created LIMIT ?)",
+                (excess,)
+            )
+
+    def clear_memory(self):
+        """Drop the in-memory tier only (the disk tier is shared with other processes)."""
+        with self._lock:
+            self._memory.clear()
+
+    def clear(self):
+        """Invalidate every cached result in both tiers."""
+        self.clear_memory()
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute("DELETE FROM results")
+        logger.info("Result cache cleared")
+
+    def stats(self) -> dict:
+        """
+        Hit/miss counters and tier sizes.
+
+        Returns:
+            dict with counters, hit ratio and entry counts
+        """
+        disk_entries = None
+        if self._db is not None:
+            with self._db_lock:
+                disk_entries = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+        with self._lock:
+            hits = self._hits_memory + self._hits_disk
+            lookups = hits + self._misses
+            return {
+                "model_version": self.model_version,
+                "hits_memory": self._hits_memory,
+                "hits_disk": self._hits_disk,
+                "misses": self._misses,
+                "stores": self._stores,
+                "hit_ratio": (hits / lookups) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_max_entries": self._max_entries,
+                "disk_entries": disk_entries,
+            }
@@ -0,0 +1,350 @@
+"""
+Grouping of face embeddings into identities (DBSCAN over cosine similarity).
+
+Similarities are computed block by block as matrix products of L2-normalized
+embeddings, so memory stays bounded by CLUSTER_BLOCK_MB however many faces
+are clustered and the neighbour graph is never materialized. Two passes over
+the blocks give DBSCAN: the first counts neighbours to find core faces, the
+second joins neighbouring core faces with a vectorized union-find and attaches
+border faces to their most similar core face.
+
+Offline (from the insightface directory):
+    python -m app.clustering /data/faces --threshold 0.5 --output clusters.json
+    python -m app.clustering embeddings.npy ingest.ndjson --min-samples 3
+
+Inputs: a backfill output directory, .npy matrices, binary embedding responses
+(format=binary) and JSON/NDJSON responses of /detect, /embed or /ingest.
+"""
+import argparse
+import base64
+import io
+import json
+import logging
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+from . import config, encoding
+
+logger = logging.getLogger("face_service")
+
+NOISE = -1
+
+
+def _normalize(embeddings):
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+
+def _blocks(count: int, block_mb: int):
+    """Row ranges whose (rows, count) float32 similarity block fits in block_mb."""
+    rows = max(1, (block_mb * 1024 * 1024) // max(1, count * 4))
+    for start in range(0, count, rows):
+        yield start, min(start + rows, count)
+
+
+def _compress(parent):
+    """Point every node of the union-find forest directly at its root."""
+    while True:
+        grand = parent[parent]
+        if np.array_equal(grand, parent):
+            return
+        parent[:] = grand
+
+
+def _union(parent, a, b):
+    """Join the sets of every (a[i], b[i]) pair; roots always point to the smaller index."""
+    while len(a):
+        _compress(parent)
+        root_a, root_b = parent[a], parent[b]
+        differ = root_a != root_b
+        if not differ.any():
+            return
+        a, b, root_a, root_b = a[differ], b[differ], root_a[differ], root_b[differ]
+        np.minimum.at(parent, np.maximum(root_a, root_b), np.minimum(root_a, root_b))
+
+
+def cluster(embeddings, threshold: float = None, min_samples: int = None, block_mb: int = None):
+    """
+    Cluster face embeddings with DBSCAN on cosine similarity.
+
+    Args:
+        embeddings: array of shape (N, dim)
+        threshold: cosine similarity at which two faces are neighbours (default CLUSTER_THRESHOLD)
+        min_samples: neighbours (including the face itself) that make a core face (default CLUSTER_MIN_SAMPLES)
+        block_mb: memory for one similarity block (default CLUSTER_BLOCK_MB)
+
+    Returns:
+        array of N cluster labels, NOISE (-1) for faces that belong to no cluster;
+        labels are numbered by descending cluster size
+    """
+    threshold = config.CLUSTER_THRESHOLD if threshold is None else threshold
+    min_samples = config.CLUSTER_MIN_SAMPLES if min_samples is None else min_samples
+    block_mb = config.CLUSTER_BLOCK_MB if block_mb is None else block_mb
+
+    x = _normalize(embeddings)
+    count = len(x)
+    if count == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # Pass 1: neighbour counts
+    neighbours = np.zeros(count, dtype=np.int64)
+    for start, end in _blocks(count, block_mb):
+        neighbours[start:end] = np.count_nonzero(x[start:end] @ x.T >= threshold, axis=1)
+    core = neighbours >= min_samples
+
+    # Pass 2: connect core faces, attach border faces to their most similar core face
+    parent = np.arange(count)
+    border_of = np.full(count, -1, dtype=np.int64)
+    core_rows = np.flatnonzero(core)
+    core_x = x[core_rows]
+    for start, end in _blocks(count, block_mb):
+        similarity = x[start:end] @ core_x.T
+        linked = similarity >= threshold
+        rows, columns = np.nonzero(linked)
+        rows += start
+        is_core = core[rows]
+        _union(parent, rows[is_core], core_rows[columns[is_core]])
+
+        border = ~core[start:end] & linked.any(axis=1)
+        if border.any():
+            best = np.argmax(np.where(linked[border], similarity[border], -np.inf), axis=1)
+            border_of[start + np.flatnonzero(border)] = core_rows[best]
+
+    _compress(parent)
+    roots = np.full(count, -1, dtype=np.int64)
+    roots[core] = parent[core]
+    has_core = border_of >= 0
+    roots[has_core] = parent[border_of[has_core]]
+
+    # Relabel roots as 0..K-1 by descending cluster size
+    labels = np.full(count, NOISE, dtype=np.int64)
+    assigned = roots >= 0
+    if assigned.any():
+        unique, inverse, sizes = np.unique(roots[assigned], return_inverse=True, return_counts=True)
+        rank = np.empty(len(unique), dtype=np.int64)
+        rank[np.argsort(-sizes, kind="stable")] = np.arange(len(unique))
+        labels[assigned] = rank[inverse]
+    return labels
+
+
+def representatives(embeddings, labels, top_k: int = 3) -> list:
+    """
+    The faces closest to each cluster's mean embedding.
+
+    Args:
+        embeddings: array of shape (N, dim)
+        labels: labels from cluster()
+        top_k: faces returned per cluster
+
+    Returns:
+        list (one per cluster label 0..K-1) of {"label", "size", "representatives": [indices]}
+    """
+    x = _normalize(embeddings)
+    labels = np.asarray(labels)
+    members = np.flatnonzero(labels != NOISE)
+    if len(members) == 0:
+        return []
+
+    # Members grouped by cluster; labels are 0..K-1 without gaps
+    cluster_count = int(labels[members].max()) + 1
+    by_label = members[np.argsort(labels[members], kind="stable")]
+    sorted_labels = labels[by_label]
+    starts = np.searchsorted(sorted_labels, np.arange(cluster_count))
+    ends = np.searchsorted(sorted_labels, np.arange(cluster_count), side="right")
+
+    centroids = _normalize(np.add.reduceat(x[by_label], starts, axis=0))
+    score = np.einsum("ij,ij->i", x[by_label], centroids[sorted_labels])
+
+    # Within each cluster, most central face first
+    ranked = by_label[np.lexsort((-score, sorted_labels))]
+    return [
+        {
+            "label": label,
+            "size": int(ends[label] - starts[label]),
+            "representatives": ranked[starts[label]:min(ends[label], starts[label] + top_k)].tolist(),
+        }
+        for label in range(cluster_count)
+    ]
+
+
+def _decode_embedding(holder):
+    embedding = holder.get("embedding")
+    if embedding is None:
+        return None
+    if isinstance(embedding, str):
+        dtype = encoding.DTYPES[holder.get("embedding_dtype", "float32")]
+        return np.frombuffer(base64.b64decode(embedding), dtype=dtype).astype(np.float32)
+    return np.asarray(embedding, dtype=np.float32).reshape(-1)
+
+
+def _from_json_objects(objects, source: str):
+    """Embeddings and face references from /detect, /embed or /ingest results."""
+    vectors, refs = [], []
+    for obj in objects:
+        if "embeddings" in obj:
+            for embedding in obj["embeddings"]:
+                vectors.append(np.asarray(embedding, dtype=np.float32).reshape(-1))
+                refs.append({"source": source, "row": len(refs)})
+            continue
+
+        # Batch responses hold one result per file; /embed results carry the embedding themselves
+        for item in obj.get("results", [obj]):
+            for holder in item.get("faces", [item]):
+                embedding = _decode_embedding(holder)
+                if embedding is None:
+                    continue
+                ref = {"source": source}
+                ref.update({key: item[key] for key in ("filename", "index") if key in item})
+                if "id" in holder:
+                    ref.update(face=holder["id"], bbox=holder.get("bbox"))
+                vectors.append(embedding)
+                refs.append(ref)
+    return vectors, refs
+
+
+def load_embeddings(data: bytes, source: str = "upload"):
+    """
+    Read embeddings from a file produced by the service.
+
+    Accepts .npy matrices, binary embedding responses (format=binary) and JSON
+    or NDJSON results of /detect, /embed, /ingest (json or base64 embeddings),
+    or {"embeddings": [[...], ...]}.
+
+    Args:
+        data: file content
+        source: name used in face references
+
+    Returns:
+        (array of shape (N, dim), list of N face references)
+
+    Raises:
+        ValueError: if no embeddings could be read
+    """
+    if data.startswith(b"\x93NUMPY"):
+        matrix = np.load(io.BytesIO(data), allow_pickle=False)
+        matrix = np.asarray(matrix, dtype=np.float32).reshape(len(matrix), -1)
+        valid = ~np.isnan(matrix).any(axis=1)
+        return matrix[valid], [{"source": source, "row": int(row)} for row in np.flatnonzero(valid)]
+
+    if data.startswith(encoding.BINARY_MAGIC):
+        matrix, status = encoding.parse_binary(data)
+        rows = np.flatnonzero(status)
+        return matrix[rows].astype(np.float32), [{"source": source, "row": int(row)} for row in rows]
+
+    text = data.decode("utf-8")
+    try:
+        objects = [json.loads(text)]
+    except json.JSONDecodeError:
+        objects = [json.loads(line) for line in text.splitlines() if line.strip()]
+    vectors, refs = _from_json_objects(objects, source)
+    if not vectors:
+        raise ValueError(f"No embeddings found in {source}")
+    return np.stack(vectors), refs
+
+
+def load_backfill(output: str):
+    """
+    Embeddings of every face in a backfill output directory.
+
+    Returns:
+        (array of shape (N, dim), list of N references with path, shard and row)
+    """
+    from .backfill import load_shard
+
+    db = sqlite3.connect(f"file:{os.path.join(output, 'index.sqlite')}?mode=ro", uri=True)
+    try:
+        rows = db.execute(
+            "SELECT p.shard, p.face_offset, p.face_count, MIN(f.path) FROM photos p JOIN files f ON f.sha256 = p.sha256 "
+            "WHERE p.face_count > 0 GROUP BY p.sha256 ORDER BY p.shard, p.face_offset"
+        ).fetchall()
+    finally:
+        db.close()
+
+    blocks, refs = [], []
+    shards = {}
+    for shard, offset, face_count, path in rows:
+        if shard not in shards:
+            shards[shard] = load_shard(output, shard)
+        if "embedding" not in shards[shard]:
+            raise ValueError(f"{output} was processed without the rec stage")
+        embeddings = shards[shard]["embedding"][offset:offset + face_count]
+        valid = ~np.isnan(embeddings).any(axis=1)
+        blocks.append(np.asarray(embeddings[valid], dtype=np.float32))
+        refs.extend({"path": path, "shard": shard, "row": offset + int(row)} for row in np.flatnonzero(valid))
+    if not refs:
+        raise ValueError(f"No embeddings found in {output}")
+    return np.concatenate(blocks), refs
+
+
+def cluster_embeddings(data: bytes, filename: str, threshold: float = None, min_samples: int = None, top_k: int = 3):
+    """
+    Cluster the embeddings of an uploaded file (runs on the inference executor).
+
+    Returns:
+        dict with per-face labels and references, the clusters with their
+        representative faces and the number of unclustered faces, or {"error": ...}
+    """
+    try:
+        embeddings, refs = load_embeddings(data, filename)
+    except (ValueError, UnicodeDecodeError) as e:
+        return {"error": f"Failed to read embeddings: {str(e)}"}
+    return _clustering_result(embeddings, refs, threshold, min_samples, top_k)
+
+
+def _clustering_result(embeddings, refs, threshold, min_samples, top_k):
+    started = time.perf_counter()
+    labels = cluster(embeddings, threshold, min_samples)
+    clusters = representatives(embeddings, labels, top_k)
+    logger.info(
+        f"Clustered {len(labels)} face(s) into {len(clusters)} cluster(s) in {time.perf_counter() - started:.1f}s"
+    )
+    return {
+        "faces": [dict(ref, label=int(label)) for ref, label in zip(refs, labels)],
+        "clusters": [
+            dict(item, representatives=[dict(refs[index], index=index) for index in item["representatives"]])
+            for item in clusters
+        ],
+        "noise": int(np.count_nonzero(labels == NOISE)),
+        "threshold": config.CLUSTER_THRESHOLD if threshold is None else threshold,
+        "min_samples": config.CLUSTER_MIN_SAMPLES if min_samples is None else min_samples,
+    }
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="+", help="backfill output directories or embedding files")
+    parser.add_argument("--threshold", type=float, default=None, help=f"cosine similarity of neighbours (default {config.CLUSTER_THRESHOLD})")
+    parser.add_argument("--min-samples", type=int, default=None, help=f"neighbours of a core face (default {config.CLUSTER_MIN_SAMPLES})")
+    parser.add_argument("--top-k", type=int, default=3, help="representative faces per cluster")
+    parser.add_argument("--output", default=None, help="write the result as JSON to this file")
+    args = parser.parse_args()
+
+    matrices, refs = [], []
+    for path in args.inputs:
+        if os.path.isdir(path):
+            embeddings, input_refs = load_backfill(path)
+        else:
+            with open(path, "rb") as f:
+                embeddings, input_refs = load_embeddings(f.read(), path)
+        matrices.append(embeddings)
+        refs.extend(input_refs)
+        logger.info(f"{path}: {len(input_refs)} embedding(s)")
+
+    result = _clustering_result(np.concatenate(matrices), refs, args.threshold, args.min_samples, args.top_k)
+    print(f"{len(refs)} face(s), {len(result['clusters'])} cluster(s), {result['noise']} unclustered")
+    for item in result["clusters"][:10]:
+        print(f"  cluster {item['label']}: {item['size']} face(s)")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False)
+        print(f"Result written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import os
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    """Read a boolean setting (1/true/yes/on) from the environment."""
+    value = os.environ.get(name)
+    if value is None or value.strip() == "":
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env_int(name: str, default: int) -> int:
+    """Read an integer setting from the environment, falling back to default."""
+    value = os.environ.get(name)
+    if value is None or value.strip() == "":
+        return default
+    return int(value)
+
+
+_CPU_COUNT = os.cpu_count() or 1
+
+# Number of threads that run decode, inference and JSON serialization
+# outside of the event loop
+INFERENCE_WORKERS = _env_int("INFERENCE_WORKERS", _CPU_COUNT)
+
+# Pre-forked inference processes. 0 keeps everything in the uvicorn process
+# (thread pool only); N > 0 forks N workers after loading shared state, and the
+# uvicorn process only parses HTTP and dispatches work to them.
+INFERENCE_PROCESSES = max(0, _env_int("INFERENCE_PROCESSES", 0))
+
+# ONNX Runtime intra-op threads per session (0 = ONNX Runtime default, all cores).
+# In multi-process mode the default splits the cores between the workers so that
+# INFERENCE_PROCESSES x ORT_INTRA_OP_THREADS does not oversubscribe the CPU.
+ORT_INTRA_OP_THREADS = _env_int(
+    "ORT_INTRA_OP_THREADS",
+    max(1, _CPU_COUNT // INFERENCE_PROCESSES) if INFERENCE_PROCESSES > 0 else 0
+)
+
+# ONNX Runtime session profile applied to every model (see ort_profile.py).
+# ORT_PROFILE points to a YAML file whose settings override these variables,
+# globally and per model (generate one with `python -m app.ort_profile sweep`).
+ORT_INTER_OP_THREADS = _env_int("ORT_INTER_OP_THREADS", 0)
+ORT_EXECUTION_MODE = os.environ.get("ORT_EXECUTION_MODE", "sequential").strip().lower()
+ORT_GRAPH_OPTIMIZATION = os.environ.get("ORT_GRAPH_OPTIMIZATION", "all").strip().lower()
+ORT_CPU_MEM_ARENA = _env_bool("ORT_CPU_MEM_ARENA", True)
+ORT_MEM_PATTERN = _env_bool("ORT_MEM_PATTERN", True)
+ORT_PROFILE = os.environ.get("ORT_PROFILE", "")
+
+# Optimized graphs are saved here on first load and reused on later starts
+# instead of optimizing every model again ("" disables)
+ORT_OPTIMIZED_MODEL_DIR = os.path.expanduser(os.environ.get("ORT_OPTIMIZED_MODEL_DIR", "~/.insightface/optimized"))
+
+# Model precision on CPU: fp32 (default) or int8. With int8, models that have a
+# quantized variant in QUANTIZED_MODEL_DIR (built by `python -m app.quantize build`)
+# are loaded in place of the FP32 files; the others stay FP32.
+MODEL_PRECISION = os.environ.get("MODEL_PRECISION", "fp32").strip().lower()
+QUANTIZED_MODEL_DIR = os.path.expanduser(os.environ.get("QUANTIZED_MODEL_DIR", "~/.insightface/int8"))
+
+# Emotion model runtime: onnx (exported with `python -m app.emotion_onnx export`),
+# torch (hsemotion) or auto (onnx when the exported file exists, torch otherwise)
+EMOTION_BACKEND = os.environ.get("EMOTION_BACKEND", "auto").strip().lower()
+EMOTION_MODEL_DIR = os.path.expanduser(os.environ.get("EMOTION_MODEL_DIR", "~/.insightface/emotion"))
+
+# Number of threads that decode the files of a batch request in parallel
+DECODE_WORKERS = _env_int("DECODE_WORKERS", _CPU_COUNT)
+
+# How many inference calls may run concurrently against a single model.
+# Can be overridden per model with MODEL_CONCURRENCY_<NAME>, e.g. MODEL_CONCURRENCY_EMOTION=1
+MODEL_CONCURRENCY = _env_int("MODEL_CONCURRENCY", INFERENCE_WORKERS)
+
+# Defaults for models that should not be driven by many threads at once
+# (the torch emotion model uses its own intra-op thread pool)
+_MODEL_CONCURRENCY_DEFAULTS = {
+    "emotion": 1,
+}
+
+
+def model_concurrency(name: str) -> int:
+    """
+    Resolve the concurrency limit for a model.
+
+    Args:
+        name: model name (detection, landmark, genderage, recognition, emotion)
+
+    Returns:
+        maximum number of simultaneous calls allowed for the model
+    """
+    default = _MODEL_CONCURRENCY_DEFAULTS.get(name, MODEL_CONCURRENCY)
+    return max(1, _env_int(f"MODEL_CONCURRENCY_{name.upper()}", default))
+
+# Maximum number of face crops sent to the emotion model in one forward pass
+EMOTION_BATCH_SIZE = max(1, _env_int("EMOTION_BATCH_SIZE", 32))
+
+# Cross-request micro-batching for ArcFace embeddings.
+# A batch is flushed when it reaches EMBED_BATCH_MAX_SIZE faces or when the
+# oldest face has waited EMBED_BATCH_MAX_WAIT_MS. Set EMBED_BATCH_MAX_SIZE=1 to disable.
+EMBED_BATCH_MAX_SIZE = _env_int("EMBED_BATCH_MAX_SIZE", 32)
+EMBED_BATCH_MAX_WAIT_MS = float(os.environ.get("EMBED_BATCH_MAX_WAIT_MS", "5"))
+
+# Reduced-resolution decode for detection: large JPEGs are decoded at 1/2, 1/4
+# or 1/8 scale as long as the long side stays >= DECODE_TARGET_SIZE (0 disables).
+# If a detected face is smaller than DECODE_MIN_FACE_SIZE pixels in the reduced
+# image, the regions around the faces are cut from a finer decode (the coarsest
+# reduction that makes every face large enough) for the face models.
+DECODE_TARGET_SIZE = _env_int("DECODE_TARGET_SIZE", 1280)
+DECODE_MIN_FACE_SIZE = _env_int("DECODE_MIN_FACE_SIZE", 112)
+
+# Detector input size. "auto" fits the input to each image (aspect ratio kept,
+# long side between DETECTION_MIN_SIZE and 640) and adds an overlapping tile pass
+# when the first pass finds faces smaller than DETECTION_TILE_FACE_SIZE pixels at
+# detector scale or at least DETECTION_TILE_CROWD faces. "fixed" always runs one
+# 640x640 pass. /detect can override the mode per request with det_size.
+# DETECTION_MAX_PIXELS caps the detector input pixels spent on one image.
+DETECTION_MODE = os.environ.get("DETECTION_MODE", "auto").strip().lower()
+DETECTION_MIN_SIZE = _env_int("DETECTION_MIN_SIZE", 320)
+DETECTION_TILE_FACE_SIZE = _env_int("DETECTION_TILE_FACE_SIZE", 24)
+DETECTION_TILE_CROWD = _env_int("DETECTION_TILE_CROWD", 20)
+DETECTION_TILE_OVERLAP = float(os.environ.get("DETECTION_TILE_OVERLAP", "0.25"))
+DETECTION_MAX_PIXELS = _env_int("DETECTION_MAX_PIXELS", 8 * 640 * 640)
+
+# Content-addressed result cache. The memory tier is an LRU of CACHE_MAX_ENTRIES
+# results; CACHE_PATH enables a SQLite tier that survives restarts.
+CACHE_ENABLED = _env_bool("CACHE_ENABLED", True)
+CACHE_MAX_ENTRIES = _env_int("CACHE_MAX_ENTRIES", 10000)
+CACHE_PATH = os.environ.get("CACHE_PATH", "")
+CACHE_DISK_MAX_ENTRIES = _env_int("CACHE_DISK_MAX_ENTRIES", 1000000)
+
+# Prometheus metrics at /metrics (needs prometheus_client). SERVER_TIMING adds a
+# Server-Timing header with the per-stage durations to every inference response.
+METRICS_ENABLED = _env_bool("METRICS_ENABLED", True)
+SERVER_TIMING = _env_bool("SERVER_TIMING", False)
+
+# Models loaded and run once with a dummy batch in the background at startup.
+# /ready reports 200 only after all of them are warm. Models not listed here are
+# loaded on first use; emotion is left out by default because its torch backend
+# imports torch at startup (add it once the ONNX emotion model is exported).
+WARMUP_MODELS = tuple(
+    name.strip()
+    for name in os.environ.get("WARMUP_MODELS", "detection,genderage,recognition").split(",")
+    if name.strip()
+)
+
+# Face gallery for /register, /recognize and identification in /detect.
+# GALLERY_PATH is a directory with memory-mapped embedding files shared by all
+# inference processes ("" keeps the gallery in memory only, lost on restart).
+GALLERY_PATH = os.path.expanduser(os.environ.get("GALLERY_PATH", "~/.insightface/gallery"))
+GALLERY_DTYPE = os.environ.get("GALLERY_DTYPE", "float32").strip().lower()
+GALLERY_TOP_K = max(1, _env_int("GALLERY_TOP_K", 5))
+GALLERY_MATCH_THRESHOLD = float(os.environ.get("GALLERY_MATCH_THRESHOLD", "0.4"))
+
+# Streaming ingestion (/ingest). Up to INGEST_CONCURRENCY images are in inference
+# at once and INGEST_QUEUE_SIZE more wait parsed in memory; when both are full
+# the upload is no longer read, so a slow client pauses ingestion. Zip archives
+# must be read to the end before the first member is available and are spooled
+# to a temporary file (in memory up to INGEST_SPOOL_MEMORY bytes).
+INGEST_CONCURRENCY = max(1, _env_int("INGEST_CONCURRENCY", 2 * (INFERENCE_PROCESSES or INFERENCE_WORKERS)))
+INGEST_QUEUE_SIZE = max(1, _env_int("INGEST_QUEUE_SIZE", 8))
+INGEST_MAX_FILE_SIZE = _env_int("INGEST_MAX_FILE_SIZE", 64 * 1024 * 1024)
+INGEST_SPOOL_MEMORY = _env_int("INGEST_SPOOL_MEMORY", 64 * 1024 * 1024)
+
+# Face clustering (/cluster, python -m app.clustering). Two faces are neighbours
+# at CLUSTER_THRESHOLD cosine similarity; a face with CLUSTER_MIN_SAMPLES
+# neighbours (itself included) seeds a cluster. Similarities are computed in
+# blocks of at most CLUSTER_BLOCK_MB megabytes.
+CLUSTER_THRESHOLD = float(os.environ.get("CLUSTER_THRESHOLD", "0.5"))
+CLUSTER_MIN_SAMPLES = max(1, _env_int("CLUSTER_MIN_SAMPLES", 2))
+CLUSTER_BLOCK_MB = max(1, _env_int("CLUSTER_BLOCK_MB", 256))
+
+# Admission control. At most ADMISSION_CONCURRENCY inference requests run at once
+# (default: one per inference thread or process); up to ADMISSION_QUEUE_DEPTH more
+# wait, interactive requests ahead of background ones (batch endpoints, /cluster,
+# /ingest photos). When the queue is full new requests get 503, and background
+# requests beyond ADMISSION_BACKGROUND_QUEUE_DEPTH get 429, both with Retry-After.
+# DEFAULT_DEADLINE_MS applies to requests without a deadline of their own (0: none).
+ADMISSION_CONCURRENCY = max(1, _env_int("ADMISSION_CONCURRENCY", INFERENCE_PROCESSES or INFERENCE_WORKERS))
+ADMISSION_QUEUE_DEPTH = max(0, _env_int("ADMISSION_QUEUE_DEPTH", 4 * ADMISSION_CONCURRENCY))
+ADMISSION_BACKGROUND_QUEUE_DEPTH = max(0, _env_int("ADMISSION_BACKGROUND_QUEUE_DEPTH", ADMISSION_QUEUE_DEPTH // 2))
+DEFAULT_DEADLINE_MS = max(0, _env_int("DEFAULT_DEADLINE_MS", 0))
@@ -0,0 +1,170 @@
+import io
+import logging
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from . import config
+
+logger = logging.getLogger("face_service")
+
+# JPEG can be decoded directly at 1/2, 1/4 or 1/8 scale (DCT-domain scaling),
+# which avoids materializing the full-resolution array at all
+_REDUCED_FLAGS = {
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+def decode_image(img_bytes):
+    """
+    Decode image bytes into a BGR numpy array at full resolution.
+
+    Args:
+        img_bytes: encoded image (JPEG, PNG, ...)
+
+    Returns:
+        numpy array, or None if the bytes are not a valid image
+    """
+    np_arr = np.frombuffer(img_bytes, np.uint8)
+    return cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+
+
+def read_image_header(img_bytes):
+    """
+    Read the format and dimensions of an image without decoding the pixels.
+
+    Args:
+        img_bytes: encoded image
+
+    Returns:
+        (format, (width, height)) tuple, or (None, None) if the header cannot be parsed
+    """
+    try:
+        with Image.open(io.BytesIO(img_bytes)) as header:
+            return header.format, header.size
+    except Exception:
+        return None, None
+
+
+def plan_reduction(width, height, image_format, target_size):
+    """
+    Choose the largest decode reduction that keeps the image at least target_size on its long side.
+
+    Args:
+        width, height: original image dimensions
+        image_format: PIL format name; only JPEG supports reduced decoding without a full decode
+        target_size: minimum long side after reduction (0 disables reduction)
+
+    Returns:
+        reduction factor: 1, 2, 4 or 8
+    """
+    if image_format != "JPEG" or target_size <= 0:
+        return 1
+
+    long_side = max(width, height)
+    for factor in (8, 4, 2):
+        if long_side / factor >= target_size:
+            return factor
+    return 1
+
+
+class DecodedImage:
+    """
+    A decoded image together with the mapping back to original pixel coordinates.
+
+    Coordinates measured on `image` are multiplied by (scale_x, scale_y) to get
+    coordinates in the original photo.
+    """
+
+    def __init__(self, data, image, scale_x: float = 1.0, scale_y: float = 1.0):
+        self.data = data
+        self.image = image
+        self.scale_x = scale_x
+        self.scale_y = scale_y
+
+    @property
+    def reduced(self) -> bool:
+        return self.scale_x != 1.0 or self.scale_y != 1.0
+
+    @property
+    def original_size(self):
+        """(width, height) of the original photo."""
+        height, width = self.image.shape[:2]
+        return int(round(width * self.scale_x)), int(round(height * self.scale_y))
+
+    @property
+    def factor(self) -> int:
+        """Reduction factor of this decode: 1 (full resolution), 2, 4 or 8."""
+        return int(round(max(self.scale_x, self.scale_y)))
+
+    def redecode(self, factor: int):
+        """
+        Decode the original bytes again at another reduction factor.
+
+        Args:
+            factor: 1 (full resolution), 2, 4 or 8
+
+        Returns:
+            DecodedImage, or None if the decode fails
+        """
+        if factor == self.factor:
+            return self
+        if factor == 1:
+            image = decode_image(self.data)
+            return DecodedImage(self.data, image) if image is not None else None
+
+        image = _decode_reduced(self.data, factor)
+        if image is None:
+            return None
+        width, height = self.original_size
+        decoded_height, decoded_width = image.shape[:2]
+        return DecodedImage(self.data, image, width / decoded_width, height / decoded_height)
+
+
+def _decode_reduced(img_bytes, factor):
+    np_arr = np.frombuffer(img_bytes, np.uint8)
+    return cv2.imdecode(np_arr, _REDUCED_FLAGS[factor])
+
+
+def decode_for_detection(img_bytes, target_size=None):
+    """
+    Decode an image at a resolution close to what the detector needs.
+
+    Large JPEGs are decoded with IMREAD_REDUCED_COLOR_{2,4,8} so that a 24-50 MP
+    photo never becomes a full-size array when the detector downscales it to
+    640x640 anyway. Other formats, and images that are already small, are
+    decoded at full resolution.
+
+    Args:
+        img_bytes: encoded image
+        target_size: minimum long side of the decoded image (default: config.DECODE_TARGET_SIZE)
+
+    Returns:
+        DecodedImage, or None if the bytes are not a valid image
+    """
+    if target_size is None:
+        target_size = config.DECODE_TARGET_SIZE
+
+    image_format, size = read_image_header(img_bytes)
+    factor = plan_reduction(size[0], size[1], image_format, target_size) if size else 1
+
+    if factor == 1:
+        image = decode_image(img_bytes)
+        return DecodedImage(img_bytes, image) if image is not None else None
+
+    image = _decode_reduced(img_bytes, factor)
+    if image is None:
+        return None
+
+    # imdecode applies EXIF orientation, so the decoded image may be rotated
+    # relative to the header dimensions
+    width, height = size
+    decoded_height, decoded_width = image.shape[:2]
+    if (decoded_width >= decoded_height) != (width >= height):
+        width, height = height, width
+
+    logger.info(f"Reduced decode 1/{factor}: {width}x{height} -> {decoded_width}x{decoded_height}")
+    return DecodedImage(img_bytes, image, width / decoded_width, height / decoded_height)
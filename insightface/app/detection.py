@@ -0,0 +1,196 @@
+"""
+Detector input sizing: adaptive single pass and overlapping tiles.
+
+RetinaFace resizes every image into its input box, so a fixed 640x640 input
+spends the same compute on a 300 px crop as on a group photo, and shrinks the
+faces of a large group photo until they are missed. Here the input box follows
+the image (aspect ratio kept, multiples of the 32 px stride), and images whose
+first pass finds small or many faces get a second pass over overlapping tiles
+detected near 1:1 scale, merged with NMS. A pixel budget bounds the total cost.
+"""
+import math
+
+import numpy as np
+
+from . import config
+from .models import DETECTION_SIZE
+
+MODE_AUTO = "auto"
+MODE_FIXED = "fixed"
+MODE_TILED = "tiled"  # always add the tile pass when the image is downscaled
+MODES = (MODE_AUTO, MODE_FIXED, MODE_TILED)
+
+_STRIDE = 32
+_MIN_FIXED_SIZE = 128
+_MAX_FIXED_SIZE = 2048
+
+# Tiles only pay off when the global pass shrinks the image noticeably
+_MIN_TILE_DOWNSCALE = 1.5
+
+# Detections closer than this to an inner tile edge are cut faces; the
+# neighbouring tile sees them whole thanks to the overlap
+_EDGE_MARGIN = 2
+
+
+def resolve_mode(det_size=None) -> str:
+    """
+    Validate the detection mode of a request.
+
+    Args:
+        det_size: "auto", "fixed", "tiled", a square input size such as "320", or None for DETECTION_MODE
+
+    Returns:
+        normalized mode string
+
+    Raises:
+        ValueError: if the mode or size is not supported
+    """
+    mode = (det_size if det_size is not None and det_size.strip() else config.DETECTION_MODE).strip().lower()
+    if mode in MODES:
+        return mode
+    if mode.isdigit():
+        size = int(mode)
+        if size % _STRIDE or not _MIN_FIXED_SIZE <= size <= _MAX_FIXED_SIZE:
+            raise ValueError(f"det_size must be a multiple of {_STRIDE} between {_MIN_FIXED_SIZE} and {_MAX_FIXED_SIZE}")
+        return str(size)
+    raise ValueError(f"Unknown det_size '{mode}'. Allowed: {', '.join(MODES)} or a size such as 320")
+
+
+def adaptive_input_size(width: int, height: int, max_size: int = DETECTION_SIZE[0]):
+    """
+    Smallest stride-aligned detector input that holds the image at up to max_size on its long side.
+
+    Returns:
+        (input width, input height)
+    """
+    long_side = max(width, height)
+    target = min(max_size, max(config.DETECTION_MIN_SIZE, long_side))
+    scale = target / long_side
+    return (
+        max(_STRIDE, math.ceil(width * scale / _STRIDE) * _STRIDE),
+        max(_STRIDE, math.ceil(height * scale / _STRIDE) * _STRIDE),
+    )
+
+
+def _positions(length: int, region: int, step: int):
+    if length <= region:
+        return [0]
+    positions = list(range(0, length - region, step))
+    positions.append(length - region)
+    return positions
+
+
+def plan_tiles(width: int, height: int, budget: int, tile: int = DETECTION_SIZE[0], overlap: float = None):
+    """
+    Overlapping square regions covering the image, each detected at a tile x tile input.
+
+    Regions start at tile size (detection at 1:1) and grow until the number of
+    tiles fits the pixel budget.
+
+    Args:
+        width, height: image size
+        budget: detector input pixels available for the tiles
+        tile: detector input size of one tile
+        overlap: fraction of a region shared with its neighbour (default DETECTION_TILE_OVERLAP)
+
+    Returns:
+        list of (x0, y0, x1, y1) regions, empty when tiling would not beat the global pass
+    """
+    if overlap is None:
+        overlap = config.DETECTION_TILE_OVERLAP
+    overlap = min(max(overlap, 0.0), 0.5)
+
+    region = tile
+    while region < max(width, height):
+        step = max(1, int(region * (1 - overlap)))
+        xs, ys = _positions(width, region, step), _positions(height, region, step)
+        if len(xs) * len(ys) * tile * tile <= budget:
+            return [(x, y, min(x + region, width), min(y + region, height)) for y in ys for x in xs]
+        region = int(region * 1.25)
+    return []
+
+
+def _needs_tiles(bboxes, scale: float) -> bool:
+    """Whether the global pass suggests faces were lost to downscaling."""
+    if len(bboxes) >= config.DETECTION_TILE_CROWD:
+        return True
+    sides = np.minimum(bboxes[:, 2] - bboxes[:, 0], bboxes[:, 3] - bboxes[:, 1]) * scale
+    return bool(len(sides)) and float(sides.min()) < config.DETECTION_TILE_FACE_SIZE
+
+
+def _detect_tiles(model, img, regions):
+    height, width = img.shape[:2]
+    all_bboxes, all_kpss = [], []
+    for x0, y0, x1, y1 in regions:
+        bboxes, kpss = model.detect(
+            img[y0:y1, x0:x1], input_size=adaptive_input_size(x1 - x0, y1 - y0), max_num=0, metric='default'
+        )
+        if len(bboxes) == 0:
+            continue
+
+        # Drop faces cut by an inner tile edge
+        keep = np.ones(len(bboxes), dtype=bool)
+        if x0 > 0:
+            keep &= bboxes[:, 0] > _EDGE_MARGIN
+        if y0 > 0:
+            keep &= bboxes[:, 1] > _EDGE_MARGIN
+        if x1 < width:
+            keep &= bboxes[:, 2] < x1 - x0 - _EDGE_MARGIN
+        if y1 < height:
+            keep &= bboxes[:, 3] < y1 - y0 - _EDGE_MARGIN
+
+        bboxes = bboxes[keep].copy()
+        bboxes[:, [0, 2]] += x0
+        bboxes[:, [1, 3]] += y0
+        all_bboxes.append(bboxes)
+        if kpss is not None:
+            kpss = kpss[keep].copy()
+            kpss += np.array([x0, y0], dtype=kpss.dtype)
+            all_kpss.append(kpss)
+    return all_bboxes, all_kpss
+
+
+def detect(model, img, mode: str = None):
+    """
+    Run the detector on an image according to a detection mode.
+
+    Args:
+        model: insightface RetinaFace
+        img: numpy array (BGR)
+        mode: value from resolve_mode (default DETECTION_MODE)
+
+    Returns:
+        (bboxes of shape (N, 5) with scores, keypoints of shape (N, 5, 2) or None), in image coordinates
+    """
+    mode = mode or config.DETECTION_MODE
+    if mode == MODE_FIXED:
+        return model.detect(img, input_size=DETECTION_SIZE, max_num=0, metric='default')
+    if mode.isdigit():
+        return model.detect(img, input_size=(int(mode), int(mode)), max_num=0, metric='default')
+
+    height, width = img.shape[:2]
+    input_size = adaptive_input_size(width, height)
+    bboxes, kpss = model.detect(img, input_size=input_size, max_num=0, metric='default')
+
+    scale = max(input_size) / max(width, height)
+    if scale > 1 / _MIN_TILE_DOWNSCALE or (mode != MODE_TILED and not _needs_tiles(bboxes, scale)):
+        return bboxes, kpss
+
+    regions = plan_tiles(width, height, config.DETECTION_MAX_PIXELS - input_size[0] * input_size[1])
+    if not regions:
+        return bboxes, kpss
+
+    tile_bboxes, tile_kpss = _detect_tiles(model, img, regions)
+    bboxes = np.concatenate([bboxes] + tile_bboxes, axis=0)
+    if kpss is not None:
+        kpss = np.concatenate([kpss] + tile_kpss, axis=0)
+    if len(bboxes) == 0:
+        return bboxes, kpss
+
+    # Faces seen by the global pass and one or more tiles are merged here
+    keep = model.nms(bboxes)
+    return bboxes[keep], kpss[keep] if kpss is not None else None
+
+
+# Fail at startup rather than on the first request when DETECTION_MODE is invalid
+resolve_mode(None)
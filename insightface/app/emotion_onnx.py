@@ -0,0 +1,164 @@
+"""
+ONNX version of the HSEmotion EfficientNet emotion model.
+
+The torch model is exported once; at run time the ONNX model runs on the same
+onnxruntime providers and session profile as the face models, without importing
+torch, timm or hsemotion.
+
+Export (needs the torch dependencies, from the insightface directory):
+    python -m app.emotion_onnx export
+    python -m app.emotion_onnx export --verify crops/
+"""
+import argparse
+import logging
+import os
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger("face_service")
+
+# Same preprocessing as HSEmotionRecognizer for the B0 models: 224x224 bilinear
+# resize, then ImageNet normalization
+INPUT_SIZE = 224
+IMAGENET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+IMAGENET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+# Class order of the 8-class HSEmotion models
+IDX_TO_CLASS = ['Anger', 'Contempt', 'Disgust', 'Fear', 'Happiness', 'Neutral', 'Sadness', 'Surprise']
+
+OPSET = 17
+
+
+def preprocess(face_img_list):
+    """
+    Turn RGB face crops into the NCHW float32 model input.
+
+    Args:
+        face_img_list: list of numpy arrays (RGB, any size)
+
+    Returns:
+        numpy array of shape (N, 3, 224, 224)
+    """
+    batch = np.empty((len(face_img_list), INPUT_SIZE, INPUT_SIZE, 3), dtype=np.float32)
+    for index, face_img in enumerate(face_img_list):
+        resized = Image.fromarray(face_img).resize((INPUT_SIZE, INPUT_SIZE), Image.BILINEAR)
+        batch[index] = np.asarray(resized, dtype=np.float32)
+    batch = (batch / 255.0 - IMAGENET_MEAN) / IMAGENET_STD
+    return np.ascontiguousarray(batch.transpose(0, 3, 1, 2))
+
+
+def softmax(x):
+    e_x = np.exp(x - np.max(x, axis=1, keepdims=True))
+    return e_x / e_x.sum(axis=1, keepdims=True)
+
+
+class OnnxEmotionRecognizer:
+    """Drop-in replacement for HSEmotionRecognizer backed by an onnxruntime session."""
+
+    def __init__(self, session):
+        self.session = session
+        self.input_name = session.get_inputs()[0].name
+
+    def predict_multi_emotions(self, face_img_list, logits=True):
+        """
+        Predict emotions for a batch of faces, same contract as HSEmotionRecognizer.
+
+        Args:
+            face_img_list: list of RGB face crops
+            logits: return raw logits instead of softmax probabilities
+
+        Returns:
+            (list of emotion names, (N, 8) score array)
+        """
+        scores = self.session.run(None, {self.input_name: preprocess(face_img_list)})[0]
+        preds = np.argmax(scores, axis=1)
+        if not logits:
+            scores = softmax(scores)
+        return [IDX_TO_CLASS[pred] for pred in preds], scores
+
+
+def export(model_name: str, path: str):
+    """
+    Export an HSEmotion torch model (backbone plus classifier) to ONNX with a dynamic batch axis.
+
+    Args:
+        model_name: HSEmotion model name, e.g. "enet_b0_8_best_afew"
+        path: output .onnx file
+    """
+    import torch
+
+    from . import emotion_patch  # noqa: F401 - allows torch.load of the timm EfficientNet
+    from hsemotion.facial_emotions import HSEmotionRecognizer
+
+    recognizer = HSEmotionRecognizer(model_name=model_name)
+
+    # HSEmotionRecognizer strips the classifier and applies it in numpy; put it back
+    # into the graph so the ONNX model outputs logits directly
+    classifier = torch.nn.Linear(recognizer.classifier_weights.shape[1], recognizer.classifier_weights.shape[0])
+    classifier.weight.data = torch.from_numpy(np.asarray(recognizer.classifier_weights, dtype=np.float32))
+    classifier.bias.data = torch.from_numpy(np.asarray(recognizer.classifier_bias, dtype=np.float32))
+    model = torch.nn.Sequential(recognizer.model, classifier).eval()
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    dummy = torch.zeros(1, 3, INPUT_SIZE, INPUT_SIZE)
+    with torch.no_grad():
+        torch.onnx.export(
+            model, dummy, path,
+            input_names=["input"],
+            output_names=["logits"],
+            dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}},
+            opset_version=OPSET,
+        )
+    logger.info(f"Exported {model_name} to {path}")
+    return recognizer
+
+
+def verify(recognizer, onnx_path: str, faces_rgb):
+    """
+    Compare torch and ONNX predictions on the same faces.
+
+    Returns:
+        (max absolute probability difference, fraction of matching labels)
+    """
+    import onnxruntime as ort
+
+    onnx_model = OnnxEmotionRecognizer(ort.InferenceSession(onnx_path, providers=["CPUExecutionProvider"]))
+    torch_labels, torch_scores = recognizer.predict_multi_emotions(faces_rgb, logits=False)
+    onnx_labels, onnx_scores = onnx_model.predict_multi_emotions(faces_rgb, logits=False)
+    agreement = float(np.mean([a == b for a, b in zip(torch_labels, onnx_labels)]))
+    return float(np.max(np.abs(torch_scores - onnx_scores))), agreement
+
+
+def main():
+    from .models import EMOTION, EMOTION_MODEL_NAME, registry
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="export the torch emotion model to ONNX")
+    export_parser.add_argument("--output", default=None, help="output file (default: the path the service loads)")
+    export_parser.add_argument("--verify", default=None, help="folder of face crops to compare torch and ONNX outputs on")
+    args = parser.parse_args()
+
+    path = args.output or registry.source_model_file(EMOTION)
+    recognizer = export(EMOTION_MODEL_NAME, path)
+    print(f"Exported {EMOTION_MODEL_NAME} to {path}")
+
+    if args.verify:
+        import cv2
+
+        from .quantize import list_images, load_images
+
+        faces_rgb = [cv2.cvtColor(img, cv2.COLOR_BGR2RGB) for img in load_images(list_images(args.verify))]
+        if not faces_rgb:
+            raise SystemExit(f"No images found in {args.verify}")
+        max_diff, agreement = verify(recognizer, path, faces_rgb)
+        print(f"{len(faces_rgb)} face(s): max probability difference {max_diff:.5f}, label agreement {agreement:.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+import base64
+import json
+import struct
+from dataclasses import dataclass
+
+import numpy as np
+from fastapi.responses import JSONResponse, Response
+
+try:
+    import msgpack
+except ImportError:  # optional dependency, only needed for format=msgpack
+    msgpack = None
+
+# Response formats for embeddings
+FORMAT_JSON = "json"        # embeddings as JSON float arrays (default, backwards compatible)
+FORMAT_BASE64 = "base64"    # embeddings as base64 of little-endian float bytes inside JSON
+FORMAT_MSGPACK = "msgpack"  # whole response as msgpack, embeddings as raw bytes
+FORMAT_BINARY = "binary"    # application/octet-stream: header + embedding matrix only
+FORMATS = (FORMAT_JSON, FORMAT_BASE64, FORMAT_MSGPACK, FORMAT_BINARY)
+
+# Formats that fit into a line of NDJSON (/ingest)
+LINE_FORMATS = (FORMAT_JSON, FORMAT_BASE64)
+
+DTYPES = {
+    "float32": np.dtype("<f4"),
+    "float16": np.dtype("<f2"),
+}
+
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+BINARY_MEDIA_TYPE = "application/octet-stream"
+BASE64_MEDIA_TYPE = "application/x-embedding-base64"  # Accept only; the response itself is JSON
+
+_ACCEPT_FORMATS = {
+    "application/json": FORMAT_JSON,
+    "*/*": FORMAT_JSON,
+    BASE64_MEDIA_TYPE: FORMAT_BASE64,
+    "application/msgpack": FORMAT_MSGPACK,
+    "application/x-msgpack": FORMAT_MSGPACK,
+    "application/octet-stream": FORMAT_BINARY,
+}
+
+# Binary layout (little-endian):
+#   magic  4s  b"PBEM"
+#   ver    u8  1
+#   dtype  u8  1 = float32, 2 = float16
+#   flags  u16 bit 0 = L2-normalized
+#   rows   u32
+#   dim    u32
+# followed by `rows` status bytes (1 = embedding present, 0 = missing/error)
+# and rows * dim values (zeros for missing rows).
+BINARY_MAGIC = b"PBEM"
+BINARY_VERSION = 1
+_BINARY_HEADER = struct.Struct("<4sBBHII")
+_BINARY_DTYPE_CODES = {"float32": 1, "float16": 2}
+_BINARY_FLAG_NORMALIZED = 1
+
+
+@dataclass(frozen=True)
+class ResponseFormat:
+    """How embeddings in a response should be encoded."""
+    format: str = FORMAT_JSON
+    dtype: str = "float32"
+    normalize: bool = False
+
+
+def negotiate(format=None, dtype="float32", normalize=False, accept=None):
+    """
+    Resolve the response format from the query parameters and the Accept header.
+
+    An explicit format= parameter wins over the Accept header; JSON is the default.
+    From the Accept header the known media type with the highest q-value is used,
+    the first listed one on ties.
+
+    Args:
+        format: requested format name (json, base64, msgpack, binary) or None
+        dtype: float32 or float16 (ignored for plain JSON)
+        normalize: return L2-normalized embeddings
+        accept: value of the Accept header
+
+    Returns:
+        ResponseFormat
+
+    Raises:
+        ValueError: if the format or dtype is not supported
+    """
+    if format is None and accept:
+        format = _accepted_format(accept)
+
+    format = (format or FORMAT_JSON).lower()
+    if format not in FORMATS:
+        raise ValueError(f"Unknown format '{format}'. Allowed: {', '.join(FORMATS)}")
+    if dtype not in DTYPES:
+        raise ValueError(f"Unknown dtype '{dtype}'. Allowed: {', '.join(DTYPES)}")
+    if format == FORMAT_MSGPACK and msgpack is None:
+        raise ValueError("msgpack format is not available: the msgpack package is not installed")
+
+    return ResponseFormat(format=format, dtype=dtype, normalize=normalize)
+
+
+def _accepted_format(accept: str):
+    """Format of the preferred supported media type in an Accept header, or None."""
+    best_format, best_quality = None, 0.0
+    for media_range in accept.split(","):
+        media_type, *params = media_range.split(";")
+        media_type = media_type.strip().lower()
+        if media_type not in _ACCEPT_FORMATS or (_ACCEPT_FORMATS[media_type] == FORMAT_MSGPACK and msgpack is None):
+            continue
+
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > best_quality:
+            best_format, best_quality = _ACCEPT_FORMATS[media_type], quality
+    return best_format
+
+
+def l2_normalize(embedding):
+    """Scale each row of an embedding (1-D or 2-D array) to unit length."""
+    embedding = np.asarray(embedding, dtype=np.float32)
+    norms = np.linalg.norm(embedding, axis=-1, keepdims=True)
+    return embedding / np.maximum(norms, 1e-12)
+
+
+def _embedding_holders(result):
+    """Yield every dict in a service result that carries an "embedding" key, in response order."""
+    if "embedding" in result:
+        yield result
+    for face in result.get("faces", ()):
+        if "embedding" in face:
+            yield face
+    for item in result.get("results", ()):
+        yield from _embedding_holders(item)
+
+
+def _prepare(result, fmt: ResponseFormat):
+    """Copy embeddings into the requested representation (the service result itself is not modified)."""
+    result = _copy(result)
+    for holder in _embedding_holders(result):
+        embedding = holder["embedding"]
+        if embedding is None:
+            continue
+        if fmt.normalize:
+            embedding = l2_normalize(embedding)
+
+        if fmt.format == FORMAT_JSON:
+            holder["embedding"] = np.asarray(embedding).tolist()
+            continue
+
+        raw = np.ascontiguousarray(embedding, dtype=DTYPES[fmt.dtype]).tobytes()
+        holder["embedding"] = base64.b64encode(raw).decode("ascii") if fmt.format == FORMAT_BASE64 else raw
+        holder["embedding_dtype"] = fmt.dtype
+
+    if fmt.normalize:
+        result["embedding_normalized"] = True
+
+    return result
+
+
+def _copy(value):
+    """Shallow-copy the dict/list structure of a result so it can be rewritten safely."""
+    if isinstance(value, dict):
+        return {key: _copy(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy(item) for item in value]
+    return value
+
+
+def _to_binary(result, fmt: ResponseFormat):
+    """Pack all embeddings of a result into the binary matrix layout."""
+    if "results" in result and any("faces" in item for item in result["results"]):
+        raise ValueError("binary format is not supported for multi-image detection; use msgpack or base64")
+
+    if "results" in result:
+        # One row per file; failed files have no "embedding" key but keep their row
+        sources = result["results"]
+    else:
+        sources = list(_embedding_holders(result))
+
+    rows = []
+    for source in sources:
+        embedding = source.get("embedding")
+        rows.append(None if embedding is None else np.asarray(embedding, dtype=np.float32).reshape(-1))
+
+    dim = next((row.shape[0] for row in rows if row is not None), 0)
+    matrix = np.zeros((len(rows), dim), dtype=DTYPES[fmt.dtype])
+    status = np.zeros(len(rows), dtype=np.uint8)
+    for index, row in enumerate(rows):
+        if row is None:
+            continue
+        matrix[index] = l2_normalize(row) if fmt.normalize else row
+        status[index] = 1
+
+    header = _BINARY_HEADER.pack(
+        BINARY_MAGIC,
+        BINARY_VERSION,
+        _BINARY_DTYPE_CODES[fmt.dtype],
+        _BINARY_FLAG_NORMALIZED if fmt.normalize else 0,
+        len(rows),
+        dim,
+    )
+    return header + status.tobytes() + matrix.tobytes()
+
+
+def parse_binary(data: bytes):
+    """
+    Read a response in the binary matrix layout.
+
+    Args:
+        data: response body starting with BINARY_MAGIC
+
+    Returns:
+        (matrix of shape (rows, dim), status array with 1 where a row holds an embedding)
+
+    Raises:
+        ValueError: if the data is not in the binary layout
+    """
+    if len(data) < _BINARY_HEADER.size:
+        raise ValueError("binary embedding data is truncated")
+    magic, version, dtype_code, _, rows, dim = _BINARY_HEADER.unpack_from(data)
+    if magic != BINARY_MAGIC or version != BINARY_VERSION:
+        raise ValueError("not a binary embedding response")
+    dtype_names = {code: name for name, code in _BINARY_DTYPE_CODES.items()}
+    if dtype_code not in dtype_names:
+        raise ValueError(f"unknown binary dtype code {dtype_code}")
+
+    offset = _BINARY_HEADER.size
+    status = np.frombuffer(data, dtype=np.uint8, count=rows, offset=offset)
+    matrix = np.frombuffer(data, dtype=DTYPES[dtype_names[dtype_code]], count=rows * dim, offset=offset + rows)
+    return matrix.reshape(rows, dim), status
+
+
+def render(result, fmt: ResponseFormat = ResponseFormat()):
+    """
+    Serialize a service result in the negotiated format.
+
+    Results that carry an "error" are always returned as JSON.
+
+    Args:
+        result: dict returned by face_service (embeddings as numpy arrays)
+        fmt: ResponseFormat from negotiate
+
+    Returns:
+        starlette Response
+    """
+    if "error" in result:
+        return JSONResponse(_prepare(result, ResponseFormat()))
+
+    if fmt.format == FORMAT_JSON:
+        return JSONResponse(_prepare(result, fmt))
+
+    if fmt.format == FORMAT_BINARY:
+        try:
+            return Response(content=_to_binary(result, fmt), media_type=BINARY_MEDIA_TYPE)
+        except ValueError as e:
+            return JSONResponse({"detail": str(e)}, status_code=406)
+
+    prepared = _prepare(result, fmt)
+    if fmt.format == FORMAT_MSGPACK:
+        return Response(content=msgpack.packb(prepared, use_bin_type=True), media_type=MSGPACK_MEDIA_TYPE)
+
+    return JSONResponse(prepared)
+
+
+def render_line(result, fmt: ResponseFormat = ResponseFormat()):
+    """
+    Serialize a service result as one NDJSON line.
+
+    Args:
+        result: dict returned by face_service (embeddings as numpy arrays)
+        fmt: ResponseFormat with a format from LINE_FORMATS
+
+    Returns:
+        UTF-8 encoded JSON object followed by a newline
+    """
+    if "error" in result:
+        fmt = ResponseFormat()
+    return json.dumps(_prepare(result, fmt), ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
@@ -0,0 +1,248 @@
+import asyncio
+import functools
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+
+from . import config
+
+logger = logging.getLogger("face_service")
+
+# Dedicated pool for blocking work (decode, inference, serialization).
+# The event loop only accepts requests and awaits results from this pool.
+_executor = ThreadPoolExecutor(
+    max_workers=config.INFERENCE_WORKERS,
+    thread_name_prefix="inference",
+)
+
+# Separate pool for fan-out work submitted from inference threads (e.g. decoding
+# the files of a batch request). Using the inference pool here could deadlock
+# when all of its threads wait on their own sub-tasks.
+_parallel_executor = ThreadPoolExecutor(
+    max_workers=config.DECODE_WORKERS,
+    thread_name_prefix="decode",
+)
+
+# Pre-forked inference processes (INFERENCE_PROCESSES > 0). When set, run_inference
+# dispatches to these workers and this process only does HTTP parsing.
+_process_pool = None
+_process_pool_lock = threading.Lock()
+_fork_context = multiprocessing.get_context("fork") if config.INFERENCE_PROCESSES > 0 else None
+
+# Shared between the front process and the forked workers
+_ready_workers = _fork_context.Value("i", 0) if _fork_context else None
+_cache_generation = (_fork_context or multiprocessing).Value("i", 0)
+
+_model_slots = {}
+_model_slots_lock = threading.Lock()
+
+
+def _get_model_slot(name: str) -> threading.BoundedSemaphore:
+    with _model_slots_lock:
+        slot = _model_slots.get(name)
+        if slot is None:
+            limit = config.model_concurrency(name)
+            slot = threading.BoundedSemaphore(limit)
+            _model_slots[name] = slot
+            logger.info(f"Model '{name}' concurrency limit: {limit}")
+        return slot
+
+
+@contextmanager
+def model_slot(name: str):
+    """
+    Limit how many inference threads may use a model at the same time.
+
+    Args:
+        name: model name, see config.model_concurrency
+    """
+    slot = _get_model_slot(name)
+    with slot:
+        yield
+
+
+def submit_inference(fn, *args, **kwargs):
+    """
+    Start a blocking function on the inference executor.
+
+    In multi-process mode fn and its arguments must be picklable
+    (module-level functions, bytes, plain data).
+
+    Args:
+        fn: callable to run
+        *args, **kwargs: arguments passed to fn
+
+    Returns:
+        concurrent.futures.Future of the call
+    """
+    call = functools.partial(fn, *args, **kwargs)
+    if _process_pool is None:
+        return _executor.submit(call)
+    try:
+        return _healthy_process_pool().submit(call)
+    except BrokenProcessPool:
+        # A worker died between the check and the submit
+        return _healthy_process_pool().submit(call)
+
+
+async def run_inference(fn, *args, **kwargs):
+    """
+    Run a blocking function on the inference executor and await its result.
+
+    Args:
+        fn: callable to run, see submit_inference
+        *args, **kwargs: arguments passed to fn
+
+    Returns:
+        whatever fn returns
+    """
+    return await asyncio.wrap_future(submit_inference(fn, *args, **kwargs))
+
+
+def map_parallel(fn, items):
+    """
+    Apply a blocking function (cv2 decode, resize, ...) to items in parallel.
+
+    Args:
+        fn: callable taking a single item
+        items: list of inputs
+
+    Returns:
+        list of results in input order
+    """
+    if len(items) <= 1:
+        return [fn(item) for item in items]
+    return list(_parallel_executor.map(fn, items))
+
+
+def cache_generation() -> int:
+    """Counter bumped whenever cached results are invalidated; shared by all workers."""
+    return _cache_generation.value
+
+
+def bump_cache_generation():
+    """Tell every worker to drop its in-memory cached results."""
+    with _cache_generation.get_lock():
+        _cache_generation.value += 1
+
+
+def _reset_after_fork():
+    """Recreate per-process state that does not survive fork (threads, held semaphores)."""
+    global _executor, _parallel_executor, _model_slots_lock
+
+    _executor = None
+    _parallel_executor = ThreadPoolExecutor(max_workers=config.DECODE_WORKERS, thread_name_prefix="decode")
+    _model_slots_lock = threading.Lock()
+    _model_slots.clear()
+
+
+def _init_worker(ready_workers):
+    """Initializer of each forked inference process."""
+    _reset_after_fork()
+
+    from . import face_service
+    from .models import registry
+
+    face_service.reset_after_fork()
+
+    # Keep workers x threads within the number of cores
+    if "torch" in sys.modules and config.ORT_INTRA_OP_THREADS > 0:
+        sys.modules["torch"].set_num_threads(config.ORT_INTRA_OP_THREADS)
+
+    registry.warm_up(config.WARMUP_MODELS)
+
+    with ready_workers.get_lock():
+        ready_workers.value += 1
+    logger.info(f"Inference worker {os.getpid()} ready")
+
+
+def _noop():
+    return os.getpid()
+
+
+def start_process_pool():
+    """
+    Load shared state in this process and fork the inference workers.
+
+    Heavy imports, the model pack download and the torch emotion weights are
+    loaded here before forking so workers share those pages copy-on-write.
+    ONNX Runtime sessions own thread pools that do not survive fork, so each
+    worker creates its own sessions (reading the same model files through
+    the shared page cache) with ORT_INTRA_OP_THREADS threads.
+    """
+    global _process_pool
+
+    from .models import registry
+
+    registry.preload(config.WARMUP_MODELS)
+
+    with _process_pool_lock:
+        _process_pool = _fork_process_pool()
+    logger.info(
+        f"Started {config.INFERENCE_PROCESSES} inference process(es) "
+        f"with {config.ORT_INTRA_OP_THREADS} intra-op thread(s) each"
+    )
+
+
+def _fork_process_pool() -> ProcessPoolExecutor:
+    with _ready_workers.get_lock():
+        _ready_workers.value = 0
+    pool = ProcessPoolExecutor(
+        max_workers=config.INFERENCE_PROCESSES,
+        mp_context=_fork_context,
+        initializer=_init_worker,
+        initargs=(_ready_workers,),
+    )
+    # The fork context starts all workers on first submit; do it now rather than on the first request
+    pool.submit(_noop)
+    return pool
+
+
+def _process_pool_broken() -> bool:
+    # Set by the executor when a worker exits abruptly (OOM kill, crash in native code);
+    # every later submit then fails with BrokenProcessPool
+    return bool(getattr(_process_pool, "_broken", False))
+
+
+def _healthy_process_pool() -> ProcessPoolExecutor:
+    """The process pool, forked again if a worker died."""
+    global _process_pool
+
+    with _process_pool_lock:
+        if _process_pool_broken():
+            logger.error("An inference process died, restarting the inference processes")
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+            _process_pool = _fork_process_pool()
+        return _process_pool
+
+
+def uses_processes() -> bool:
+    return config.INFERENCE_PROCESSES > 0
+
+
+def processes_ready() -> bool:
+    """
+    Whether every forked worker has finished its warm-up.
+
+    A pool broken by a dead worker is restarted here as well, so it recovers
+    even when no requests arrive; it is reported not ready until the new
+    workers have warmed up.
+    """
+    if _process_pool is None:
+        return False
+    _healthy_process_pool()
+    return _ready_workers.value >= config.INFERENCE_PROCESSES
+
+
+def shutdown():
+    """Stop accepting new work and drop queued inference calls."""
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+    _parallel_executor.shutdown(wait=False, cancel_futures=True)
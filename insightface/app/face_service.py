@@ -1,71 +1,204 @@
-from fastapi import UploadFile
 import numpy as np
-import insightface
+import hashlib
 import json
 import logging
+import os
+import threading
 import cv2
-import onnxruntime as ort
-from . import emotion_patch
-from hsemotion.facial_emotions import HSEmotionRecognizer
+from insightface.app.common import Face
+from insightface.utils import face_align
+from . import config
+from .batching import MicroBatcher
+from .cache import ResultCache
+from .decoding import decode_image, decode_for_detection
+from .gallery import FaceGallery
+from . import admission, detection, executor
+from . import metrics
+from .executor import model_slot, map_parallel
+from .models import registry, MODEL_PACK, EMOTION, EMOTION_MODEL_NAME
 
 # Setup logger
 logger = logging.getLogger("face_service")
 logger.setLevel(logging.INFO)
 
-# Initialize InsightFace recognition model only (no face detection)
-# Using antelopev2 model pack which includes ResNet100@Glint360K recognition model
-logger.info("Initializing InsightFace ArcFace recognition model (antelopev2 with glint360k)...")
+# Models are loaded lazily by the registry (see models.py); nothing heavy happens at import time
 
-# Detect available ONNX Runtime providers
-available_providers = ort.get_available_providers()
-logger.info(f"Available ONNX Runtime providers: {available_providers}")
 
-# Build provider list with preference for CUDA if available
-providers = []
-if 'CUDAExecutionProvider' in available_providers:
-    providers.append('CUDAExecutionProvider')
-    logger.info("CUDA provider is available - GPU acceleration enabled")
-else:
-    logger.info("CUDA provider not available - using CPU only")
+def _recognize_batch(face_imgs):
+    """Run ArcFace on a list of 112x112 BGR faces in a single forward pass."""
+    with model_slot("recognition"):
+        return registry.get("recognition").get_feat(face_imgs)
 
-if 'CPUExecutionProvider' in available_providers:
-    providers.append('CPUExecutionProvider')
 
-logger.info(f"Using providers: {providers}")
+# Crops from concurrent requests are collected into shared ArcFace batches.
+# Created on first use so that forked inference workers start their own thread.
+_recognition_batcher = None
+_recognition_batcher_lock = threading.Lock()
 
-# Load the model pack to access models
-app_insightface = insightface.app.FaceAnalysis(
-    name='buffalo_l',
-    providers=providers
-)
-app_insightface.prepare(ctx_id=0, det_size=(640, 640))
 
-# Extract models from the pack
-recognition_model = None
-genderage_model = None
+def get_recognition_batcher():
+    """
+    The ArcFace micro-batcher, created on first use.
 
-for task_name, model in app_insightface.models.items():
-    logger.info(f"Found model: {task_name} - {type(model).__name__}")
+    Returns:
+        MicroBatcher, or None when batching is disabled
+    """
+    global _recognition_batcher
+    if config.EMBED_BATCH_MAX_SIZE <= 1:
+        return None
 
-    # Extract recognition model
-    if hasattr(model, 'get_feat') or 'rec' in str(type(model)).lower():
-        recognition_model = model
-        logger.info(f"Extracted recognition model: {type(model).__name__}")
+    with _recognition_batcher_lock:
+        if _recognition_batcher is None:
+            _recognition_batcher = MicroBatcher(
+                "recognition",
+                _recognize_batch,
+                max_batch_size=config.EMBED_BATCH_MAX_SIZE,
+                max_wait_ms=config.EMBED_BATCH_MAX_WAIT_MS
+            )
+        return _recognition_batcher
 
-    # Extract gender/age model
-    if 'ga' in task_name.lower() or 'genderage' in str(type(model)).lower():
-        genderage_model = model
-        logger.info(f"Extracted genderage model: {type(model).__name__}")
 
-if recognition_model is None:
-    raise RuntimeError("Could not extract recognition model from antelopev2 pack")
+def _compute_model_version():
+    """
+    Fingerprint of everything that affects results: model files and decode settings.
 
-logger.info(f"InsightFace models initialized - Recognition: ✓, GenderAge: {'✓' if genderage_model else '✗'}")
+    Returns:
+        short hex string that changes whenever the model pack is replaced
+    """
+    fingerprint = hashlib.sha256()
+    fingerprint.update(f"{MODEL_PACK}|{EMOTION_MODEL_NAME}:{registry.emotion_backend()}".encode())
+    for name, model_file in sorted(registry.model_files().items()):
+        if os.path.exists(model_file):
+            stat = os.stat(model_file)
+            fingerprint.update(f"|{name}:{os.path.basename(model_file)}:{stat.st_size}:{int(stat.st_mtime)}".encode())
+    fingerprint.update(f"|decode:{config.DECODE_TARGET_SIZE}:{config.DECODE_MIN_FACE_SIZE}".encode())
+    fingerprint.update(
+        f"|detection:{config.DETECTION_MODE}:{config.DETECTION_MIN_SIZE}:{config.DETECTION_TILE_FACE_SIZE}:"
+        f"{config.DETECTION_TILE_CROWD}:{config.DETECTION_TILE_OVERLAP}:{config.DETECTION_MAX_PIXELS}".encode()
+    )
+    return fingerprint.hexdigest()[:16]
+
+
+# Byte-identical re-submissions are answered from this cache instead of re-running inference.
+# Created on first use because the key depends on the model files.
+_result_cache = None
+_result_cache_lock = threading.Lock()
+_result_cache_generation = 0
+
+
+def get_result_cache():
+    """
+    The result cache, created on first use.
 
-# Initialize HSEmotion model for emotion recognition
-logger.info("Initializing HSEmotion model for emotion recognition...")
-emotion_model = HSEmotionRecognizer(model_name='enet_b0_8_best_afew')
-logger.info("HSEmotion model initialized successfully - Emotions: ✓")
+    Returns:
+        ResultCache, or None when caching is disabled
+    """
+    global _result_cache, _result_cache_generation
+    if not config.CACHE_ENABLED:
+        return None
+
+    with _result_cache_lock:
+        # Another inference process cleared the cache: drop this process's memory tier too
+        generation = executor.cache_generation()
+        if _result_cache is not None and generation != _result_cache_generation:
+            _result_cache.clear_memory()
+        _result_cache_generation = generation
+
+        if _result_cache is None:
+            model_version = _compute_model_version()
+            logger.info(f"Model version: {model_version}")
+            _result_cache = ResultCache(
+                model_version,
+                max_entries=config.CACHE_MAX_ENTRIES,
+                path=config.CACHE_PATH,
+                disk_max_entries=config.CACHE_DISK_MAX_ENTRIES
+            )
+        return _result_cache
+
+
+# Registered persons for /register, /recognize and identification in /detect.
+# Opened on first use; with GALLERY_PATH all inference processes share the files.
+_gallery = None
+_gallery_lock = threading.Lock()
+
+
+def get_gallery():
+    """
+    The face gallery, opened on first use.
+
+    Returns:
+        FaceGallery
+    """
+    global _gallery
+    with _gallery_lock:
+        if _gallery is None:
+            _gallery = FaceGallery(dim=512, path=config.GALLERY_PATH, dtype=config.GALLERY_DTYPE)
+        return _gallery
+
+
+def reset_after_fork():
+    """
+    Drop per-process state inherited from the parent of a forked inference worker.
+
+    The micro-batcher thread, the SQLite connection of the result cache and the
+    gallery memory maps do not survive fork; all are recreated on first use in the worker.
+    """
+    global _recognition_batcher, _recognition_batcher_lock, _result_cache, _result_cache_lock, _gallery, _gallery_lock
+    _recognition_batcher = None
+    _recognition_batcher_lock = threading.Lock()
+    _result_cache = None
+    _result_cache_lock = threading.Lock()
+    _gallery = None
+    _gallery_lock = threading.Lock()
+
+
+# Pipeline stages that can be requested per call.
+# Detection always runs; every other stage maps to one or more models.
+STAGE_DETECTION = "det"
+STAGE_LANDMARKS = "lmk"
+STAGE_GENDERAGE = "ga"
+STAGE_RECOGNITION = "rec"
+STAGE_EMOTION = "emotion"
+STAGE_IDENTIFY = "id"  # match faces against the gallery (runs recognition, embeddings are not returned)
+ALL_STAGES = (STAGE_DETECTION, STAGE_LANDMARKS, STAGE_GENDERAGE, STAGE_RECOGNITION, STAGE_EMOTION, STAGE_IDENTIFY)
+
+# What /detect has always returned: bbox, 5-point landmarks, age, gender and emotion
+DEFAULT_STAGES = frozenset({STAGE_DETECTION, STAGE_GENDERAGE, STAGE_EMOTION})
+
+# /recognize and /batch_recognize: boxes and identities only
+RECOGNIZE_STAGES = frozenset({STAGE_DETECTION, STAGE_IDENTIFY})
+
+
+def resolve_stages(stages=None, include_embeddings: bool = False, identify: bool = False):
+    """
+    Build the stage plan for a detection request.
+
+    Args:
+        stages: comma-separated stage names (e.g. "det,ga,rec,emotion") or None for the default plan
+        include_embeddings: whether embeddings were requested (adds the "rec" stage)
+        identify: whether faces should be matched against the gallery (adds the "id" stage)
+
+    Returns:
+        frozenset of stage names to run
+
+    Raises:
+        ValueError: if an unknown stage is requested
+    """
+    if stages is None or stages.strip() == "":
+        plan = set(DEFAULT_STAGES)
+    else:
+        plan = {stage.strip().lower() for stage in stages.split(",") if stage.strip()}
+        unknown = plan.difference(ALL_STAGES)
+        if unknown:
+            raise ValueError(f"Unknown stage(s): {', '.join(sorted(unknown))}. Allowed: {', '.join(ALL_STAGES)}")
+
+    plan.add(STAGE_DETECTION)
+    if include_embeddings:
+        plan.add(STAGE_RECOGNITION)
+    if identify:
+        plan.add(STAGE_IDENTIFY)
+
+    return frozenset(plan)
 
 
 def preprocess_face_image(img):
@@ -107,232 +240,984 @@ def get_embedding_from_cropped_face(img):
     processed_img = preprocess_face_image(img)
 
     # Extract embedding using the recognition model
-    embedding = recognition_model.get_feat(processed_img)
+    return embed_faces([processed_img])
+
+
+def embed_faces(face_imgs):
+    """
+    Extract embeddings for several aligned 112x112 faces.
+
+    When micro-batching is enabled the faces are queued together with crops
+    from other concurrent requests and share a single ArcFace forward pass.
+
+    Args:
+        face_imgs: list of numpy arrays (112x112, BGR)
+
+    Returns:
+        numpy array of shape (len(face_imgs), 512)
+    """
+    # The span includes the time spent waiting for a shared batch
+    with metrics.span("recognition"):
+        recognition_batcher = get_recognition_batcher()
+        if recognition_batcher is None:
+            return _recognize_batch(face_imgs)
+
+        futures = recognition_batcher.submit_many(face_imgs)
+        return np.stack([future.result() for future in futures])
+
+
+def get_batching_stats():
+    """
+    Queue depth and batch-size statistics of the micro-batchers.
+
+    Returns:
+        dict keyed by batcher name (empty when batching is disabled)
+    """
+    recognition_batcher = get_recognition_batcher()
+    if recognition_batcher is None:
+        return {}
+    return {recognition_batcher.name: recognition_batcher.stats()}
+
+
+def detect_image_faces(img, stages, detection_mode=None):
+    """
+    Run the detector (and per-face landmark models) on one image.
+
+    Args:
+        img: numpy array of the full image (BGR)
+        stages: stage plan from resolve_stages
+        detection_mode: detector sizing from detection.resolve_mode (None means DETECTION_MODE)
+
+    Returns:
+        list of insightface Face objects with bbox, kps and det_score
+    """
+    with metrics.span("detect"), model_slot("detection"):
+        bboxes, kpss = detection.detect(registry.get("detection"), img, detection_mode)
+
+    faces = []
+    for i in range(bboxes.shape[0]):
+        face = Face(
+            bbox=bboxes[i, 0:4],
+            kps=kpss[i] if kpss is not None else None,
+            det_score=bboxes[i, 4]
+        )
+
+        if STAGE_LANDMARKS in stages:
+            for name in ("landmark_3d_68", "landmark_2d_106"):
+                with metrics.span("landmarks"), model_slot("landmark"):
+                    registry.get(name).get(img, face)
+
+        faces.append(face)
+
+    return faces
+
+
+def _supports_batch(model):
+    """Whether an ONNX model accepts more than one image per run (dynamic batch axis)."""
+    batch_dim = model.input_shape[0] if getattr(model, 'input_shape', None) else None
+    return not isinstance(batch_dim, int) or batch_dim != 1
+
+
+def predict_genderage(img_faces):
+    """
+    Estimate gender and age for many faces in a single forward pass.
+
+    Applies the same alignment as insightface's Attribute.get, but stacks all
+    faces (possibly from different images) into one blob.
+
+    Args:
+        img_faces: list of (image, Face) pairs; results are written to face.gender / face.age
+    """
+    if not img_faces:
+        return
+
+    with metrics.span("genderage"):
+        _predict_genderage(img_faces)
+
+
+def _predict_genderage(img_faces):
+    model = registry.get("genderage")
+    if not _supports_batch(model):
+        for img, face in img_faces:
+            with model_slot("genderage"):
+                model.get(img, face)
+        return
+
+    input_size = model.input_size[0]
+    aligned = []
+    for img, face in img_faces:
+        bbox = face.bbox
+        w, h = (bbox[2] - bbox[0]), (bbox[3] - bbox[1])
+        center = (bbox[2] + bbox[0]) / 2, (bbox[3] + bbox[1]) / 2
+        scale = input_size / (max(w, h) * 1.5)
+        aimg, _ = face_align.transform(img, center, input_size, scale, 0)
+        aligned.append(aimg)
+
+    blob = cv2.dnn.blobFromImages(
+        aligned, 1.0 / model.input_std, (input_size, input_size),
+        (model.input_mean, model.input_mean, model.input_mean), swapRB=True
+    )
+    with model_slot("genderage"):
+        preds = model.session.run(model.output_names, {model.input_name: blob})[0]
+
+    for (_, face), pred in zip(img_faces, preds):
+        face.gender = int(np.argmax(pred[:2]))
+        face.age = int(np.round(pred[2] * 100))
+
+
+def run_face_models(img_faces, stages):
+    """
+    Run the per-face models of the stage plan over all faces at once.
 
-    return embedding
+    Args:
+        img_faces: list of (image, Face) pairs, may span several images
+        stages: stage plan from resolve_stages
+    """
+    if STAGE_GENDERAGE in stages:
+        predict_genderage(img_faces)
+
+    # Align all faces and embed them together (batched with other requests)
+    if STAGE_RECOGNITION in stages or STAGE_IDENTIFY in stages:
+        admission.check_deadline("recognition")
+        aligned = [(img, face) for img, face in img_faces if face.kps is not None]
+        if aligned:
+            crops = [
+                face_align.norm_crop(img, landmark=face.kps, image_size=registry.get("recognition").input_size[0])
+                for img, face in aligned
+            ]
+            for (_, face), embedding in zip(aligned, embed_faces(crops)):
+                face.embedding = embedding.flatten()
 
 
 def get_face_attributes(img):
     """
     Extract face attributes from a pre-cropped face image.
-    Uses FaceAnalysis to detect the face and extract all attributes.
+
+    The crop itself is used as the face box, so no detection (and no second
+    recognition pass) is run: genderage and the 3D-68 landmark model (pose)
+    work directly on the known crop.
 
     Args:
-        img: numpy array of face image
+        img: numpy array of face image (BGR)
 
     Returns:
-        dict with age, gender, and other attributes, or None if no face detected
+        dict with age, gender and pose
     """
-    # Use FaceAnalysis to detect face and extract attributes
-    # Even though it's a cropped face, we still need to "detect" it
-    faces = app_insightface.get(img)
+    return get_faces_attributes([img])[0]
 
-    if not faces or len(faces) == 0:
-        logger.warning("No face detected in the cropped image")
-        return None
 
-    # Take the first (and should be only) detected face
-    face = faces[0]
+def get_faces_attributes(imgs):
+    """
+    Extract face attributes for several pre-cropped face images.
 
-    # Extract attributes
-    attributes = {
-        "age": int(face.age) if hasattr(face, 'age') and face.age is not None else None,
-        "gender": "male" if hasattr(face, 'gender') and face.gender == 1 else "female" if hasattr(face, 'gender') and face.gender == 0 else None,
-    }
+    Genderage runs as one batch over all crops; pose is estimated per crop.
 
-    # Add pose if available
-    if hasattr(face, 'pose') and face.pose is not None:
-        attributes["pose"] = {
-            "yaw": float(face.pose.yaw) if hasattr(face.pose, 'yaw') else None,
-            "pitch": float(face.pose.pitch) if hasattr(face.pose, 'pitch') else None,
-            "roll": float(face.pose.roll) if hasattr(face.pose, 'roll') else None,
+    Args:
+        imgs: list of numpy arrays of face images (BGR)
+
+    Returns:
+        list of dicts with age, gender and pose, in the same order as imgs
+    """
+    img_faces = []
+    for img in imgs:
+        height, width = img.shape[:2]
+        face = Face(bbox=np.array([0, 0, width, height], dtype=np.float32), kps=None, det_score=1.0)
+        img_faces.append((img, face))
+
+    predict_genderage(img_faces)
+
+    # Only the 3D-68 model estimates pose; the 2D-106 model is not needed here
+    pose_model = registry.get("landmark_3d_68")
+    for img, face in img_faces:
+        with metrics.span("landmarks"), model_slot("landmark"):
+            pose_model.get(img, face)
+
+    results = []
+    for _, face in img_faces:
+        attributes = {
+            "age": int(face.age) if face.age is not None else None,
+            "gender": "male" if face.gender == 1 else "female" if face.gender == 0 else None,
         }
 
-    # Add embedding shape info
-    if hasattr(face, 'embedding') and face.embedding is not None:
-        attributes["embedding_available"] = True
-        attributes["embedding_dim"] = len(face.embedding)
+        # face.pose is [pitch, yaw, roll] in degrees
+        if face.pose is not None:
+            pitch, yaw, roll = face.pose
+            attributes["pose"] = {
+                "yaw": float(yaw),
+                "pitch": float(pitch),
+                "roll": float(roll),
+            }
+
+        results.append(attributes)
+
+    return results
+
+
+def to_rgb(img):
+    """
+    Convert a decoded image (BGR, grayscale or BGRA) to RGB.
+
+    Args:
+        img: numpy array as returned by cv2.imdecode
+
+    Returns:
+        numpy array in RGB format
+    """
+    if len(img.shape) == 2:  # Grayscale
+        return cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
+    if img.shape[2] == 4:  # BGRA
+        return cv2.cvtColor(img, cv2.COLOR_BGRA2RGB)
+    # cv2.imdecode returns BGR
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
 
-    return attributes
 
+# HSEmotion returns: Anger, Contempt, Disgust, Fear, Happiness, Neutral, Sadness, Surprise
+EMOTION_LABELS = ['anger', 'contempt', 'disgust', 'fear', 'happiness', 'neutral', 'sadness', 'surprise']
 
-def get_emotion(img):
+
+def get_emotions(faces_rgb):
+    """
+    Detect emotions for many face images with batched forward passes.
+
+    Args:
+        faces_rgb: list of numpy arrays of face images (RGB format), may come from different images
+
+    Returns:
+        list of dicts with dominant emotion and scores (None where prediction failed),
+        in the same order as faces_rgb
+    """
+    results = [None] * len(faces_rgb)
+
+    for start in range(0, len(faces_rgb), config.EMOTION_BATCH_SIZE):
+        chunk = faces_rgb[start:start + config.EMOTION_BATCH_SIZE]
+        admission.check_deadline("emotion")
+        try:
+            # HSEmotion returns: emotions as strings (e.g., "Happiness"), scores as (N, 8) array
+            with metrics.span("emotion"), model_slot("emotion"):
+                emotions, scores = registry.get(EMOTION).predict_multi_emotions(chunk, logits=False)
+
+            for offset, (emotion, face_scores) in enumerate(zip(emotions, scores)):
+                results[start + offset] = {
+                    # emotion is already a string from HSEmotion, just convert to lowercase
+                    "emotion": emotion.lower(),
+                    "emotion_scores": {label: float(score) for label, score in zip(EMOTION_LABELS, face_scores)}
+                }
+        except Exception as e:
+            metrics.count_model_error("emotion")
+            _mark_partial()
+            logger.warning(f"Failed to detect emotions for a batch of {len(chunk)} face(s): {str(e)}")
+
+    return results
+
+
+def get_emotion(img, img_rgb=None):
     """
     Detect emotion from a face image.
 
     Args:
-        img: numpy array of face image (RGB format)
+        img: numpy array of face image (BGR format, as decoded by cv2)
+        img_rgb: optional RGB version of img, reused instead of converting again
 
     Returns:
         dict with dominant emotion and scores for all emotions
     """
     try:
         # HSEmotion expects RGB format
-        if len(img.shape) == 2:  # Grayscale
-            img_rgb = cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
-        elif img.shape[2] == 3:
-            # Check if BGR (from cv2.imread) and convert to RGB
-            img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        if img_rgb is None:
+            img_rgb = to_rgb(img)
+    except Exception as e:
+        _mark_partial()
+        logger.warning(f"Failed to detect emotion: {str(e)}")
+        return None
+
+    return get_emotions([img_rgb])[0]
+
+
+def crop_face(img, bbox):
+    """
+    Crop a face from an image, clipping the bbox to the image bounds.
+
+    Args:
+        img: numpy array of the full image
+        bbox: [x1, y1, x2, y2] face box
+
+    Returns:
+        numpy array view of the face region (may be empty)
+    """
+    x1, y1, x2, y2 = np.asarray(bbox).astype(int)[:4]
+    x1, y1 = max(0, x1), max(0, y1)
+    x2, y2 = min(img.shape[1], x2), min(img.shape[0], y2)
+    return img[y1:y2, x1:x2]
+
+
+def decode_all(items, decoder=decode_image):
+    """
+    Decode many images in parallel.
+
+    Args:
+        items: list of (filename, bytes)
+        decoder: function turning bytes into a decoded image (or None)
+
+    Returns:
+        list of (filename, decoded image or None) tuples
+    """
+    admission.check_deadline("decode")
+    payloads = [data for _, data in items]
+    with metrics.span("decode"):
+        decoded = map_parallel(decoder, payloads)
+    return [(filename, img) for (filename, _), img in zip(items, decoded)]
+
+
+# Stage failures that were logged and skipped instead of failing the file
+# (e.g. an emotion batch), counted per thread; such partial results are not cached
+_partial = threading.local()
+
+
+def _mark_partial():
+    _partial.count = getattr(_partial, "count", 0) + 1
+
+
+def _partial_count():
+    return getattr(_partial, "count", 0)
+
+
+def _process_uploads(items, endpoint, params, process):
+    """
+    Answer uploads from the result cache where possible and process the rest.
+
+    Args:
+        items: list of (filename, bytes)
+        endpoint: endpoint name, part of the cache key
+        params: request parameters that affect the result, part of the cache key
+        process: function taking a list of (filename, bytes) and returning one result per item
+
+    Returns:
+        list of (filename, result) tuples in upload order
+    """
+    result_cache = get_result_cache()
+    if result_cache is None:
+        results = process(items)
+    else:
+        keys = [result_cache.key(data, endpoint, params) for _, data in items]
+        results = [result_cache.get(key) for key in keys]
+        misses = [index for index, result in enumerate(results) if result is None]
+        if len(misses) < len(items):
+            logger.info(f"Result cache: {len(items) - len(misses)} hit(s), {len(misses)} miss(es)")
+            # Cached answers still count towards the face-count bucket of the request
+            for result in results:
+                if result is not None:
+                    metrics.count_faces(len(result["faces"]) if "faces" in result else 1)
+
+        if misses:
+            partial_before = _partial_count()
+            processed = process([items[index] for index in misses])
+            # Errors and partial results are cheap to recompute and may be transient
+            cacheable = _partial_count() == partial_before
+            for index, result in zip(misses, processed):
+                results[index] = result
+                if cacheable and "error" not in result:
+                    result_cache.put(keys[index], result)
+
+    return [(filename, result) for (filename, _), result in zip(items, results)]
+
+
+def get_cache_stats():
+    """
+    Hit/miss counters of the result cache.
+
+    Returns:
+        dict with cache statistics, or None when the cache is disabled
+    """
+    result_cache = get_result_cache()
+    return result_cache.stats() if result_cache is not None else None
+
+
+def clear_cache():
+    """Invalidate all cached results (in every inference process)."""
+    result_cache = get_result_cache()
+    if result_cache is not None:
+        result_cache.clear()
+        executor.bump_cache_generation()
+
+
+def get_stats():
+    """
+    Runtime statistics of the process that runs inference.
+
+    Returns:
+        dict with the process id, micro-batcher and result cache statistics
+    """
+    return {
+        "pid": os.getpid(),
+        "batching": get_batching_stats(),
+        "cache": get_cache_stats(),
+        "gallery": get_gallery().stats(),
+    }
+
+
+def _scale_face(face, scale_x, scale_y):
+    """Map the coordinates of a Face from a reduced decode back to another resolution."""
+    factors = np.array([scale_x, scale_y], dtype=np.float32)
+    face.bbox = face.bbox * np.tile(factors, 2)
+    if face.kps is not None:
+        face.kps = face.kps * factors
+    if face.landmark_2d_106 is not None:
+        face.landmark_2d_106 = face.landmark_2d_106 * factors
+    if face.landmark_3d_68 is not None:
+        landmarks = face.landmark_3d_68.copy()
+        landmarks[:, :2] *= factors
+        face.landmark_3d_68 = landmarks
+
+
+def _translate_face(face, dx, dy):
+    """Shift the coordinates of a Face by (dx, dy) pixels."""
+    offset = np.array([dx, dy], dtype=np.float32)
+    face.bbox = face.bbox + np.tile(offset, 2)
+    if face.kps is not None:
+        face.kps = face.kps + offset
+    if face.landmark_2d_106 is not None:
+        face.landmark_2d_106 = face.landmark_2d_106 + offset
+    if face.landmark_3d_68 is not None:
+        landmarks = face.landmark_3d_68.copy()
+        landmarks[:, :2] += offset
+        face.landmark_3d_68 = landmarks
+
+
+def _face_model_factor(decoded, faces, stages):
+    """
+    Decode reduction at which every face is at least DECODE_MIN_FACE_SIZE pixels for the pixel-based models.
+
+    Returns:
+        decoded.factor when the detection decode is enough, otherwise a finer factor (1 = full resolution)
+    """
+    if not faces or not stages.intersection((STAGE_GENDERAGE, STAGE_RECOGNITION, STAGE_EMOTION, STAGE_IDENTIFY)):
+        return decoded.factor
+
+    smallest = min(min(face.bbox[2] - face.bbox[0], face.bbox[3] - face.bbox[1]) for face in faces)
+    if smallest >= config.DECODE_MIN_FACE_SIZE:
+        return decoded.factor
+
+    # A face of `smallest` pixels at the current factor is smallest * current / factor pixels at `factor`
+    for factor in (4, 2):
+        if factor < decoded.factor and smallest * decoded.factor / factor >= config.DECODE_MIN_FACE_SIZE:
+            return factor
+    return 1
+
+
+def _face_region(img, face, stages):
+    """
+    Bounds of the pixels the face models read around a face.
+
+    Covers the gender/age alignment window (1.5x the longest box side around the
+    box centre, as in insightface's Attribute, which also contains the emotion
+    crop) and the ArcFace alignment window mapped back from the keypoints.
+
+    Returns:
+        (x0, y0, x1, y1) clipped to the image
+    """
+    x1, y1, x2, y2 = face.bbox[:4]
+    half = 0.75 * max(x2 - x1, y2 - y1)
+    cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+    xs, ys = [cx - half, cx + half], [cy - half, cy + half]
+
+    if face.kps is not None and (STAGE_RECOGNITION in stages or STAGE_IDENTIFY in stages):
+        size = registry.get("recognition").input_size[0]
+        inverse = cv2.invertAffineTransform(face_align.estimate_norm(face.kps, size))
+        corners = np.array([[0, 0, 1], [size, 0, 1], [0, size, 1], [size, size, 1]], dtype=np.float64)
+        window = corners @ inverse.T
+        xs.extend(window[:, 0])
+        ys.extend(window[:, 1])
+
+    # A couple of extra pixels keep bilinear sampling at the window edge identical
+    height, width = img.shape[:2]
+    x0, x1 = max(0, int(np.floor(min(xs))) - 2), min(width, int(np.ceil(max(xs))) + 2)
+    y0, y1 = max(0, int(np.floor(min(ys))) - 2), min(height, int(np.ceil(max(ys))) + 2)
+    return x0, y0, x1, y1
+
+
+def _face_model_inputs(decoded, faces, stages):
+    """
+    Images the face models run on for the faces of one photo.
+
+    When faces are too small in the reduced detection decode, the photo is decoded
+    again at the coarsest reduction that makes them large enough (full resolution
+    only if needed), the regions the models read are cut out, and the large decode
+    is released before the face models run. Faces are moved into the coordinates
+    of their crop.
+
+    Returns:
+        (scale to original coordinates as (scale_x, scale_y), image per face,
+        crop offset per face or None when the faces are on the detection decode)
+    """
+    factor = _face_model_factor(decoded, faces, stages)
+    if factor == decoded.factor:
+        return (decoded.scale_x, decoded.scale_y), [decoded.image] * len(faces), None
+
+    finer = decoded.redecode(factor)
+    if finer is None:
+        logger.warning("Finer decode failed, using the reduced decode for face models")
+        return (decoded.scale_x, decoded.scale_y), [decoded.image] * len(faces), None
+    logger.info(f"Small faces found in reduced decode, using crops of the 1/{factor} decode for face models")
+
+    crops, offsets = [], []
+    for face in faces:
+        _scale_face(face, decoded.scale_x / finer.scale_x, decoded.scale_y / finer.scale_y)
+        x0, y0, x1, y1 = _face_region(finer.image, face, stages)
+        crops.append(finer.image[y0:y1, x0:x1].copy())
+        offsets.append((x0, y0))
+        _translate_face(face, -x0, -y0)
+    return (finer.scale_x, finer.scale_y), crops, offsets
+
+
+def _embed_decoded(images, include_attributes):
+    """
+    Embed already decoded face crops with one pass per model.
+
+    Args:
+        images: list of (filename, image or None)
+        include_attributes: whether to include face attributes (age, gender, pose) and emotion
+
+    Returns:
+        list of result dicts (or {"error": ...}) in the same order as images
+    """
+    results = [None] * len(images)
+    valid = []
+    for index, (filename, img) in enumerate(images):
+        if img is None:
+            logger.error(f"Failed to decode image: {filename}")
+            metrics.count_decode_failure()
+            results[index] = {"error": "Invalid image format"}
         else:
-            img_rgb = img
+            logger.info(f"Cropped face image size: {img.shape[1]}x{img.shape[0]}")
+            valid.append(index)
 
-        # Get emotion prediction
-        # HSEmotion returns: emotion as string (e.g., "Happiness"), scores as array
-        emotion, scores = emotion_model.predict_emotions(img_rgb, logits=False)
+    if not valid:
+        return results
 
-        # HSEmotion returns: Anger, Contempt, Disgust, Fear, Happiness, Neutral, Sadness, Surprise
-        emotion_labels = ['anger', 'contempt', 'disgust', 'fear', 'happiness', 'neutral', 'sadness', 'surprise']
+    imgs = [images[index][1] for index in valid]
 
-        # Create scores dictionary
-        emotion_scores = {label: float(score) for label, score in zip(emotion_labels, scores)}
+    admission.check_deadline("recognition")
+    try:
+        # Get embeddings for all cropped faces in one batch
+        embeddings = embed_faces([preprocess_face_image(img) for img in imgs])
 
-        # emotion is already a string from HSEmotion, just convert to lowercase
-        dominant_emotion = emotion.lower()
+        # Optionally compute attributes and emotions for all crops at once.
+        # The decoded crops are shared by all models: genderage and pose run on them
+        # as known face boxes, emotion reuses a single RGB conversion per crop.
+        if include_attributes:
+            admission.check_deadline("genderage")
+        attributes = get_faces_attributes(imgs) if include_attributes else None
+        emotions = get_emotions([to_rgb(img) for img in imgs]) if include_attributes else None
+
+        for position, index in enumerate(valid):
+            embedding = embeddings[position:position + 1]
+
+            # Return embedding with metadata.
+            # The embedding stays a numpy array; encoding.render converts it
+            # to the negotiated response format (JSON list, base64, msgpack, ...)
+            result = {
+                "embedding": embedding,
+                "embedding_shape": list(embedding.shape),
+                "embedding_dim": len(embedding),
+                "model": "antelopev2_glint360k",
+                "input_size": "112x112"
+            }
 
-        return {
-            "emotion": dominant_emotion,
-            "emotion_scores": emotion_scores
-        }
+            if include_attributes:
+                face_attributes = attributes[position]
+                face_attributes["embedding_available"] = True
+                face_attributes["embedding_dim"] = embedding.shape[-1]
+                result["attributes"] = face_attributes
+
+                emotion_data = emotions[position]
+                if emotion_data:
+                    result["emotion"] = emotion_data["emotion"]
+                    result["emotion_scores"] = emotion_data["emotion_scores"]
+
+            results[index] = result
+
+        metrics.count_faces(len(valid))
+        logger.info(f"Successfully extracted {len(valid)} embedding(s) with dimension {embeddings.shape[-1]}")
+
+    except admission.DeadlineExceeded:
+        raise
     except Exception as e:
-        logger.warning(f"Failed to detect emotion: {str(e)}")
-        return None
+        metrics.count_model_error("recognition")
+        logger.exception(f"Error extracting embedding: {str(e)}")
+        for index in valid:
+            results[index] = {"error": f"Failed to extract embedding: {str(e)}"}
 
+    return results
 
-def embed_cropped_face(file: UploadFile, include_attributes: bool = False):
+
+def embed_cropped_face(filename: str, data: bytes, include_attributes: bool = False):
     """
     Extract embedding from a pre-cropped face image.
 
     Args:
-        file: UploadFile containing a cropped face image
+        filename: name of the uploaded file (for logging)
+        data: encoded image of a cropped face
         include_attributes: whether to include face attributes (age, gender, pose)
 
     Returns:
         dict with embedding vector and metadata in JSON format
     """
-    logger.info(f"Processing cropped face image: {file.filename}, include_attributes={include_attributes}")
+    logger.info(f"Processing cropped face image: {filename}, include_attributes={include_attributes}")
+    return _embed_uploads([(filename, data)], include_attributes)[0][1]
 
-    # Read image bytes
-    img_bytes = file.file.read()
-    np_arr = np.frombuffer(img_bytes, np.uint8)
-    img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
 
-    if img is None:
-        logger.error("Failed to decode image")
-        return {"error": "Invalid image format"}
+def embed_cropped_faces(items, include_attributes: bool = False):
+    """
+    Extract embeddings from many pre-cropped face images in one request.
 
-    logger.info(f"Cropped face image size: {img.shape[1]}x{img.shape[0]}")
+    Files are decoded in parallel; recognition, genderage and emotion each run
+    once over the whole batch.
 
-    try:
-        # Get embedding from the cropped face
-        embedding = get_embedding_from_cropped_face(img)
-
-        # Convert embedding to list for JSON serialization
-        embedding_list = embedding.tolist()
-
-        # Return embedding with metadata
-        result = {
-            "embedding": embedding_list,
-            "embedding_shape": list(embedding.shape),
-            "embedding_dim": len(embedding_list),
-            "model": "antelopev2_glint360k",
-            "input_size": "112x112"
-        }
+    Args:
+        items: list of (filename, bytes), each a cropped face image
+        include_attributes: whether to include face attributes (age, gender, pose)
 
-        # Optionally add attributes
-        if include_attributes:
-            attributes = get_face_attributes(img)
-            if attributes:
-                result["attributes"] = attributes
+    Returns:
+        dict with per-file results (each with "filename" and either the embedding or an "error")
+    """
+    logger.info(f"Processing batch of {len(items)} cropped face image(s), include_attributes={include_attributes}")
+    results = _embed_uploads(items, include_attributes)
+    return {"results": [{"filename": filename, **result} for filename, result in results]}
 
-            # Add emotion detection
-            emotion_data = get_emotion(img)
-            if emotion_data:
-                result["emotion"] = emotion_data["emotion"]
-                result["emotion_scores"] = emotion_data["emotion_scores"]
 
-        logger.info(f"Successfully extracted embedding with dimension {len(embedding_list)}")
-        return result
+def _embed_uploads(uploads, include_attributes):
+    def process(items):
+        return _embed_decoded(decode_all(items), include_attributes)
+
+    return _process_uploads(uploads, "embed", {"include_attributes": include_attributes}, process)
+
+
+def _face_to_dict(idx, face, stages):
+    """Convert a Face to the /detect response format (without emotion)."""
+    face_data = {
+        "id": str(idx),
+        "score": float(face.det_score) if hasattr(face, 'det_score') else 1.0,
+        "bbox": face.bbox.tolist() if hasattr(face, 'bbox') and face.bbox is not None else None,
+        "landmark": face.kps.tolist() if hasattr(face, 'kps') and face.kps is not None else None,
+        "age": int(face.age) if hasattr(face, 'age') and face.age is not None else None,
+        "gender": "male" if hasattr(face, 'gender') and face.gender == 1 else "female" if hasattr(face, 'gender') and face.gender == 0 else None,
+    }
+
+    # Include embedding when the recognition stage ran
+    if STAGE_RECOGNITION in stages:
+        if hasattr(face, 'embedding') and face.embedding is not None:
+            face_data["embedding"] = face.embedding
+            face_data["embedding_dim"] = len(face.embedding)
+        else:
+            face_data["embedding"] = None
+
+    # Add head pose and dense landmarks when the landmark stage ran
+    if STAGE_LANDMARKS in stages:
+        if face.pose is not None:
+            pitch, yaw, roll = face.pose
+            face_data["pose"] = {"yaw": float(yaw), "pitch": float(pitch), "roll": float(roll)}
+        if face.landmark_2d_106 is not None:
+            face_data["landmark_2d_106"] = face.landmark_2d_106.tolist()
+
+    return face_data
+
+
+def _detect_decoded(images, stages, detection_mode=None):
+    """
+    Detect faces in already decoded images, batching per-face models across images.
+
+    Args:
+        images: list of (filename, DecodedImage or None)
+        stages: stage plan from resolve_stages
+        detection_mode: detector sizing from detection.resolve_mode (None means DETECTION_MODE)
+
+    Returns:
+        list of {"faces": [...]} dicts (or {"error": ...}) in the same order as images
+    """
+    results = [None] * len(images)
+    detected = []
+    for index, (filename, decoded) in enumerate(images):
+        if decoded is None:
+            logger.error(f"Failed to decode image: {filename}")
+            metrics.count_decode_failure()
+            results[index] = {"error": "Invalid image format"}
+            continue
+
+        width, height = decoded.original_size
+        logger.info(f"Image size: {width}x{height}")
+
+        # Detection runs per image; a failure only affects that file
+        admission.check_deadline("detect")
+        try:
+            faces = detect_image_faces(decoded.image, stages, detection_mode)
+            logger.info(f"Detected {len(faces)} face(s) in the image")
+
+            # Small faces in a reduced decode are cut from a finer decode
+            # for recognition, gender/age and emotion
+            scale, face_images, offsets = _face_model_inputs(decoded, faces, stages)
+            detected.append((index, scale, faces, face_images, offsets))
+        except Exception as e:
+            metrics.count_model_error("detection")
+            logger.exception(f"Error detecting faces: {str(e)}")
+            results[index] = {"error": f"Failed to detect faces: {str(e)}"}
+
+    if not detected:
+        return results
+
+    # Expired requests stop here, before the per-face models
+    admission.check_deadline("face models")
+    try:
+        # Run gender/age and recognition over the faces of all images together
+        run_face_models([
+            (face_image, face)
+            for _, _, faces, face_images, _ in detected
+            for face, face_image in zip(faces, face_images)
+        ], stages)
 
+        # Convert each detected face to response format
+        emotion_inputs = []
+        emotion_targets = []
+        identify_inputs = []
+        identify_targets = []
+        for index, (scale_x, scale_y), faces, face_images, offsets in detected:
+            detected_faces = []
+            for idx, face in enumerate(faces):
+                # Collect face crops for a single batched emotion pass
+                face_crop = None
+                if STAGE_EMOTION in stages and hasattr(face, 'bbox') and face.bbox is not None:
+                    try:
+                        face_crop = crop_face(face_images[idx], face.bbox)
+                    except Exception as e:
+                        _mark_partial()
+                        logger.warning(f"Failed to extract emotion for face {idx}: {str(e)}")
+
+                # Report coordinates in the original photo
+                if offsets is not None:
+                    _translate_face(face, *offsets[idx])
+                if scale_x != 1.0 or scale_y != 1.0:
+                    _scale_face(face, scale_x, scale_y)
+
+                face_data = _face_to_dict(idx, face, stages)
+                if face_crop is not None and face_crop.size > 0:
+                    emotion_inputs.append(to_rgb(face_crop))
+                    emotion_targets.append(face_data)
+
+                if STAGE_IDENTIFY in stages:
+                    face_data["identity"] = None
+                    if face.embedding is not None:
+                        identify_inputs.append(face.embedding)
+                        identify_targets.append(face_data)
+
+                detected_faces.append(face_data)
+
+            results[index] = {"faces": detected_faces}
+
+        # Run emotion recognition for all faces at once and scatter results back
+        if emotion_inputs:
+            for face_data, emotion_data in zip(emotion_targets, get_emotions(emotion_inputs)):
+                if emotion_data:
+                    face_data["emotion"] = emotion_data["emotion"]
+                    face_data["emotion_scores"] = emotion_data["emotion_scores"]
+
+        # Match all faces against the gallery with one matrix product
+        if identify_inputs:
+            admission.check_deadline("identify")
+            with metrics.span("identify"):
+                identities = identify_faces(np.stack(identify_inputs))
+            for face_data, identity in zip(identify_targets, identities):
+                face_data["identity"] = identity
+
+        metrics.count_faces(sum(len(faces) for _, _, faces, _, _ in detected))
+
+    except admission.DeadlineExceeded:
+        raise
     except Exception as e:
-        logger.exception(f"Error extracting embedding: {str(e)}")
-        return {"error": f"Failed to extract embedding: {str(e)}"}
+        metrics.count_model_error("face_models")
+        logger.exception(f"Error detecting faces: {str(e)}")
+        for index, _, _, _, _ in detected:
+            results[index] = {"error": f"Failed to detect faces: {str(e)}"}
 
+    return results
 
-def detect_faces(file: UploadFile, include_embeddings: bool = False):
+
+def detect_faces(filename: str, data: bytes, include_embeddings: bool = False, stages=None, detection_mode=None):
     """
     Detect all faces in a full image.
 
     Args:
-        file: UploadFile containing an image with potentially multiple faces
+        filename: name of the uploaded file (for logging)
+        data: encoded image with potentially multiple faces
         include_embeddings: whether to include face embeddings in response
+        stages: stage plan from resolve_stages (None means the default plan)
+        detection_mode: detector sizing from detection.resolve_mode (None means DETECTION_MODE)
 
     Returns:
         dict with list of detected faces and their metadata in JSON format
     """
-    logger.info(f"Processing image for face detection: {file.filename}, include_embeddings={include_embeddings}")
+    if stages is None:
+        stages = resolve_stages(None, include_embeddings)
 
-    # Read image bytes
-    img_bytes = file.file.read()
-    np_arr = np.frombuffer(img_bytes, np.uint8)
-    img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+    logger.info(f"Processing image for face detection: {filename}, include_embeddings={include_embeddings}, stages={','.join(sorted(stages))}")
+    return _detect_uploads([(filename, data)], stages, detection_mode)[0][1]
 
-    if img is None:
-        logger.error("Failed to decode image")
-        return {"error": "Invalid image format"}
 
-    logger.info(f"Image size: {img.shape[1]}x{img.shape[0]}")
+def detect_faces_batch(items, include_embeddings: bool = False, stages=None, detection_mode=None):
+    """
+    Detect faces in many images in one request.
 
-    try:
-        # Detect all faces in the image
-        faces = app_insightface.get(img)
+    Files are decoded in parallel, detection runs per image and the per-face
+    models (genderage, recognition, emotion) run once over all faces.
 
-        logger.info(f"Detected {len(faces)} face(s) in the image")
+    Args:
+        items: list of (filename, bytes)
+        include_embeddings: whether to include face embeddings in response
+        stages: stage plan from resolve_stages (None means the default plan)
+        detection_mode: detector sizing from detection.resolve_mode (None means DETECTION_MODE)
 
-        # Convert each detected face to response format
-        detected_faces = []
-        for idx, face in enumerate(faces):
-            face_data = {
-                "id": str(idx),
-                "score": float(face.det_score) if hasattr(face, 'det_score') else 1.0,
-                "bbox": face.bbox.tolist() if hasattr(face, 'bbox') and face.bbox is not None else None,
-                "landmark": face.kps.tolist() if hasattr(face, 'kps') and face.kps is not None else None,
-                "age": int(face.age) if hasattr(face, 'age') and face.age is not None else None,
-                "gender": "male" if hasattr(face, 'gender') and face.gender == 1 else "female" if hasattr(face, 'gender') and face.gender == 0 else None,
-            }
+    Returns:
+        dict with per-file results (each with "filename" and either "faces" or an "error")
+    """
+    if stages is None:
+        stages = resolve_stages(None, include_embeddings)
 
-            # Optionally include embedding
-            if include_embeddings:
-                if hasattr(face, 'embedding') and face.embedding is not None:
-                    face_data["embedding"] = face.embedding.tolist()
-                    face_data["embedding_dim"] = len(face.embedding)
-                else:
-                    face_data["embedding"] = None
-
-            # Add emotion detection for each face
-            if hasattr(face, 'bbox') and face.bbox is not None:
-                try:
-                    # Crop face from image using bbox
-                    bbox = face.bbox.astype(int)
-                    x1, y1, x2, y2 = bbox[0], bbox[1], bbox[2], bbox[3]
-                    # Ensure bbox is within image bounds
-                    x1, y1 = max(0, x1), max(0, y1)
-                    x2, y2 = min(img.shape[1], x2), min(img.shape[0], y2)
-
-                    face_crop = img[y1:y2, x1:x2]
-
-                    if face_crop.size > 0:
-                        emotion_data = get_emotion(face_crop)
-                        if emotion_data:
-                            face_data["emotion"] = emotion_data["emotion"]
-                            face_data["emotion_scores"] = emotion_data["emotion_scores"]
-                except Exception as e:
-                    logger.warning(f"Failed to extract emotion for face {idx}: {str(e)}")
-
-            detected_faces.append(face_data)
-
-        return {"faces": detected_faces}
+    logger.info(f"Processing batch of {len(items)} image(s) for face detection, stages={','.join(sorted(stages))}")
+    results = _detect_uploads(items, stages, detection_mode)
+    return {"results": [{"filename": filename, **result} for filename, result in results]}
 
-    except Exception as e:
-        logger.exception(f"Error detecting faces: {str(e)}")
-        return {"error": f"Failed to detect faces: {str(e)}"}
 
+def detect_photos(items, stages):
+    """
+    Run the detection pipeline on many photos without the result cache.
+
+    Used by offline jobs (see backfill.py) that see every photo once.
+
+    Args:
+        items: list of (filename, bytes)
+        stages: stage plan from resolve_stages
+
+    Returns:
+        list of {"faces": [...]} dicts (or {"error": ...}) in the same order as items
+    """
+    return _detect_decoded(decode_all(items, decode_for_detection), stages)
+
+
+def _detect_uploads(uploads, stages, detection_mode=None):
+    def process(items):
+        return _detect_decoded(decode_all(items, decode_for_detection), stages, detection_mode)
+
+    params = {"stages": sorted(stages)}
+    if detection_mode is not None and detection_mode != config.DETECTION_MODE:
+        params["det_size"] = detection_mode
+    if STAGE_IDENTIFY in stages:
+        # Identification results are only valid for the gallery they were matched against
+        params["gallery_version"] = get_gallery().version
+    return _process_uploads(uploads, "detect", params, process)
+
+
+def identify_faces(embeddings):
+    """
+    Match face embeddings against the gallery.
+
+    Args:
+        embeddings: array of shape (N, 512)
+
+    Returns:
+        list of {"person_id", "score", "matches"} dicts, one per embedding; person_id is
+        None when no person reaches GALLERY_MATCH_THRESHOLD
+    """
+    identities = []
+    for matches in get_gallery().search(embeddings, top_k=config.GALLERY_TOP_K):
+        best = matches[0] if matches else None
+        recognized = best is not None and best["score"] >= config.GALLERY_MATCH_THRESHOLD
+        identities.append({
+            "person_id": best["person_id"] if recognized else None,
+            "score": best["score"] if best else None,
+            "matches": matches,
+        })
+    return identities
+
+
+def register_face(filename: str, data: bytes, person_id: int):
+    """
+    Add the largest face of a photo to the gallery under a person.
+
+    Args:
+        filename: name of the uploaded file (for logging)
+        data: encoded image
+        person_id: person the face belongs to
+
+    Returns:
+        dict with the person id, the new face id and the person's face count, or {"error": ...}
+    """
+    logger.info(f"Registering face for person {person_id}: {filename}")
+    result = _detect_decoded(decode_all([(filename, data)], decode_for_detection), frozenset({STAGE_DETECTION, STAGE_RECOGNITION}))[0]
+    if "error" in result:
+        return result
+
+    faces = [face for face in result["faces"] if face.get("embedding") is not None]
+    if not faces:
+        return {"error": "No face detected"}
+
+    # Several faces: register the largest one, which is the subject of a profile photo
+    face = max(faces, key=lambda face: (face["bbox"][2] - face["bbox"][0]) * (face["bbox"][3] - face["bbox"][1]))
+    gallery = get_gallery()
+    face_id = gallery.add(person_id, face["embedding"])[0]
+    return {
+        "person_id": person_id,
+        "face_id": face_id,
+        "bbox": face["bbox"],
+        "faces_detected": len(result["faces"]),
+        "person_faces": gallery.persons().get(person_id, 0),
+    }
+
+
+def recognize_faces(filename: str, data: bytes):
+    """
+    Detect faces in a photo and identify each of them against the gallery.
+
+    Returns:
+        same format as detect_faces, with an "identity" per face
+    """
+    logger.info(f"Recognizing faces: {filename}")
+    return _detect_uploads([(filename, data)], RECOGNIZE_STAGES)[0][1]
+
+
+def recognize_faces_batch(items):
+    """
+    Identify the faces of many photos; matching runs once over the faces of all photos.
+
+    Args:
+        items: list of (filename, bytes)
+
+    Returns:
+        dict with per-file results, as detect_faces_batch
+    """
+    logger.info(f"Recognizing faces in a batch of {len(items)} image(s)")
+    results = _detect_uploads(items, RECOGNIZE_STAGES)
+    return {"results": [{"filename": filename, **result} for filename, result in results]}
+
+
+def list_persons():
+    """
+    Persons registered in the gallery.
+
+    Returns:
+        dict with the persons and their face counts
+    """
+    persons = get_gallery().persons()
+    return {
+        "persons": [{"person_id": person_id, "faces": count} for person_id, count in persons.items()],
+        "total_faces": sum(persons.values()),
+    }
+
+
+def delete_person(person_id: int):
+    """
+    Remove all faces of a person from the gallery.
+
+    Returns:
+        dict with the person id and the number of faces removed
+    """
+    removed = get_gallery().remove_person(person_id)
+    logger.info(f"Removed {removed} face(s) of person {person_id} from the gallery")
+    return {"person_id": person_id, "removed": removed}
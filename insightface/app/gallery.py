@@ -0,0 +1,348 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+logger = logging.getLogger("face_service")
+
+DTYPES = {
+    "float32": np.float32,
+    "float16": np.float16,
+}
+
+# Rows scored per matrix product; bounds the float32 copy made of a float16 gallery
+_SEARCH_BLOCK_ROWS = 65536
+_MIN_CAPACITY = 1024
+
+
+class FaceGallery:
+    """
+    Person/face gallery answering top-K cosine queries in process.
+
+    Embeddings are stored L2-normalized as one contiguous (capacity, dim) matrix,
+    so a query is a single matrix product followed by argpartition. With a path
+    the matrix and the ids live in .npy files opened as memory maps, plus a small
+    meta.json with the row count and a version number. Writers take an exclusive
+    file lock and readers reload the maps whenever the version changes, so forked
+    inference workers share one gallery.
+
+    Files in the gallery directory:
+        embeddings.npy  (capacity, dim) matrix, first `count` rows valid
+        ids.npy         (capacity, 2) int64 rows of [person_id, face_id]
+        meta.json       count, capacity, dim, dtype, version, next_face_id
+    """
+
+    def __init__(self, dim: int = 512, path: str = None, dtype: str = "float32"):
+        """
+        Args:
+            dim: embedding dimension
+            path: gallery directory (None or "" keeps the gallery in memory only)
+            dtype: float32 or float16 storage for the embedding matrix
+        """
+        if dtype not in DTYPES:
+            raise ValueError(f"Unknown gallery dtype '{dtype}'. Allowed: {', '.join(DTYPES)}")
+
+        self.dim = dim
+        self.dtype = dtype
+        self.path = path or None
+        self._lock = threading.RLock()
+
+        self._meta = {"count": 0, "capacity": 0, "dim": dim, "dtype": dtype, "version": 0, "next_face_id": 1}
+        self._embeddings = np.zeros((0, dim), dtype=DTYPES[dtype])
+        self._ids = np.zeros((0, 2), dtype=np.int64)
+        self._person_index = None
+        self._loaded_version = None
+
+        if self.path:
+            os.makedirs(self.path, exist_ok=True)
+            with self._file_lock(fcntl.LOCK_EX):
+                if os.path.exists(self._meta_path):
+                    self._refresh()
+                    if self._meta["dim"] != dim:
+                        raise ValueError(f"Gallery at {self.path} has dimension {self._meta['dim']}, expected {dim}")
+                else:
+                    self._grow(_MIN_CAPACITY)
+                    self._write_meta()
+            logger.info(f"Face gallery opened at {self.path} with {self._meta['count']} face(s)")
+
+    @property
+    def _meta_path(self):
+        return os.path.join(self.path, "meta.json")
+
+    @property
+    def version(self) -> int:
+        """Counter bumped on every change; part of the cache key of identification results."""
+        with self._reading():
+            return self._meta["version"]
+
+    @contextmanager
+    def _file_lock(self, mode):
+        """Cross-process lock on the gallery directory (no-op for in-memory galleries)."""
+        if not self.path:
+            yield
+            return
+        with open(os.path.join(self.path, ".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, mode)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _reading(self):
+        """Hold a shared lock and reload the memory maps if another process changed the gallery."""
+        with self._lock, self._file_lock(fcntl.LOCK_SH):
+            if self.path:
+                self._refresh()
+            yield
+
+    def _refresh(self):
+        """Re-read meta.json and reopen the maps when the version differs (caller holds a file lock)."""
+        with open(self._meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["version"] == self._loaded_version:
+            return
+
+        capacity_changed = meta["capacity"] != self._meta["capacity"] or self._embeddings.shape[0] != meta["capacity"]
+        self._meta = meta
+        self.dtype = meta["dtype"]
+        if capacity_changed:
+            self._embeddings = np.load(os.path.join(self.path, "embeddings.npy"), mmap_mode="r+")
+            self._ids = np.load(os.path.join(self.path, "ids.npy"), mmap_mode="r+")
+        self._person_index = None
+        self._loaded_version = meta["version"]
+
+    def _write_meta(self):
+        """Flush the maps and atomically replace meta.json (caller holds the exclusive lock)."""
+        self._meta["version"] += 1
+        if self.path:
+            for array in (self._embeddings, self._ids):
+                if isinstance(array, np.memmap):
+                    array.flush()
+            partial = f"{self._meta_path}.{os.getpid()}.tmp"
+            with open(partial, "w", encoding="utf-8") as f:
+                json.dump(self._meta, f)
+            os.replace(partial, self._meta_path)
+        self._loaded_version = self._meta["version"]
+        self._person_index = None
+
+    def _grow(self, capacity: int):
+        """Reallocate the matrix and ids with a larger capacity, keeping the valid rows."""
+        count = self._meta["count"]
+        if self.path:
+            embeddings = _replace_npy(os.path.join(self.path, "embeddings.npy"), (capacity, self.dim), DTYPES[self.dtype], self._embeddings[:count])
+            ids = _replace_npy(os.path.join(self.path, "ids.npy"), (capacity, 2), np.int64, self._ids[:count])
+        else:
+            embeddings = np.zeros((capacity, self.dim), dtype=DTYPES[self.dtype])
+            ids = np.zeros((capacity, 2), dtype=np.int64)
+            embeddings[:count] = self._embeddings[:count]
+            ids[:count] = self._ids[:count]
+        self._embeddings, self._ids = embeddings, ids
+        self._meta["capacity"] = capacity
+
+    @contextmanager
+    def _writing(self):
+        with self._lock, self._file_lock(fcntl.LOCK_EX):
+            if self.path:
+                self._refresh()
+            yield
+            self._write_meta()
+
+    def add(self, person_id: int, embeddings) -> list:
+        """
+        Add faces of a person.
+
+        Args:
+            person_id: person the faces belong to
+            embeddings: array of shape (dim,) or (N, dim); normalized before storing
+
+        Returns:
+            list of the new face ids
+        """
+        embeddings = _normalize(np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim))
+
+        with self._writing():
+            count = self._meta["count"]
+            needed = count + len(embeddings)
+            if needed > self._meta["capacity"]:
+                self._grow(max(_MIN_CAPACITY, self._meta["capacity"] * 2, needed))
+
+            first_face_id = self._meta["next_face_id"]
+            face_ids = list(range(first_face_id, first_face_id + len(embeddings)))
+            self._embeddings[count:needed] = embeddings
+            self._ids[count:needed, 0] = person_id
+            self._ids[count:needed, 1] = face_ids
+            self._meta["count"] = needed
+            self._meta["next_face_id"] = first_face_id + len(embeddings)
+
+        return face_ids
+
+    def _remove_rows(self, rows):
+        """Swap-remove rows by moving the last valid rows into their place."""
+        count = self._meta["count"]
+        for row in sorted(rows, reverse=True):
+            last = count - 1
+            if row != last:
+                self._embeddings[row] = self._embeddings[last]
+                self._ids[row] = self._ids[last]
+            count -= 1
+        self._meta["count"] = count
+
+    def remove_person(self, person_id: int) -> int:
+        """
+        Remove every face of a person.
+
+        Returns:
+            number of faces removed
+        """
+        with self._writing():
+            rows = np.flatnonzero(self._ids[:self._meta["count"], 0] == person_id)
+            self._remove_rows(rows.tolist())
+        return len(rows)
+
+    def remove_face(self, face_id: int) -> bool:
+        """
+        Remove a single face.
+
+        Returns:
+            True if the face existed
+        """
+        with self._writing():
+            rows = np.flatnonzero(self._ids[:self._meta["count"], 1] == face_id)
+            self._remove_rows(rows.tolist())
+        return len(rows) > 0
+
+    def _persons(self):
+        """
+        Rows grouped by person (cached per version).
+
+        Returns:
+            (unique person ids, row order that puts each person's rows together,
+            start of every person's segment in that order)
+        """
+        if self._person_index is None:
+            person_ids, person_of_row = np.unique(self._ids[:self._meta["count"], 0], return_inverse=True)
+            order = np.argsort(person_of_row, kind="stable")
+            starts = np.searchsorted(person_of_row[order], np.arange(len(person_ids)))
+            self._person_index = (person_ids, order, starts)
+        return self._person_index
+
+    def search(self, queries, top_k: int = 5, threshold: float = None) -> list:
+        """
+        Find the most similar persons for each query embedding.
+
+        A person's score is the best cosine similarity over their faces.
+
+        Args:
+            queries: array of shape (dim,) or (M, dim)
+            top_k: number of persons returned per query
+            threshold: drop matches with a lower similarity (None keeps all)
+
+        Returns:
+            list (one per query) of lists of {"person_id", "face_id", "score"} sorted by score
+        """
+        queries = _normalize(np.asarray(queries, dtype=np.float32).reshape(-1, self.dim))
+
+        with self._reading():
+            count = self._meta["count"]
+            if count == 0 or len(queries) == 0:
+                return [[] for _ in range(len(queries))]
+
+            person_ids, order, starts = self._persons()
+
+            # (M, count) similarities, computed block by block in float32
+            scores = np.empty((len(queries), count), dtype=np.float32)
+            for start in range(0, count, _SEARCH_BLOCK_ROWS):
+                block = np.asarray(self._embeddings[start:min(start + _SEARCH_BLOCK_ROWS, count)], dtype=np.float32)
+                scores[:, start:start + len(block)] = queries @ block.T
+            face_ids = self._ids[order, 1]
+
+        # Group each person's rows together, then take the best face score per person
+        scores = np.take(scores, order, axis=1)
+        best = np.maximum.reduceat(scores, starts, axis=1)
+
+        # Top persons of every query, best first
+        k = min(top_k, len(person_ids))
+        top = np.argpartition(-best, k - 1, axis=1)[:, :k]
+        top = np.take_along_axis(top, np.argsort(-np.take_along_axis(best, top, axis=1), axis=1, kind="stable"), axis=1)
+        top_scores = np.take_along_axis(best, top, axis=1)
+        top_faces = face_ids[_segment_argmax(scores, starts, count, top)]
+
+        results = []
+        for query_persons, query_faces, query_scores in zip(person_ids[top].tolist(), top_faces.tolist(), top_scores.tolist()):
+            matches = []
+            for person_id, face_id, score in zip(query_persons, query_faces, query_scores):
+                if threshold is not None and score < threshold:
+                    break
+                matches.append({"person_id": person_id, "face_id": face_id, "score": score})
+            results.append(matches)
+
+        return results
+
+    def persons(self) -> dict:
+        """
+        Registered persons.
+
+        Returns:
+            {person_id: number of faces}
+        """
+        with self._reading():
+            person_ids, counts = np.unique(self._ids[:self._meta["count"], 0], return_counts=True)
+        return {int(person_id): int(count) for person_id, count in zip(person_ids, counts)}
+
+    def stats(self) -> dict:
+        """Size, storage and version of the gallery."""
+        with self._reading():
+            return {
+                "faces": self._meta["count"],
+                "capacity": self._meta["capacity"],
+                "dim": self.dim,
+                "dtype": self.dtype,
+                "version": self._meta["version"],
+                "path": self.path,
+            }
+
+
+def _normalize(embeddings):
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+
+def _segment_argmax(scores, starts, count: int, segments):
+    """
+    Best column of selected segments.
+
+    Args:
+        scores: (M, count) array whose columns are grouped into segments
+        starts: first column of every segment
+        count: number of columns
+        segments: (M, k) segment indices selected for each row
+
+    Returns:
+        (M, k) column of the highest score within each selected segment (the first one on ties)
+    """
+    lengths = np.diff(np.append(starts, count))[segments].ravel()
+    offsets = np.cumsum(lengths) - lengths
+    within = np.arange(lengths.sum()) - np.repeat(offsets, lengths)
+    columns = np.repeat(starts[segments].ravel(), lengths) + within
+    rows = np.repeat(np.repeat(np.arange(len(segments)), segments.shape[1]), lengths)
+
+    values = scores[rows, columns]
+    best = np.repeat(np.maximum.reduceat(values, offsets), lengths)
+    first = np.minimum.reduceat(np.where(values == best, within, count), offsets)
+    return starts[segments] + first.reshape(segments.shape)
+
+
+def _replace_npy(path, shape, dtype, rows):
+    """Write a new zero-filled .npy of the given shape with `rows` at the top and open it as a memory map."""
+    partial = f"{path}.{os.getpid()}.tmp"
+    array = np.lib.format.open_memmap(partial, mode="w+", dtype=dtype, shape=shape)
+    array[:len(rows)] = rows
+    array.flush()
+    del array
+    os.replace(partial, path)
+    return np.load(path, mmap_mode="r+")
@@ -0,0 +1,376 @@
+"""
+Streaming bulk ingestion: an archive or multipart stream of photos in, one
+NDJSON line per photo out.
+
+The request body is parsed in a dedicated thread while photos already parsed
+are decoded, detected and embedded on the inference executor, and each result
+is sent as soon as it is ready. All stages are connected by bounded queues, so
+a slow client (or a slow upload) stalls the pipeline instead of buffering it.
+"""
+import asyncio
+import concurrent.futures
+import io
+import logging
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+
+from multipart.multipart import MultipartParser, parse_options_header
+from starlette.responses import StreamingResponse
+
+from . import admission, config, encoding, metrics
+from .face_service import detect_faces
+
+logger = logging.getLogger("face_service")
+
+KIND_TAR = "tar"
+KIND_ZIP = "zip"
+KIND_MULTIPART = "multipart"
+
+_CONTENT_TYPES = {
+    "application/x-tar": KIND_TAR,
+    "application/tar": KIND_TAR,
+    "application/gzip": KIND_TAR,
+    "application/x-gzip": KIND_TAR,
+    "application/x-compressed-tar": KIND_TAR,
+    "application/zip": KIND_ZIP,
+    "application/x-zip-compressed": KIND_ZIP,
+    "multipart/form-data": KIND_MULTIPART,
+}
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff")
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# Request body chunks buffered between the socket and the parser thread
+_BODY_QUEUE_SIZE = 16
+_READ_SIZE = 64 * 1024
+
+# Marks the end of the body and of the parsed photos
+_END = object()
+
+
+class _Aborted(Exception):
+    """The response was closed (client gone); the parser thread stops."""
+
+
+def archive_kind(content_type: str) -> str:
+    """
+    Map the Content-Type of an /ingest request to the parser to use.
+
+    Raises:
+        ValueError: for unsupported content types
+    """
+    media_type = content_type.split(";")[0].strip().lower()
+    if media_type not in _CONTENT_TYPES:
+        raise ValueError(
+            f"Unsupported content type '{media_type}'. Send a tar (optionally gzip) or zip archive, or multipart/form-data"
+        )
+    return _CONTENT_TYPES[media_type]
+
+
+def _is_image(name: str) -> bool:
+    base = os.path.basename(name)
+    return not base.startswith(".") and "__MACOSX" not in name and base.lower().endswith(IMAGE_EXTENSIONS)
+
+
+class _Bridge:
+    """Lets the parser thread wait on coroutines of the event loop without outliving the response."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.closed = threading.Event()
+
+    def call(self, coro):
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        while True:
+            try:
+                return future.result(timeout=0.5)
+            except concurrent.futures.TimeoutError:
+                if self.closed.is_set():
+                    future.cancel()
+                    raise _Aborted()
+
+
+class _BodyReader(io.RawIOBase):
+    """Blocking file-like view of the request body, fed by the event loop through a bounded queue."""
+
+    def __init__(self, bridge, chunks):
+        self._bridge = bridge
+        self._chunks = chunks
+        self._buffer = b""
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, target):
+        while not self._buffer:
+            if self._eof:
+                return 0
+            chunk = self._bridge.call(self._chunks.get())
+            if chunk is _END:
+                self._eof = True
+                return 0
+            if isinstance(chunk, Exception):
+                raise chunk
+            self._buffer = chunk
+        size = min(len(target), len(self._buffer))
+        target[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+
+def _parse_tar(reader, emit):
+    # Stream mode ("r|*") reads members strictly in order and never seeks
+    with tarfile.open(fileobj=reader, mode="r|*") as archive:
+        for member in archive:
+            if not member.isfile() or not _is_image(member.name):
+                continue
+            if member.size > config.INGEST_MAX_FILE_SIZE:
+                emit(member.name, None)
+                continue
+            emit(member.name, archive.extractfile(member).read())
+
+
+def _parse_zip(reader, emit):
+    # The zip directory is at the end of the archive: spool the body first
+    with tempfile.SpooledTemporaryFile(max_size=config.INGEST_SPOOL_MEMORY) as spool:
+        shutil.copyfileobj(reader, spool, _READ_SIZE)
+        spool.seek(0)
+        with zipfile.ZipFile(spool) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not _is_image(info.filename):
+                    continue
+                if info.file_size > config.INGEST_MAX_FILE_SIZE:
+                    emit(info.filename, None)
+                    continue
+                emit(info.filename, archive.read(info))
+
+
+def _parse_multipart(reader, emit, boundary):
+    part = {}
+
+    def on_part_begin():
+        part.clear()
+        part.update(headers={}, data=bytearray(), header_field=b"", header_value=b"", too_large=False)
+
+    def on_header_field(data, start, end):
+        part["header_field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        part["header_value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][part["header_field"].lower()] = part["header_value"]
+        part["header_field"] = part["header_value"] = b""
+
+    def on_part_data(data, start, end):
+        if part["too_large"]:
+            return
+        if len(part["data"]) + end - start > config.INGEST_MAX_FILE_SIZE:
+            part["too_large"] = True
+            part["data"] = bytearray()
+            return
+        part["data"] += data[start:end]
+
+    def on_part_end():
+        _, options = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        filename = options.get(b"filename")
+        if filename is None:
+            return  # a plain form field, not a file
+        emit(filename.decode("utf-8", "replace"), None if part["too_large"] else bytes(part["data"]))
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+    while True:
+        chunk = reader.read(_READ_SIZE)
+        if not chunk:
+            break
+        parser.write(chunk)
+    parser.finalize()
+
+
+def _parse(kind, content_type, bridge, chunks, photos):
+    """Parser thread: turn the body into (filename, bytes) items on the photos queue."""
+    reader = io.BufferedReader(_BodyReader(bridge, chunks), _READ_SIZE)
+
+    def emit(filename, data):
+        bridge.call(photos.put((filename, data)))
+
+    try:
+        if kind == KIND_TAR:
+            _parse_tar(reader, emit)
+        elif kind == KIND_ZIP:
+            _parse_zip(reader, emit)
+        else:
+            _, options = parse_options_header(content_type)
+            boundary = options.get(b"boundary")
+            if not boundary:
+                raise ValueError("multipart body without a boundary")
+            _parse_multipart(reader, emit, boundary)
+        bridge.call(photos.put(_END))
+    except _Aborted:
+        pass
+    except Exception as e:
+        logger.warning(f"Ingestion stopped, the upload could not be parsed: {str(e)}")
+        try:
+            bridge.call(photos.put(e))
+        except _Aborted:
+            pass
+
+
+async def _pump(body, chunks):
+    """Copy the request body into the bounded chunk queue (waits while the parser is behind)."""
+    try:
+        async for chunk in body:
+            if chunk:
+                await chunks.put(chunk)
+        await chunks.put(_END)
+    except Exception as e:
+        await chunks.put(e)
+
+
+def ingest_photo(index: int, filename: str, data: bytes, stages, fmt):
+    """
+    Process one photo of an ingestion stream (runs on the inference executor).
+
+    Args:
+        index: position of the photo in the upload
+        filename: member or part name
+        data: encoded image, or None when the file exceeded INGEST_MAX_FILE_SIZE
+        stages: stage plan from resolve_stages
+        fmt: ResponseFormat with a format from encoding.LINE_FORMATS
+
+    Returns:
+        (NDJSON line, whether the photo failed, metrics report)
+    """
+    with metrics.collect() as request_metrics:
+        if data is None:
+            result = {"error": f"File larger than {config.INGEST_MAX_FILE_SIZE} bytes"}
+        else:
+            result = detect_faces(filename, data, stages=stages)
+        with metrics.span("serialize"):
+            line = encoding.render_line({"index": index, "filename": filename, **result}, fmt)
+    return line, "error" in result, request_metrics.report()
+
+
+async def _admitted_photo(index, filename, data, stages, fmt):
+    # Photos wait behind interactive requests; the ingestion window already
+    # bounds how many are queued, so they are never rejected
+    queue_seconds, (line, failed, report) = await admission.controller.run(
+        admission.BACKGROUND, None, ingest_photo, index, filename, data, stages, fmt, bounded=False
+    )
+    report["stages"] = {"queue": queue_seconds, **report["stages"]}
+    return line, failed, report
+
+
+async def stream_results(body, content_type: str, stages, fmt):
+    """
+    Ingest the photos of a request body and yield one NDJSON line per photo.
+
+    Lines are yielded in completion order and carry the "index" of the photo in
+    the upload. The last line is a summary with the number of photos and errors.
+
+    Args:
+        body: async iterator of body chunks (request.stream())
+        content_type: Content-Type header of the request
+        stages: stage plan from resolve_stages
+        fmt: ResponseFormat with a format from encoding.LINE_FORMATS
+    """
+    kind = archive_kind(content_type)
+    loop = asyncio.get_running_loop()
+    bridge = _Bridge(loop)
+    chunks = asyncio.Queue(maxsize=_BODY_QUEUE_SIZE)
+    photos = asyncio.Queue(maxsize=config.INGEST_QUEUE_SIZE)
+
+    pump = asyncio.ensure_future(_pump(body, chunks))
+    parser = threading.Thread(
+        target=_parse, args=(kind, content_type, bridge, chunks, photos), name="ingest-parser", daemon=True
+    )
+    parser.start()
+
+    started = time.perf_counter()
+    in_flight = {}
+    next_photo = None
+    count = errors = 0
+    finished = False
+    try:
+        while True:
+            # Take the next photo only while there is room in the inference window
+            if next_photo is None and not finished and len(in_flight) < config.INGEST_CONCURRENCY:
+                next_photo = asyncio.ensure_future(photos.get())
+
+            waiting = set(in_flight)
+            if next_photo is not None:
+                waiting.add(next_photo)
+            if not waiting:
+                break
+
+            done, _ = await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+
+            if next_photo in done:
+                item = next_photo.result()
+                next_photo = None
+                if item is _END:
+                    finished = True
+                elif isinstance(item, Exception):
+                    finished = True
+                    errors += 1
+                    yield encoding.render_line({"error": f"Failed to read the upload: {str(item)}"})
+                else:
+                    filename, data = item
+                    task = asyncio.ensure_future(_admitted_photo(count, filename, data, stages, fmt))
+                    in_flight[task] = time.perf_counter()
+                    count += 1
+
+            for task in done:
+                if task not in in_flight:
+                    continue
+                task_started = in_flight.pop(task)
+                line, failed, report = task.result()
+                metrics.observe("ingest", report, time.perf_counter() - task_started)
+                errors += failed
+                yield line
+
+        elapsed = time.perf_counter() - started
+        logger.info(f"Ingested {count} photo(s) in {elapsed:.1f}s, {errors} error(s)")
+        yield encoding.render_line({"summary": {"photos": count, "errors": errors, "seconds": round(elapsed, 3)}})
+    finally:
+        bridge.closed.set()
+        pump.cancel()
+        if next_photo is not None:
+            next_photo.cancel()
+        for task in in_flight:
+            task.cancel()
+
+
+class NDJSONStreamingResponse(StreamingResponse):
+    """
+    Streaming response that leaves receive() to the request body.
+
+    StreamingResponse may listen for a disconnect on receive() while streaming,
+    which would swallow body chunks that /ingest is still reading. Here a gone
+    client surfaces as a failed send or an aborted body read instead.
+    """
+
+    media_type = NDJSON_MEDIA_TYPE
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        try:
+            async for chunk in self.body_iterator:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            await self.body_iterator.aclose()
@@ -1,20 +1,207 @@
-from fastapi import FastAPI, UploadFile, File, Query
-from .face_service import embed_cropped_face, detect_faces
+import time
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+from fastapi import FastAPI, UploadFile, File, Query, HTTPException, Header, Depends, Request
+from fastapi.responses import JSONResponse, Response
+from .face_service import (
+    embed_cropped_face,
+    embed_cropped_faces,
+    detect_faces,
+    detect_faces_batch,
+    resolve_stages,
+    get_stats,
+    clear_cache,
+    register_face,
+    recognize_faces,
+    recognize_faces_batch,
+    list_persons,
+    delete_person,
+)
+from .clustering import cluster_embeddings
+from .detection import resolve_mode
+from .models import registry
+from . import admission, config, executor, encoding, ingest, metrics
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Models are warmed up in the background; the server accepts connections right away
+    if executor.uses_processes():
+        executor.start_process_pool()
+    else:
+        registry.start_warm_up(config.WARMUP_MODELS)
+    yield
+    executor.shutdown()
+
 
 app = FastAPI(
     title="InsightFace ArcFace API",
     version="3.1",
-    description="Face detection and embedding extraction service using InsightFace (ArcFace Glint360K)"
+    description="Face detection and embedding extraction service using InsightFace (ArcFace Glint360K)",
+    lifespan=lifespan
 )
 
+
+# Endpoints admitted as background work unless the request asks otherwise
+_BACKGROUND_ENDPOINTS = {"detect_batch", "embed_batch", "batch_recognize", "cluster"}
+
+
+def _render(deadline, fmt, fn, *args):
+    """
+    Call a service function and serialize its result.
+
+    Runs on the inference executor so that decoding, inference and
+    response encoding never block the event loop. In multi-process mode
+    the arguments are plain bytes/data so they can be sent to a worker.
+
+    Returns:
+        (response, stage timings and counters of the call); the response is a
+        504 when the deadline passed between two stages
+    """
+    with metrics.collect() as request_metrics, admission.deadline_scope(deadline):
+        try:
+            result = fn(*args)
+        except admission.DeadlineExceeded as e:
+            return JSONResponse({"detail": str(e)}, status_code=504), request_metrics.report()
+        with metrics.span("serialize"):
+            response = encoding.render(result, fmt)
+    return response, request_metrics.report()
+
+
+async def _read_uploads(files):
+    """
+    Read uploaded files into (filename, bytes) pairs.
+
+    Returns:
+        (list of (filename, bytes), seconds spent reading)
+    """
+    started = time.perf_counter()
+    items = [(file.filename, await file.read()) for file in files]
+    return items, time.perf_counter() - started
+
+
+async def _infer(endpoint, policy, read_seconds, fmt, fn, *args):
+    """
+    Admit the request, run _render on the inference executor and export its stage timings.
+
+    The timings are measured where the work runs (thread or inference process)
+    and recorded here, in the HTTP process that serves /metrics.
+
+    Raises:
+        HTTPException: 503/429 when the admission queue is full, 504 when the
+            deadline passed while queued (all with Retry-After)
+    """
+    priority = policy.priority or (admission.BACKGROUND if endpoint in _BACKGROUND_ENDPOINTS else admission.INTERACTIVE)
+    started = time.perf_counter()
+    try:
+        queue_seconds, (response, report) = await admission.controller.run(
+            priority, policy.deadline, _render, policy.deadline, fmt, fn, *args
+        )
+    except admission.Rejected as e:
+        metrics.count_shed(endpoint, e.reason)
+        raise HTTPException(status_code=e.status_code, detail=e.detail, headers={"Retry-After": str(e.retry_after)})
+    if response.status_code == 504:
+        metrics.count_shed(endpoint, admission.REASON_DEADLINE)
+    report["stages"] = {"read": read_seconds, "queue": queue_seconds, **report["stages"]}
+    metrics.observe(endpoint, report, read_seconds + time.perf_counter() - started)
+    if config.SERVER_TIMING:
+        response.headers["Server-Timing"] = metrics.server_timing(report)
+    return response
+
+
+def response_format(
+    format: Optional[str] = Query(None, description="Embedding encoding: json (default), base64, msgpack or binary. Overrides the Accept header"),
+    dtype: str = Query("float32", description="Element type for base64/msgpack/binary embeddings: float32 or float16"),
+    normalize: bool = Query(False, description="Return L2-normalized embeddings"),
+    accept: Optional[str] = Header(None)
+) -> encoding.ResponseFormat:
+    """Negotiate how embeddings are encoded, shared by all endpoints that return embeddings."""
+    try:
+        return encoding.negotiate(format, dtype, normalize, accept)
+    except ValueError as e:
+        raise HTTPException(status_code=406, detail=str(e))
+
+
+def request_policy(
+    priority: Optional[str] = Query(None, description="Admission priority: interactive or background (default depends on the endpoint). Overrides X-Priority"),
+    deadline_ms: Optional[int] = Query(None, description="Time budget in milliseconds; work still queued or running after it is dropped with 504. Overrides X-Deadline-Ms"),
+    x_priority: Optional[str] = Header(None),
+    x_deadline_ms: Optional[int] = Header(None)
+) -> admission.RequestPolicy:
+    """Priority class and deadline of an inference request, shared by all endpoints that run models."""
+    try:
+        return admission.resolve_policy(
+            priority if priority is not None else x_priority,
+            deadline_ms if deadline_ms is not None else x_deadline_ms
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @app.get("/health")
 async def health():
     return {"status": "ok"}
 
+@app.get("/ready")
+async def ready():
+    """
+    Readiness probe: 200 once the warm-up models are loaded and have run a dummy batch, 503 before that
+    and while the inference processes restart after one of them died.
+
+    Returns:
+        JSON with overall readiness and the state of each model
+    """
+    if executor.uses_processes():
+        status = {"ready": executor.processes_ready(), "workers": config.INFERENCE_PROCESSES}
+    else:
+        status = registry.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+@app.get("/stats")
+async def stats():
+    """
+    Runtime statistics for tuning throughput against latency.
+
+    With INFERENCE_PROCESSES > 0 the numbers come from whichever worker handles the call.
+
+    Returns:
+        JSON with micro-batcher queue depths, batch-size histograms, result cache
+        counters and the admission queue of the HTTP process
+    """
+    return {**await executor.run_inference(get_stats), "admission": admission.controller.stats()}
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """
+    Prometheus metrics: per-stage latency histograms labeled by endpoint and
+    face-count bucket, faces processed, decode failures and model errors.
+    """
+    if not config.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    try:
+        body, content_type = metrics.latest()
+    except RuntimeError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    return Response(content=body, media_type=content_type)
+
+@app.delete("/cache")
+async def delete_cache():
+    """
+    Invalidate all cached detect/embed results (memory and disk tiers).
+    """
+    await executor.run_inference(clear_cache)
+    return {"status": "cleared"}
+
 @app.post("/detect")
 async def detect(
     file: UploadFile = File(...),
-    include_embeddings: bool = Query(False, description="Include face embeddings (512-dim vectors)")
+    include_embeddings: bool = Query(False, description="Include face embeddings (512-dim vectors)"),
+    stages: Optional[str] = Query(None, description="Comma-separated models to run: det,lmk,ga,rec,emotion,id (default: det,ga,emotion)"),
+    identify: bool = Query(False, description="Match each face against the registered persons (adds the id stage)"),
+    det_size: Optional[str] = Query(None, description="Detector input: auto (default), tiled, fixed or a square size such as 320"),
+    fmt: encoding.ResponseFormat = Depends(response_format),
+    policy: admission.RequestPolicy = Depends(request_policy)
 ):
     """
     Detect all faces in a full image.
@@ -25,16 +212,31 @@ async def detect(
     Args:
         file: Image file (can contain multiple faces)
         include_embeddings: If true, includes 512-dimensional embedding vectors for each face
+        stages: Which models to run. Only the requested models are executed, e.g.
+            "det" skips landmarks, gender/age, recognition and emotion entirely
+        identify: If true, each face gets an "identity" with the best matching persons
+        det_size: Detector sizing. "auto" fits the detector input to the image and adds
+            overlapping tiles for crowded photos, "tiled" always tiles large photos,
+            "fixed" is one 640x640 pass, a number is one pass at that square size
 
     Returns:
         JSON with list of detected faces and their attributes
     """
-    return detect_faces(file, include_embeddings)
+    try:
+        stage_plan = resolve_stages(stages, include_embeddings, identify)
+        detection_mode = resolve_mode(det_size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    [(filename, data)], read_seconds = await _read_uploads([file])
+    return await _infer("detect", policy, read_seconds, fmt, detect_faces, filename, data, include_embeddings, stage_plan, detection_mode)
 
 @app.post("/embed")
 async def embed(
     file: UploadFile = File(...),
-    include_attributes: bool = Query(False, description="Include face attributes (age, gender, pose)")
+    include_attributes: bool = Query(False, description="Include face attributes (age, gender, pose)"),
+    fmt: encoding.ResponseFormat = Depends(response_format),
+    policy: admission.RequestPolicy = Depends(request_policy)
 ):
     """
     Extract face embedding from a pre-cropped face image.
@@ -49,4 +251,199 @@ async def embed(
     Returns:
         JSON with embedding vector, metadata, and optionally face attributes
     """
-    return embed_cropped_face(file, include_attributes)
+    [(filename, data)], read_seconds = await _read_uploads([file])
+    return await _infer("embed", policy, read_seconds, fmt, embed_cropped_face, filename, data, include_attributes)
+
+@app.post("/detect/batch")
+async def detect_batch(
+    files: List[UploadFile] = File(...),
+    include_embeddings: bool = Query(False, description="Include face embeddings (512-dim vectors)"),
+    stages: Optional[str] = Query(None, description="Comma-separated models to run: det,lmk,ga,rec,emotion,id (default: det,ga,emotion)"),
+    identify: bool = Query(False, description="Match each face against the registered persons (adds the id stage)"),
+    det_size: Optional[str] = Query(None, description="Detector input: auto (default), tiled, fixed or a square size such as 320"),
+    fmt: encoding.ResponseFormat = Depends(response_format),
+    policy: admission.RequestPolicy = Depends(request_policy)
+):
+    """
+    Detect faces in many images in one multipart request.
+
+    Files are decoded in parallel and the per-face models run once over the
+    faces of all images. A file that fails does not fail the whole request.
+
+    Args:
+        files: Image files (each can contain multiple faces)
+        include_embeddings: If true, includes 512-dimensional embedding vectors for each face
+        stages: Which models to run, same as for /detect
+        identify: Match faces against the registered persons, same as for /detect
+        det_size: Detector sizing, same as for /detect
+
+    Returns:
+        JSON with per-file results: filename plus either faces or error
+    """
+    try:
+        stage_plan = resolve_stages(stages, include_embeddings, identify)
+        detection_mode = resolve_mode(det_size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    items, read_seconds = await _read_uploads(files)
+    return await _infer("detect_batch", policy, read_seconds, fmt, detect_faces_batch, items, include_embeddings, stage_plan, detection_mode)
+
+@app.post("/embed/batch")
+async def embed_batch(
+    files: List[UploadFile] = File(...),
+    include_attributes: bool = Query(False, description="Include face attributes (age, gender, pose)"),
+    fmt: encoding.ResponseFormat = Depends(response_format),
+    policy: admission.RequestPolicy = Depends(request_policy)
+):
+    """
+    Extract embeddings from many pre-cropped face images in one multipart request.
+
+    Recognition, genderage and emotion each run once over the whole batch.
+
+    Args:
+        files: Image files, each with a single cropped face
+        include_attributes: If true, includes age, gender, pose and emotion for each face
+
+    Returns:
+        JSON with per-file results: filename plus either the embedding or error
+    """
+    items, read_seconds = await _read_uploads(files)
+    return await _infer("embed_batch", policy, read_seconds, fmt, embed_cropped_faces, items, include_attributes)
+
+@app.post("/ingest")
+async def ingest_stream(
+    request: Request,
+    include_embeddings: bool = Query(True, description="Include face embeddings (512-dim vectors)"),
+    stages: Optional[str] = Query(None, description="Comma-separated models to run: det,lmk,ga,rec,emotion,id (default: det,ga,emotion)"),
+    identify: bool = Query(False, description="Match each face against the registered persons (adds the id stage)"),
+    fmt: encoding.ResponseFormat = Depends(response_format)
+):
+    """
+    Bulk ingestion of a photo library in one streaming request.
+
+    The body is a tar (optionally gzip-compressed) or zip archive, or a multipart
+    stream of files. Photos are processed while the upload is still arriving and
+    the response is NDJSON with one /detect result per photo, sent as soon as it
+    is ready (in completion order, with the "index" of the photo in the upload),
+    followed by a summary line. A slow reader pauses the ingestion.
+
+    Args:
+        include_embeddings: If true (default), includes embedding vectors for each face
+        stages: Which models to run, same as for /detect
+        identify: Match faces against the registered persons, same as for /detect
+
+    Returns:
+        application/x-ndjson stream
+    """
+    try:
+        stage_plan = resolve_stages(stages, include_embeddings, identify)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if fmt.format not in encoding.LINE_FORMATS:
+        raise HTTPException(status_code=406, detail=f"/ingest streams NDJSON; use format {' or '.join(encoding.LINE_FORMATS)}")
+
+    content_type = request.headers.get("content-type", "")
+    try:
+        ingest.archive_kind(content_type)
+    except ValueError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+
+    return ingest.NDJSONStreamingResponse(ingest.stream_results(request.stream(), content_type, stage_plan, fmt))
+
+@app.post("/register")
+async def register(
+    person_id: int = Query(..., description="Person the face belongs to"),
+    file: UploadFile = File(...),
+    policy: admission.RequestPolicy = Depends(request_policy)
+):
+    """
+    Register the largest face of a photo in the gallery.
+
+    Args:
+        person_id: Person identifier
+        file: Photo of the person
+
+    Returns:
+        JSON with the person id, the new face id and the number of faces of the person
+    """
+    [(filename, data)], read_seconds = await _read_uploads([file])
+    return await _infer("register", policy, read_seconds, encoding.ResponseFormat(), register_face, filename, data, person_id)
+
+@app.post("/recognize")
+async def recognize(
+    file: UploadFile = File(...),
+    fmt: encoding.ResponseFormat = Depends(response_format),
+    policy: admission.RequestPolicy = Depends(request_policy)
+):
+    """
+    Detect faces in a photo and identify each of them against the registered persons.
+
+    Args:
+        file: Image file (can contain multiple faces)
+
+    Returns:
+        JSON with the detected faces, each with an identity (best person or null) and the top matches
+    """
+    [(filename, data)], read_seconds = await _read_uploads([file])
+    return await _infer("recognize", policy, read_seconds, fmt, recognize_faces, filename, data)
+
+@app.post("/batch_recognize")
+async def batch_recognize(
+    files: List[UploadFile] = File(...),
+    fmt: encoding.ResponseFormat = Depends(response_format),
+    policy: admission.RequestPolicy = Depends(request_policy)
+):
+    """
+    Identify the faces of many photos in one multipart request.
+
+    Args:
+        files: Image files
+
+    Returns:
+        JSON with per-file results: filename plus either faces (with identities) or error
+    """
+    items, read_seconds = await _read_uploads(files)
+    return await _infer("batch_recognize", policy, read_seconds, fmt, recognize_faces_batch, items)
+
+@app.post("/cluster")
+async def cluster(
+    file: UploadFile = File(...),
+    threshold: Optional[float] = Query(None, ge=-1.0, le=1.0, description="Cosine similarity at which two faces are neighbours (default CLUSTER_THRESHOLD)"),
+    min_samples: Optional[int] = Query(None, ge=1, description="Neighbours (including the face) that start a cluster (default CLUSTER_MIN_SAMPLES)"),
+    top_k: int = Query(3, ge=1, le=100, description="Representative faces returned per cluster"),
+    policy: admission.RequestPolicy = Depends(request_policy)
+):
+    """
+    Group face embeddings into identities.
+
+    The file is an embedding file produced by the service: a .npy matrix, a
+    format=binary response, JSON/NDJSON results of /detect, /embed or /ingest,
+    or {"embeddings": [[...], ...]}.
+
+    Returns:
+        JSON with a label per face (-1 for unclustered faces), the clusters by
+        descending size with their most central faces, and the noise count
+    """
+    [(filename, data)], read_seconds = await _read_uploads([file])
+    return await _infer("cluster", policy, read_seconds, encoding.ResponseFormat(), cluster_embeddings, data, filename, threshold, min_samples, top_k)
+
+@app.get("/persons")
+async def persons():
+    """
+    List the registered persons.
+
+    Returns:
+        JSON with person ids, their face counts and the total number of faces
+    """
+    return await executor.run_inference(list_persons)
+
+@app.delete("/persons/{person_id}")
+async def remove_person(person_id: int):
+    """
+    Remove all faces of a person from the gallery.
+
+    Returns:
+        JSON with the person id and the number of faces removed
+    """
+    return await executor.run_inference(delete_person, person_id)
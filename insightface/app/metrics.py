@@ -0,0 +1,178 @@
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import prometheus_client
+except ImportError:  # optional dependency, only needed for /metrics
+    prometheus_client = None
+
+# Pipeline stages timed per request
+STAGES = ("read", "queue", "decode", "detect", "landmarks", "genderage", "recognition", "emotion", "identify", "serialize")
+
+# Face-count buckets used as a label, so that latency of 1-face and 60-face photos is not mixed
+_FACE_BUCKETS = ((0, "0"), (1, "1"), (5, "2-5"), (20, "6-20"), (50, "21-50"))
+
+_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_local = threading.local()
+
+
+class RequestMetrics:
+    """
+    Stage timings and counters of one request.
+
+    Collected in the thread (or inference process) that runs the request and
+    returned to the HTTP process as a plain dict via report().
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.faces = 0
+        self.decode_failures = 0
+        self.model_errors = {}
+
+    def add_stage(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def report(self) -> dict:
+        return {
+            "stages": dict(self.stages),
+            "faces": self.faces,
+            "decode_failures": self.decode_failures,
+            "model_errors": dict(self.model_errors),
+        }
+
+
+@contextmanager
+def collect():
+    """
+    Record the spans and counters of the code run inside the block.
+
+    Yields:
+        RequestMetrics
+    """
+    previous = getattr(_local, "current", None)
+    current = RequestMetrics()
+    _local.current = current
+    try:
+        yield current
+    finally:
+        _local.current = previous
+
+
+@contextmanager
+def span(stage: str):
+    """Add the duration of the block to a stage of the current request (no-op outside collect())."""
+    current = getattr(_local, "current", None)
+    if current is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        current.add_stage(stage, time.perf_counter() - started)
+
+
+def count_faces(count: int):
+    current = getattr(_local, "current", None)
+    if current is not None:
+        current.faces += count
+
+
+def count_decode_failure():
+    current = getattr(_local, "current", None)
+    if current is not None:
+        current.decode_failures += 1
+
+
+def count_model_error(model: str):
+    current = getattr(_local, "current", None)
+    if current is not None:
+        current.model_errors[model] = current.model_errors.get(model, 0) + 1
+
+
+def face_bucket(count: int) -> str:
+    """Label of the face-count bucket a request falls into."""
+    for upper, label in _FACE_BUCKETS:
+        if count <= upper:
+            return label
+    return "51+"
+
+
+if prometheus_client is not None:
+    _STAGE_SECONDS = prometheus_client.Histogram(
+        "face_service_stage_seconds", "Time spent in each pipeline stage per request",
+        ["endpoint", "stage", "faces"], buckets=_LATENCY_BUCKETS
+    )
+    _REQUEST_SECONDS = prometheus_client.Histogram(
+        "face_service_request_seconds", "End-to-end request time",
+        ["endpoint", "faces"], buckets=_LATENCY_BUCKETS
+    )
+    _FACES = prometheus_client.Counter("face_service_faces_processed_total", "Faces processed", ["endpoint"])
+    _DECODE_FAILURES = prometheus_client.Counter(
+        "face_service_decode_failures_total", "Uploaded files that could not be decoded", ["endpoint"]
+    )
+    _MODEL_ERRORS = prometheus_client.Counter("face_service_model_errors_total", "Model inference errors", ["model"])
+    _SHED = prometheus_client.Counter(
+        "face_service_shed_requests_total", "Requests rejected or dropped by admission control", ["endpoint", "reason"]
+    )
+
+
+def observe(endpoint: str, report: dict, total_seconds: float):
+    """
+    Export a request report as Prometheus metrics.
+
+    Args:
+        endpoint: endpoint name used as label
+        report: RequestMetrics.report()
+        total_seconds: end-to-end request time
+    """
+    if prometheus_client is None:
+        return
+
+    faces = face_bucket(report["faces"])
+    for stage, seconds in report["stages"].items():
+        _STAGE_SECONDS.labels(endpoint, stage, faces).observe(seconds)
+    _REQUEST_SECONDS.labels(endpoint, faces).observe(total_seconds)
+    if report["faces"]:
+        _FACES.labels(endpoint).inc(report["faces"])
+    if report["decode_failures"]:
+        _DECODE_FAILURES.labels(endpoint).inc(report["decode_failures"])
+    for model, count in report["model_errors"].items():
+        _MODEL_ERRORS.labels(model).inc(count)
+
+
+def count_shed(endpoint: str, reason: str):
+    """
+    Count a request that was rejected when queued or dropped at its deadline.
+
+    Args:
+        endpoint: endpoint name used as label
+        reason: queue_full, background_limit or deadline
+    """
+    if prometheus_client is not None:
+        _SHED.labels(endpoint, reason).inc()
+
+
+def server_timing(report: dict) -> str:
+    """
+    Format stage timings as a Server-Timing header value (durations in ms).
+    """
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in report["stages"].items())
+
+
+def latest():
+    """
+    Current metrics in the Prometheus text format.
+
+    Returns:
+        (body bytes, content type)
+
+    Raises:
+        RuntimeError: if prometheus_client is not installed
+    """
+    if prometheus_client is None:
+        raise RuntimeError("metrics are not available: the prometheus_client package is not installed")
+    return prometheus_client.generate_latest(), prometheus_client.CONTENT_TYPE_LATEST
@@ -0,0 +1,336 @@
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+import onnxruntime as ort
+from insightface.app.common import Face
+from insightface.model_zoo import ArcFaceONNX, Attribute, Landmark, RetinaFace
+from insightface.utils import ensure_available
+
+from . import config
+from .emotion_onnx import OnnxEmotionRecognizer
+from .ort_profile import create_session
+
+logger = logging.getLogger("face_service")
+
+# InsightFace model pack and the ONNX file of each model in it
+MODEL_PACK = 'buffalo_l'
+MODEL_PACK_ROOT = '~/.insightface'
+PACK_FILES = {
+    "detection": "det_10g.onnx",
+    "landmark_3d_68": "1k3d68.onnx",
+    "landmark_2d_106": "2d106det.onnx",
+    "genderage": "genderage.onnx",
+    "recognition": "w600k_r50.onnx",
+}
+# insightface wrapper class of each pack model
+PACK_CLASSES = {
+    "detection": RetinaFace,
+    "landmark_3d_68": Landmark,
+    "landmark_2d_106": Landmark,
+    "genderage": Attribute,
+    "recognition": ArcFaceONNX,
+}
+DETECTION_SIZE = (640, 640)
+DETECTION_THRESHOLD = 0.5
+
+# HSEmotion model; loaded only when emotion recognition is first used. Runs on
+# onnxruntime from an exported file (see emotion_onnx.py) or on torch as a fallback.
+EMOTION = "emotion"
+EMOTION_MODEL_NAME = 'enet_b0_8_best_afew'
+
+MODEL_NAMES = tuple(PACK_FILES) + (EMOTION,)
+
+# ONNX file of every model that can run on onnxruntime
+ONNX_FILES = dict(PACK_FILES, **{EMOTION: f"{EMOTION_MODEL_NAME}.onnx"})
+
+PRECISIONS = ("fp32", "int8")
+EMOTION_BACKENDS = ("auto", "onnx", "torch")
+
+_providers = None
+
+
+def quantized_model_file(name: str) -> str:
+    """Path of the INT8 variant of a model in QUANTIZED_MODEL_DIR."""
+    stem = os.path.splitext(ONNX_FILES[name])[0]
+    return os.path.join(config.QUANTIZED_MODEL_DIR, f"{stem}.int8.onnx")
+
+
+def get_providers():
+    """
+    ONNX Runtime providers to use, preferring CUDA when available.
+
+    Returns:
+        list of provider names
+    """
+    global _providers
+    if _providers is not None:
+        return _providers
+
+    # Detect available ONNX Runtime providers
+    available_providers = ort.get_available_providers()
+    logger.info(f"Available ONNX Runtime providers: {available_providers}")
+
+    # Build provider list with preference for CUDA if available
+    providers = []
+    if 'CUDAExecutionProvider' in available_providers:
+        providers.append('CUDAExecutionProvider')
+        logger.info("CUDA provider is available - GPU acceleration enabled")
+    else:
+        logger.info("CUDA provider not available - using CPU only")
+
+    if 'CPUExecutionProvider' in available_providers:
+        providers.append('CPUExecutionProvider')
+
+    logger.info(f"Using providers: {providers}")
+    _providers = providers
+    return providers
+
+
+def _warm_detection(model):
+    model.detect(np.zeros((DETECTION_SIZE[1], DETECTION_SIZE[0], 3), dtype=np.uint8), max_num=0, metric='default')
+
+
+def _warm_recognition(model):
+    model.get_feat([np.zeros((112, 112, 3), dtype=np.uint8)] * 2)
+
+
+def _warm_face_model(model):
+    img = np.zeros((256, 256, 3), dtype=np.uint8)
+    model.get(img, Face(bbox=np.array([32, 32, 224, 224], dtype=np.float32), kps=None, det_score=1.0))
+
+
+def _warm_emotion(model):
+    model.predict_multi_emotions([np.zeros((224, 224, 3), dtype=np.uint8)] * 2, logits=False)
+
+
+_WARMUPS = {
+    "detection": _warm_detection,
+    "landmark_3d_68": _warm_face_model,
+    "landmark_2d_106": _warm_face_model,
+    "genderage": _warm_face_model,
+    "recognition": _warm_recognition,
+    EMOTION: _warm_emotion,
+}
+
+
+if config.MODEL_PRECISION not in PRECISIONS:
+    raise ValueError(f"Unknown MODEL_PRECISION '{config.MODEL_PRECISION}'. Allowed: {', '.join(PRECISIONS)}")
+if config.EMOTION_BACKEND not in EMOTION_BACKENDS:
+    raise ValueError(f"Unknown EMOTION_BACKEND '{config.EMOTION_BACKEND}'. Allowed: {', '.join(EMOTION_BACKENDS)}")
+
+
+class ModelRegistry:
+    """
+    Loads each model on first use and tracks warm-up state.
+
+    Nothing heavy happens at import time: ONNX sessions are created when a model
+    is first requested (or by the background warm-up), and torch/hsemotion are
+    only imported when emotion recognition is actually used.
+    """
+
+    def __init__(self):
+        self._models = {}
+        self._locks = {name: threading.Lock() for name in MODEL_NAMES}
+        self._pack_lock = threading.Lock()
+        self._pack_dir = None
+        self._warm = set()
+        self._errors = {}
+        self._warm_up_names = ()
+        self._warm_up_done = threading.Event()
+        self._warm_up_done.set()
+
+    def pack_dir(self) -> str:
+        """Directory of the model pack, downloading it on first use."""
+        with self._pack_lock:
+            if self._pack_dir is None:
+                self._pack_dir = ensure_available('models', MODEL_PACK, root=MODEL_PACK_ROOT)
+            return self._pack_dir
+
+    def source_model_file(self, name: str) -> str:
+        """Path of the original (FP32) ONNX file of a model."""
+        if name == EMOTION:
+            return os.path.join(config.EMOTION_MODEL_DIR, ONNX_FILES[EMOTION])
+        return os.path.join(self.pack_dir(), PACK_FILES[name])
+
+    def model_file(self, name: str) -> str:
+        """
+        Path of the ONNX file to load for a model.
+
+        With MODEL_PRECISION=int8 this is the quantized variant when one has been
+        built, otherwise the original file.
+        """
+        if config.MODEL_PRECISION == "int8":
+            quantized = quantized_model_file(name)
+            if os.path.exists(quantized):
+                return quantized
+            logger.warning(f"No INT8 variant of '{name}' at {quantized}, using FP32")
+        return self.source_model_file(name)
+
+    def model_files(self) -> dict:
+        """Paths of all ONNX files that are loaded, keyed by model name."""
+        files = {name: self.model_file(name) for name in PACK_FILES}
+        if self.emotion_backend() == "onnx":
+            files[EMOTION] = self.model_file(EMOTION)
+        return files
+
+    def emotion_backend(self) -> str:
+        """
+        Resolve EMOTION_BACKEND: "auto" uses the ONNX model when it has been exported.
+
+        Returns:
+            "onnx" or "torch"
+        """
+        if config.EMOTION_BACKEND != "auto":
+            return config.EMOTION_BACKEND
+        return "onnx" if os.path.exists(self.source_model_file(EMOTION)) else "torch"
+
+    def get(self, name: str):
+        """
+        Return a model, loading it on first use.
+
+        Args:
+            name: one of MODEL_NAMES
+
+        Returns:
+            the loaded model object
+        """
+        model = self._models.get(name)
+        if model is not None:
+            return model
+
+        with self._locks[name]:
+            model = self._models.get(name)
+            if model is None:
+                model = self._load(name)
+                self._models[name] = model
+            return model
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._models
+
+    def _load(self, name: str):
+        started = time.perf_counter()
+        logger.info(f"Loading model '{name}'...")
+
+        if name == EMOTION:
+            model = self._load_emotion()
+        else:
+            # Sessions are created here rather than by insightface's get_model so
+            # that the session profile (threads, optimization, arena) applies
+            model_file = self.model_file(name)
+            session = create_session(model_file, get_providers(), model_name=name)
+            model = PACK_CLASSES[name](model_file=model_file, session=session)
+            if name == "detection":
+                model.prepare(ctx_id=0, input_size=DETECTION_SIZE, det_thresh=DETECTION_THRESHOLD)
+            else:
+                model.prepare(ctx_id=0)
+
+        logger.info(f"Model '{name}' loaded in {time.perf_counter() - started:.2f}s ({type(model).__name__})")
+        return model
+
+    def _load_emotion(self):
+        if self.emotion_backend() == "onnx":
+            model_file = self.model_file(EMOTION)
+            if not os.path.exists(model_file):
+                raise FileNotFoundError(f"Emotion ONNX model not found at {model_file}; run `python -m app.emotion_onnx export`")
+            return OnnxEmotionRecognizer(create_session(model_file, get_providers(), model_name=EMOTION))
+
+        # torch, timm and hsemotion are imported here so that processes which
+        # never run emotion recognition do not pay for them
+        logger.info("Using the torch emotion model; export it with `python -m app.emotion_onnx export` to drop torch")
+        from . import emotion_patch  # noqa: F401 - allows torch.load of the timm EfficientNet
+        from hsemotion.facial_emotions import HSEmotionRecognizer
+
+        return HSEmotionRecognizer(model_name=EMOTION_MODEL_NAME)
+
+    def preload(self, names):
+        """
+        Load the state that can be shared with forked inference workers.
+
+        Downloads the model pack and, for the torch backend, loads the emotion
+        weights without running inference. ONNX Runtime sessions are not
+        created: their thread pools do not survive fork, so every worker builds its own.
+
+        Args:
+            names: model names the workers will warm up
+        """
+        self.pack_dir()
+        if EMOTION in names and self.emotion_backend() == "torch":
+            self.get(EMOTION)
+
+    def warm_up(self, names):
+        """
+        Load models and run a dummy batch through each of them.
+
+        Args:
+            names: model names to warm up
+        """
+        for name in names:
+            try:
+                started = time.perf_counter()
+                _WARMUPS[name](self.get(name))
+                self._warm.add(name)
+                logger.info(f"Model '{name}' warmed up in {time.perf_counter() - started:.2f}s")
+            except Exception as e:
+                self._errors[name] = str(e)
+                logger.exception(f"Failed to warm up model '{name}': {str(e)}")
+
+    def start_warm_up(self, names):
+        """
+        Warm up models in a background thread so the server can start accepting connections immediately.
+
+        Args:
+            names: model names to warm up
+        """
+        unknown = set(names).difference(MODEL_NAMES)
+        if unknown:
+            raise ValueError(f"Unknown model(s) in warm-up list: {', '.join(sorted(unknown))}")
+
+        self._warm_up_names = tuple(names)
+        if not names:
+            return
+
+        self._warm_up_done.clear()
+
+        def run():
+            try:
+                self.warm_up(names)
+            finally:
+                self._warm_up_done.set()
+
+        threading.Thread(target=run, name="model-warm-up", daemon=True).start()
+
+    def is_ready(self) -> bool:
+        """Whether every model of the warm-up list is loaded and warmed."""
+        return all(name in self._warm for name in self._warm_up_names)
+
+    def status(self) -> dict:
+        """
+        Readiness report for /ready.
+
+        Returns:
+            dict with overall readiness and a per-model state
+        """
+        models = {}
+        for name in MODEL_NAMES:
+            if name in self._errors:
+                models[name] = f"error: {self._errors[name]}"
+            elif name in self._warm:
+                models[name] = "warm"
+            elif name in self._models:
+                models[name] = "loaded"
+            else:
+                models[name] = "not_loaded"
+
+        return {
+            "ready": self.is_ready(),
+            "emotion_backend": self.emotion_backend(),
+            "warm_up_in_progress": not self._warm_up_done.is_set(),
+            "models": models,
+        }
+
+
+registry = ModelRegistry()
@@ -0,0 +1,351 @@
+"""
+ONNX Runtime session profile shared by all models, with cached optimized graphs.
+
+The profile is built from the ORT_* environment variables and, when ORT_PROFILE
+is set, a YAML file that overrides them globally and per model:
+
+    intra_op_threads: 4
+    execution_mode: sequential
+    models:
+      detection:
+        intra_op_threads: 8
+
+Find the fastest thread configuration for the host CPU (from the insightface directory):
+    python -m app.ort_profile sweep
+    python -m app.ort_profile sweep --models detection,recognition --threads 1,2,4,8 --write ort_profile.yaml
+"""
+import argparse
+import hashlib
+import logging
+import os
+import time
+from dataclasses import asdict, dataclass, fields, replace
+
+import numpy as np
+import onnxruntime as ort
+
+from . import config
+
+try:
+    import yaml
+except ImportError:  # optional dependency, only needed for ORT_PROFILE files
+    yaml = None
+
+logger = logging.getLogger("face_service")
+
+EXECUTION_MODES = {
+    "sequential": ort.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": ort.ExecutionMode.ORT_PARALLEL,
+}
+
+GRAPH_OPTIMIZATIONS = {
+    "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+
+@dataclass(frozen=True)
+class SessionProfile:
+    """Settings applied to an ONNX Runtime session (0 threads = ONNX Runtime default)."""
+    intra_op_threads: int = 0
+    inter_op_threads: int = 0
+    execution_mode: str = "sequential"
+    graph_optimization: str = "all"
+    cpu_mem_arena: bool = True
+    mem_pattern: bool = True
+
+
+def _validate(profile: SessionProfile) -> SessionProfile:
+    if profile.execution_mode not in EXECUTION_MODES:
+        raise ValueError(f"Unknown execution_mode '{profile.execution_mode}'. Allowed: {', '.join(EXECUTION_MODES)}")
+    if profile.graph_optimization not in GRAPH_OPTIMIZATIONS:
+        raise ValueError(
+            f"Unknown graph_optimization '{profile.graph_optimization}'. Allowed: {', '.join(GRAPH_OPTIMIZATIONS)}"
+        )
+    return profile
+
+
+def _apply(profile: SessionProfile, settings: dict, source: str) -> SessionProfile:
+    """Override profile fields with the known keys of a settings dict."""
+    known = {field.name for field in fields(SessionProfile)}
+    unknown = set(settings).difference(known)
+    if unknown:
+        raise ValueError(f"Unknown setting(s) in {source}: {', '.join(sorted(unknown))}")
+    return replace(profile, **settings)
+
+
+def _env_profile() -> SessionProfile:
+    return SessionProfile(
+        intra_op_threads=config.ORT_INTRA_OP_THREADS,
+        inter_op_threads=config.ORT_INTER_OP_THREADS,
+        execution_mode=config.ORT_EXECUTION_MODE,
+        graph_optimization=config.ORT_GRAPH_OPTIMIZATION,
+        cpu_mem_arena=config.ORT_CPU_MEM_ARENA,
+        mem_pattern=config.ORT_MEM_PATTERN,
+    )
+
+
+_profile_file = None
+
+
+def _read_profile_file(path: str) -> dict:
+    global _profile_file
+    if _profile_file is None:
+        if yaml is None:
+            raise ValueError("ORT_PROFILE requires the PyYAML package")
+        with open(path, encoding="utf-8") as f:
+            _profile_file = yaml.safe_load(f) or {}
+        logger.info(f"Loaded ONNX Runtime profile from {path}")
+    return _profile_file
+
+
+def load_profile(model_name: str = None) -> SessionProfile:
+    """
+    Resolve the session profile of a model.
+
+    Environment variables form the base; the ORT_PROFILE file overrides them,
+    and its `models.<name>` section overrides the file's global settings.
+
+    Args:
+        model_name: model name (e.g. "detection"), or None for the global profile
+
+    Returns:
+        SessionProfile
+
+    Raises:
+        ValueError: if the profile contains unknown settings or values
+    """
+    profile = _env_profile()
+    if config.ORT_PROFILE:
+        settings = dict(_read_profile_file(config.ORT_PROFILE))
+        per_model = settings.pop("models", None) or {}
+        profile = _apply(profile, settings, config.ORT_PROFILE)
+        if model_name in per_model:
+            profile = _apply(profile, per_model[model_name] or {}, f"{config.ORT_PROFILE} (models.{model_name})")
+    return _validate(profile)
+
+
+def session_options(profile: SessionProfile) -> ort.SessionOptions:
+    """
+    Build ONNX Runtime session options from a profile.
+
+    Args:
+        profile: SessionProfile
+
+    Returns:
+        ort.SessionOptions
+    """
+    options = ort.SessionOptions()
+    if profile.intra_op_threads > 0:
+        options.intra_op_num_threads = profile.intra_op_threads
+    if profile.inter_op_threads > 0:
+        options.inter_op_num_threads = profile.inter_op_threads
+    options.execution_mode = EXECUTION_MODES[profile.execution_mode]
+    options.graph_optimization_level = GRAPH_OPTIMIZATIONS[profile.graph_optimization]
+    options.enable_cpu_mem_arena = profile.cpu_mem_arena
+    options.enable_mem_pattern = profile.mem_pattern
+    return options
+
+
+def optimized_model_path(model_file: str, profile: SessionProfile, providers) -> str:
+    """
+    Path of the cached optimized graph for a model file.
+
+    Optimized graphs can contain provider- and version-specific fused nodes, so the
+    name includes the source file, the optimization level, the providers and the
+    ONNX Runtime version.
+
+    Returns:
+        path inside ORT_OPTIMIZED_MODEL_DIR
+    """
+    stat = os.stat(model_file)
+    fingerprint = hashlib.sha256(
+        f"{os.path.abspath(model_file)}|{stat.st_size}|{int(stat.st_mtime)}|{profile.graph_optimization}|"
+        f"{','.join(providers)}|{ort.__version__}".encode()
+    ).hexdigest()[:12]
+    stem = os.path.splitext(os.path.basename(model_file))[0]
+    return os.path.join(config.ORT_OPTIMIZED_MODEL_DIR, f"{stem}.{profile.graph_optimization}.{fingerprint}.onnx")
+
+
+def create_session(model_file: str, providers, model_name: str = None, profile: SessionProfile = None):
+    """
+    Create an ONNX Runtime session with the configured profile.
+
+    On first load the optimized graph is saved to ORT_OPTIMIZED_MODEL_DIR; later
+    starts load the saved graph with optimizations disabled, skipping the
+    optimization pass.
+
+    Args:
+        model_file: path of the .onnx file
+        providers: execution providers
+        model_name: model name used to pick per-model settings from ORT_PROFILE
+        profile: explicit profile (default: load_profile(model_name))
+
+    Returns:
+        ort.InferenceSession
+    """
+    if profile is None:
+        profile = load_profile(model_name)
+    options = session_options(profile)
+
+    if not config.ORT_OPTIMIZED_MODEL_DIR or profile.graph_optimization == "disable":
+        return ort.InferenceSession(model_file, sess_options=options, providers=providers)
+
+    cached = optimized_model_path(model_file, profile, providers)
+    if os.path.exists(cached):
+        options.graph_optimization_level = GRAPH_OPTIMIZATIONS["disable"]
+        try:
+            session = ort.InferenceSession(cached, sess_options=options, providers=providers)
+            logger.info(f"Using optimized graph {cached}")
+            return session
+        except Exception as e:
+            logger.warning(f"Cannot load optimized graph {cached}, rebuilding it: {str(e)}")
+            options = session_options(profile)
+
+    # Each process writes its own file and renames it, so concurrent workers never see a partial graph
+    os.makedirs(config.ORT_OPTIMIZED_MODEL_DIR, exist_ok=True)
+    partial = f"{cached}.{os.getpid()}.tmp"
+    options.optimized_model_filepath = partial
+    session = ort.InferenceSession(model_file, sess_options=options, providers=providers)
+    try:
+        os.replace(partial, cached)
+        logger.info(f"Saved optimized graph {cached}")
+    except OSError as e:
+        logger.warning(f"Cannot save optimized graph {cached}: {str(e)}")
+    return session
+
+
+def _dummy_inputs(session, batch_size: int, spatial_size: int):
+    """Random inputs for every session input; dynamic dims become batch_size (first) or spatial_size."""
+    inputs = {}
+    for model_input in session.get_inputs():
+        shape = [
+            dim if isinstance(dim, int) else (batch_size if index == 0 else spatial_size)
+            for index, dim in enumerate(model_input.shape)
+        ]
+        inputs[model_input.name] = np.random.default_rng(0).random(shape, dtype=np.float32)
+    return inputs
+
+
+def time_session(session, inputs, runs: int) -> float:
+    """
+    Median latency of a session in milliseconds (after one warm-up run).
+    """
+    session.run(None, inputs)
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        session.run(None, inputs)
+        timings.append(time.perf_counter() - started)
+    return float(np.median(timings) * 1000)
+
+
+def _default_thread_counts():
+    cpu_count = os.cpu_count() or 1
+    counts = [1]
+    while counts[-1] * 2 <= cpu_count:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != cpu_count:
+        counts.append(cpu_count)
+    return counts
+
+
+def sweep(model_files: dict, thread_counts, runs: int = 20, batch_size: int = 1, providers=None):
+    """
+    Time every model under each thread configuration.
+
+    Args:
+        model_files: {model name: .onnx path}
+        thread_counts: intra-op thread counts to try
+        runs: timed runs per configuration
+        batch_size: value used for dynamic batch dimensions
+        providers: execution providers (default: CPU only)
+
+    Returns:
+        list of (SessionProfile, {model name: median ms}) tuples
+    """
+    providers = providers or ["CPUExecutionProvider"]
+    base = replace(load_profile(), intra_op_threads=0, inter_op_threads=0)
+
+    candidates = []
+    for threads in thread_counts:
+        candidates.append(replace(base, intra_op_threads=threads, inter_op_threads=1, execution_mode="sequential"))
+        candidates.append(replace(base, intra_op_threads=threads, inter_op_threads=2, execution_mode="parallel"))
+
+    results = []
+    for profile in candidates:
+        timings = {}
+        for name, model_file in model_files.items():
+            session = ort.InferenceSession(model_file, sess_options=session_options(profile), providers=providers)
+            spatial_size = 640 if name == "detection" else 112
+            timings[name] = time_session(session, _dummy_inputs(session, batch_size, spatial_size), runs)
+        results.append((profile, timings))
+        print(
+            f"intra={profile.intra_op_threads:>3} inter={profile.inter_op_threads} {profile.execution_mode:<10} "
+            + " ".join(f"{name}={ms:.2f}ms" for name, ms in timings.items())
+        )
+    return results
+
+
+def best_profiles(results):
+    """
+    Pick the fastest configuration overall and per model.
+
+    Returns:
+        (overall SessionProfile, {model name: SessionProfile})
+    """
+    overall = min(results, key=lambda item: sum(item[1].values()))[0]
+    per_model = {}
+    for name in results[0][1]:
+        per_model[name] = min(results, key=lambda item: item[1][name])[0]
+    return overall, per_model
+
+
+def _profile_settings(profile: SessionProfile, keys=("intra_op_threads", "inter_op_threads", "execution_mode")):
+    settings = asdict(profile)
+    return {key: settings[key] for key in keys}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    sweep_parser = subparsers.add_parser("sweep", help="time the models under different thread configurations")
+    sweep_parser.add_argument("--models", default="detection,recognition,genderage", help="comma-separated model names")
+    sweep_parser.add_argument("--threads", default=None, help="comma-separated intra-op thread counts (default: powers of two up to the core count)")
+    sweep_parser.add_argument("--runs", type=int, default=20, help="timed runs per configuration (median is reported)")
+    sweep_parser.add_argument("--batch", type=int, default=1, help="batch size for models with a dynamic batch axis")
+    sweep_parser.add_argument("--write", default=None, help="write the best configuration to this YAML file")
+    args = parser.parse_args()
+
+    from .models import registry
+
+    names = [name.strip() for name in args.models.split(",") if name.strip()]
+    model_files = {name: registry.model_file(name) for name in names}
+    thread_counts = [int(value) for value in args.threads.split(",")] if args.threads else _default_thread_counts()
+
+    print(f"Host: {os.cpu_count()} CPU(s), onnxruntime {ort.__version__}")
+    results = sweep(model_files, thread_counts, runs=args.runs, batch_size=args.batch)
+    overall, per_model = best_profiles(results)
+
+    settings = _profile_settings(overall)
+    settings["models"] = {name: _profile_settings(profile) for name, profile in per_model.items()}
+
+    print("\nFastest configuration:")
+    print(f"  ORT_INTRA_OP_THREADS={overall.intra_op_threads} ORT_INTER_OP_THREADS={overall.inter_op_threads} "
+          f"ORT_EXECUTION_MODE={overall.execution_mode}")
+    for name, profile in per_model.items():
+        print(f"  {name}: " + ", ".join(f"{key}={value}" for key, value in _profile_settings(profile).items()))
+
+    if args.write:
+        if yaml is None:
+            raise SystemExit("--write requires the PyYAML package")
+        with open(args.write, "w", encoding="utf-8") as f:
+            yaml.safe_dump(settings, f, sort_keys=False)
+        print(f"\nProfile written to {args.write}; use it with ORT_PROFILE={args.write}")
+
+
+if __name__ == "__main__":
+    main()
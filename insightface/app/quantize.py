@@ -0,0 +1,391 @@
+"""
+INT8 variants of the ONNX models and an FP32 vs INT8 accuracy/throughput report.
+
+Build the quantized models (from the insightface directory):
+    python -m app.quantize build                                   # dynamic INT8 weights
+    python -m app.quantize build --mode static --calibration crops/ # static QDQ, calibrated on face crops
+
+Compare them with FP32:
+    python -m app.quantize report --crops crops/ --pairs pairs.txt --output report.json
+
+pairs.txt lists one verification pair per line: `<image 1> <image 2> <1 if same person else 0>`,
+with paths relative to the pairs file. Serve the quantized models with MODEL_PRECISION=int8.
+"""
+import argparse
+import json
+import logging
+import os
+import time
+
+import cv2
+import numpy as np
+from onnxruntime.quantization import (
+    CalibrationDataReader,
+    QuantFormat,
+    QuantType,
+    quantize_dynamic,
+    quantize_static,
+)
+
+from . import config
+from .decoding import decode_image
+from . import emotion_onnx
+from .models import (
+    DETECTION_SIZE,
+    DETECTION_THRESHOLD,
+    EMOTION,
+    PACK_CLASSES,
+    get_providers,
+    quantized_model_file,
+    registry,
+)
+from .ort_profile import create_session
+
+logger = logging.getLogger("face_service")
+
+QUANTIZATION_MODES = ("dynamic", "static")
+
+# Models quantized by default; the landmark models can be added with --models.
+# The emotion model is included once it has been exported to ONNX.
+DEFAULT_MODELS = ("detection", "recognition", "genderage", EMOTION)
+QUANTIZABLE_MODELS = tuple(PACK_CLASSES) + (EMOTION,)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+
+def list_images(folder: str, limit: int = None):
+    """Sorted image paths in a folder (not recursive)."""
+    paths = sorted(
+        os.path.join(folder, name) for name in os.listdir(folder)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    return paths[:limit] if limit else paths
+
+
+def load_image(path: str):
+    """Decode an image file, or return None (with a warning) if it cannot be read."""
+    try:
+        with open(path, "rb") as f:
+            img = decode_image(f.read())
+    except OSError:
+        img = None
+    if img is None:
+        logger.warning(f"Skipping unreadable image {path}")
+    return img
+
+
+def load_images(paths):
+    """Decode image files, skipping the ones that cannot be read."""
+    return [img for img in map(load_image, paths) if img is not None]
+
+
+def load_model(name: str, model_file: str):
+    """Load a model from a specific ONNX file with the configured session profile."""
+    session = create_session(model_file, get_providers(), model_name=name)
+    if name == EMOTION:
+        return emotion_onnx.OnnxEmotionRecognizer(session)
+    model = PACK_CLASSES[name](model_file=model_file, session=session)
+    if name == "detection":
+        model.prepare(ctx_id=0, input_size=DETECTION_SIZE, det_thresh=DETECTION_THRESHOLD)
+    else:
+        model.prepare(ctx_id=0)
+    return model
+
+
+def _letterbox(img, size):
+    """Resize keeping the aspect ratio into a size x size canvas, as RetinaFace.detect does."""
+    height, width = img.shape[:2]
+    scale = min(size[0] / width, size[1] / height)
+    resized = cv2.resize(img, (int(width * scale), int(height * scale)))
+    canvas = np.zeros((size[1], size[0], 3), dtype=np.uint8)
+    canvas[:resized.shape[0], :resized.shape[1]] = resized
+    return canvas
+
+
+def model_blob(name: str, model, img):
+    """
+    Preprocess one image into the input blob of a model.
+
+    Face crops are used as they are: resized to the model input for recognition,
+    genderage, landmarks and emotion, letterboxed into the detector input for detection.
+    """
+    if name == EMOTION:
+        return emotion_onnx.preprocess([cv2.cvtColor(img, cv2.COLOR_BGR2RGB)])
+    if name == "detection":
+        size = DETECTION_SIZE
+        img = _letterbox(img, size)
+    else:
+        size = tuple(model.input_size)
+    mean = model.input_mean
+    return cv2.dnn.blobFromImage(img, 1.0 / model.input_std, size, (mean, mean, mean), swapRB=True)
+
+
+class CropCalibrationReader(CalibrationDataReader):
+    """Feeds preprocessed face crops to the static quantization calibrator, one image per batch."""
+
+    def __init__(self, name: str, model, images):
+        self._input_name = model.session.get_inputs()[0].name
+        self._blobs = iter([model_blob(name, model, img) for img in images])
+
+    def get_next(self):
+        blob = next(self._blobs, None)
+        return None if blob is None else {self._input_name: blob}
+
+
+def _preprocess(source: str, target: str) -> str:
+    """Run ONNX Runtime's shape inference/optimization pre-pass recommended before quantization."""
+    try:
+        from onnxruntime.quantization.shape_inference import quant_pre_process
+    except ImportError:
+        return source
+    try:
+        quant_pre_process(source, target, skip_symbolic_shape=True)
+        return target
+    except Exception as e:
+        logger.warning(f"Quantization pre-processing failed for {source}, using it as is: {str(e)}")
+        return source
+
+
+def quantize_model(name: str, mode: str = "dynamic", calibration_images=None) -> str:
+    """
+    Build the INT8 variant of a model in QUANTIZED_MODEL_DIR.
+
+    Args:
+        name: model name (e.g. "recognition")
+        mode: "dynamic" (INT8 weights, activations quantized at run time) or
+            "static" (QDQ with activation ranges calibrated on calibration_images)
+        calibration_images: decoded face crops, required for static mode
+
+    Returns:
+        path of the quantized model
+    """
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization mode '{mode}'. Allowed: {', '.join(QUANTIZATION_MODES)}")
+    if mode == "static" and not calibration_images:
+        raise ValueError("Static quantization needs calibration images (--calibration)")
+
+    source = registry.source_model_file(name)
+    target = quantized_model_file(name)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+
+    prepared = _preprocess(source, f"{target}.pre.onnx")
+    started = time.perf_counter()
+    try:
+        if mode == "dynamic":
+            quantize_dynamic(prepared, target, weight_type=QuantType.QInt8)
+        else:
+            reader = CropCalibrationReader(name, load_model(name, source), calibration_images)
+            quantize_static(
+                prepared, target, reader,
+                quant_format=QuantFormat.QDQ,
+                per_channel=True,
+                activation_type=QuantType.QUInt8,
+                weight_type=QuantType.QInt8,
+            )
+    finally:
+        if prepared != source and os.path.exists(prepared):
+            os.remove(prepared)
+
+    logger.info(
+        f"Quantized '{name}' ({mode}) in {time.perf_counter() - started:.1f}s: "
+        f"{os.path.getsize(source) / 2**20:.1f} MB -> {os.path.getsize(target) / 2**20:.1f} MB"
+    )
+    return target
+
+
+def images_per_second(name: str, model, images, runs: int = 3) -> float:
+    """Single-image throughput of a model on the given images (best of `runs`)."""
+    blobs = [model_blob(name, model, img) for img in images]
+    input_name = model.session.get_inputs()[0].name
+    model.session.run(None, {input_name: blobs[0]})
+
+    best = float("inf")
+    for _ in range(runs):
+        started = time.perf_counter()
+        for blob in blobs:
+            model.session.run(None, {input_name: blob})
+        best = min(best, time.perf_counter() - started)
+    return len(blobs) / best
+
+
+def _embed(model, images):
+    crops = [cv2.resize(img, tuple(model.input_size)) for img in images]
+    embeddings = model.get_feat(crops)
+    return embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+
+
+def cosine_drift(fp32_model, int8_model, images) -> dict:
+    """
+    Cosine similarity between FP32 and INT8 embeddings of the same crops.
+
+    Returns:
+        dict with mean, minimum and 5th percentile similarity
+    """
+    similarities = np.sum(_embed(fp32_model, images) * _embed(int8_model, images), axis=1)
+    return {
+        "mean": float(np.mean(similarities)),
+        "min": float(np.min(similarities)),
+        "p5": float(np.percentile(similarities, 5)),
+    }
+
+
+def read_pairs(path: str):
+    """Parse a pairs file into (image 1 path, image 2 path, same) tuples."""
+    base = os.path.dirname(os.path.abspath(path))
+    pairs = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) != 3:
+                continue
+            pairs.append((os.path.join(base, parts[0]), os.path.join(base, parts[1]), parts[2] == "1"))
+    return pairs
+
+
+def verification_accuracy(model, pairs) -> dict:
+    """
+    Best-threshold verification accuracy on a pair set.
+
+    Returns:
+        dict with accuracy, the threshold that achieves it and the number of pairs
+    """
+    images = {}
+    for path in sorted({path for pair in pairs for path in pair[:2]}):
+        img = load_image(path)
+        if img is not None:
+            images[path] = img
+    usable = [pair for pair in pairs if pair[0] in images and pair[1] in images]
+    if not usable:
+        return {"accuracy": None, "threshold": None, "pairs": 0}
+
+    embeddings = dict(zip(images, _embed(model, list(images.values()))))
+    scores = np.array([float(np.dot(embeddings[a], embeddings[b])) for a, b, _ in usable])
+    labels = np.array([same for _, _, same in usable])
+
+    best_accuracy, best_threshold = 0.0, 0.0
+    for threshold in np.unique(scores):
+        accuracy = float(np.mean((scores >= threshold) == labels))
+        if accuracy > best_accuracy:
+            best_accuracy, best_threshold = accuracy, float(threshold)
+    return {"accuracy": best_accuracy, "threshold": best_threshold, "pairs": len(usable)}
+
+
+def build_report(names, crops, pairs=None) -> dict:
+    """
+    Compare FP32 and INT8 variants of the given models.
+
+    Args:
+        names: model names that have an INT8 variant
+        crops: decoded face crops used for throughput and cosine drift
+        pairs: optional verification pairs from read_pairs
+
+    Returns:
+        dict keyed by model name with images/sec per precision, speedup and,
+        for recognition, cosine drift and verification accuracy
+    """
+    report = {}
+    for name in names:
+        quantized = quantized_model_file(name)
+        if not os.path.exists(quantized):
+            logger.warning(f"No INT8 variant of '{name}', skipping")
+            continue
+
+        fp32_model = load_model(name, registry.source_model_file(name))
+        int8_model = load_model(name, quantized)
+        fp32_ips = images_per_second(name, fp32_model, crops)
+        int8_ips = images_per_second(name, int8_model, crops)
+        entry = {
+            "fp32_images_per_sec": fp32_ips,
+            "int8_images_per_sec": int8_ips,
+            "speedup": int8_ips / fp32_ips,
+        }
+
+        if name == "recognition":
+            entry["cosine_drift"] = cosine_drift(fp32_model, int8_model, crops)
+            if pairs:
+                entry["verification"] = {
+                    "fp32": verification_accuracy(fp32_model, pairs),
+                    "int8": verification_accuracy(int8_model, pairs),
+                }
+
+        if name == EMOTION:
+            rgb = [cv2.cvtColor(img, cv2.COLOR_BGR2RGB) for img in crops]
+            fp32_labels, fp32_scores = fp32_model.predict_multi_emotions(rgb, logits=False)
+            int8_labels, int8_scores = int8_model.predict_multi_emotions(rgb, logits=False)
+            entry["label_agreement"] = float(np.mean([a == b for a, b in zip(fp32_labels, int8_labels)]))
+            entry["max_score_diff"] = float(np.max(np.abs(fp32_scores - int8_scores)))
+
+        report[name] = entry
+    return report
+
+
+def print_report(report):
+    print(f"{'model':<16} {'fp32 img/s':>11} {'int8 img/s':>11} {'speedup':>8}")
+    for name, entry in report.items():
+        print(f"{name:<16} {entry['fp32_images_per_sec']:>11.1f} {entry['int8_images_per_sec']:>11.1f} "
+              f"{entry['speedup']:>7.2f}x")
+
+    emotion = report.get(EMOTION)
+    if emotion:
+        print(f"\nEmotion FP32 vs INT8: label agreement {emotion['label_agreement']:.1%}, "
+              f"max score difference {emotion['max_score_diff']:.4f}")
+
+    recognition = report.get("recognition")
+    if recognition:
+        drift = recognition["cosine_drift"]
+        print(f"\nEmbedding cosine FP32 vs INT8: mean {drift['mean']:.4f}, p5 {drift['p5']:.4f}, min {drift['min']:.4f}")
+        verification = recognition.get("verification")
+        if verification:
+            for precision in ("fp32", "int8"):
+                result = verification[precision]
+                if result["accuracy"] is not None:
+                    print(f"Verification accuracy {precision}: {result['accuracy']:.4f} "
+                          f"(threshold {result['threshold']:.3f}, {result['pairs']} pairs)")
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help=f"write INT8 models to QUANTIZED_MODEL_DIR ({config.QUANTIZED_MODEL_DIR})")
+    build_parser.add_argument("--models", default=",".join(DEFAULT_MODELS), help="comma-separated model names")
+    build_parser.add_argument("--mode", choices=QUANTIZATION_MODES, default="dynamic")
+    build_parser.add_argument("--calibration", default=None, help="folder of face crops for static calibration")
+    build_parser.add_argument("--limit", type=int, default=200, help="maximum number of calibration images")
+
+    report_parser = subparsers.add_parser("report", help="compare FP32 and INT8 models")
+    report_parser.add_argument("--models", default=",".join(DEFAULT_MODELS), help="comma-separated model names")
+    report_parser.add_argument("--crops", required=True, help="folder of face crops")
+    report_parser.add_argument("--pairs", default=None, help="verification pairs file")
+    report_parser.add_argument("--limit", type=int, default=200, help="maximum number of crops")
+    report_parser.add_argument("--output", default=None, help="also write the report as JSON")
+
+    args = parser.parse_args()
+    names = [name.strip() for name in args.models.split(",") if name.strip()]
+    unknown = set(names).difference(QUANTIZABLE_MODELS)
+    if unknown:
+        raise SystemExit(f"Unknown model(s): {', '.join(sorted(unknown))}. Allowed: {', '.join(QUANTIZABLE_MODELS)}")
+
+    if args.command == "build":
+        images = load_images(list_images(args.calibration, args.limit)) if args.calibration else None
+        for name in names:
+            if not os.path.exists(registry.source_model_file(name)):
+                print(f"{name}: skipped, {registry.source_model_file(name)} does not exist "
+                      f"(export the emotion model with `python -m app.emotion_onnx export`)")
+                continue
+            print(f"{name}: {quantize_model(name, args.mode, images)}")
+        return
+
+    crops = load_images(list_images(args.crops, args.limit))
+    if not crops:
+        raise SystemExit(f"No images found in {args.crops}")
+    report = build_report(names, crops, read_pairs(args.pairs) if args.pairs else None)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Emotion inference benchmark: per-face loop vs batched forward pass.
+
+Measures how per-face latency scales with the number of faces in one image.
+
+Usage (from the insightface directory):
+    python -m benchmarks.emotion_batch
+    python -m benchmarks.emotion_batch --faces 1,10,30,60,80 --repeat 5 --crop face.jpg
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from app import face_service
+
+
+def load_crops(count, crop_path=None, size=160):
+    """Build `count` RGB face crops from a local image or random noise."""
+    if crop_path:
+        img = cv2.imread(crop_path, cv2.IMREAD_COLOR)
+        if img is None:
+            raise SystemExit(f"Cannot read {crop_path}")
+        rgb = face_service.to_rgb(img)
+        return [rgb.copy() for _ in range(count)]
+
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 255, (size, size, 3), dtype=np.uint8) for _ in range(count)]
+
+
+def time_call(fn, repeat):
+    """Return the best wall time of `repeat` runs in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--faces", default="1,5,10,30,60,80", help="comma-separated face counts")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement (best is reported)")
+    parser.add_argument("--crop", default=None, help="face crop to replicate (random noise if omitted)")
+    args = parser.parse_args()
+
+    counts = [int(value) for value in args.faces.split(",")]
+
+    # Warm up both paths so lazy initialization is not measured
+    warmup = load_crops(2, args.crop)
+    face_service.get_emotion(None, warmup[0])
+    face_service.get_emotions(warmup)
+
+    print(f"{'faces':>6} {'loop ms':>10} {'batch ms':>10} {'loop ms/face':>13} {'batch ms/face':>14} {'speedup':>8}")
+    for count in counts:
+        crops = load_crops(count, args.crop)
+        loop = time_call(lambda: [face_service.get_emotion(None, crop) for crop in crops], args.repeat)
+        batch = time_call(lambda: face_service.get_emotions(crops), args.repeat)
+        print(f"{count:>6} {loop * 1000:>10.1f} {batch * 1000:>10.1f} "
+              f"{loop * 1000 / count:>13.2f} {batch * 1000 / count:>14.2f} {loop / batch:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
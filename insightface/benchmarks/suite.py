@@ -0,0 +1,489 @@
+"""
+Reproducible benchmark suite for the face service.
+
+Runs offline on synthetic photos built from local face crops (by default the
+faces of insightface's bundled sample image) in these scenarios: a small crop,
+photos with 1, 10 and 60 faces and a 24 MP photo. Each pipeline stage is timed
+separately; the load test drives /detect, /embed and /cluster of a running (or
+auto-started) server at several concurrency levels. Results are written as a
+JSON baseline that can be compared between commits.
+
+Usage (from the insightface directory):
+    python -m benchmarks.suite stages --output stages.json
+    python -m benchmarks.suite load --start-server --concurrency 1,4,16 --output load.json
+    python -m benchmarks.suite all --start-server --output baseline.json
+    python -m benchmarks.suite compare baseline.json new.json --fail-on-regression 10
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+# Synthetic scenarios: (name, number of faces, photo size or None for a single crop)
+SCENARIOS = (
+    ("crop", 1, None),
+    ("faces_1", 1, (1280, 960)),
+    ("faces_10", 10, (1920, 1280)),
+    ("faces_60", 60, (3000, 2000)),
+    ("photo_24mp", 10, (6000, 4000)),
+)
+
+# Synthetic embeddings posted to /cluster: (faces, identities)
+CLUSTER_SCENARIO = ("embeddings_2k", 2000, 20)
+
+# Face box size in each synthetic photo, relative to the photo's short side
+_FACE_FRACTION = {1: 0.35, 10: 0.18, 60: 0.1}
+
+
+def percentiles(values) -> dict:
+    """p50/p95/p99 and mean of a list of durations in seconds, reported in ms."""
+    values = np.asarray(values, dtype=np.float64) * 1000
+    return {
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "mean_ms": float(np.mean(values)),
+        "runs": int(len(values)),
+    }
+
+
+def time_runs(fn, repeat: int) -> dict:
+    """Run fn once to warm up, then `repeat` timed times."""
+    fn()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return percentiles(timings)
+
+
+def load_face_crops(faces_dir=None):
+    """
+    Face crops used to build the synthetic photos.
+
+    Args:
+        faces_dir: folder of face crops; defaults to the faces detected in insightface's sample image
+
+    Returns:
+        list of BGR numpy arrays
+    """
+    if faces_dir:
+        crops = []
+        for name in sorted(os.listdir(faces_dir)):
+            img = cv2.imread(os.path.join(faces_dir, name), cv2.IMREAD_COLOR)
+            if img is not None:
+                crops.append(img)
+        if not crops:
+            raise SystemExit(f"No images found in {faces_dir}")
+        return crops
+
+    from insightface.data import get_image
+
+    from app.face_service import STAGE_DETECTION, crop_face, detect_image_faces
+
+    sample = get_image("t1")
+    crops = []
+    for face in detect_image_faces(sample, frozenset({STAGE_DETECTION})):
+        x1, y1, x2, y2 = face.bbox
+        margin_x, margin_y = (x2 - x1) * 0.3, (y2 - y1) * 0.3
+        crops.append(crop_face(sample, [x1 - margin_x, y1 - margin_y, x2 + margin_x, y2 + margin_y]).copy())
+    if not crops:
+        raise SystemExit("No faces found in the sample image; pass --faces-dir")
+    return crops
+
+
+def build_photo(crops, face_count: int, size):
+    """Tile face crops on a neutral background into a photo of the given (width, height)."""
+    width, height = size
+    face_size = int(min(width, height) * _FACE_FRACTION.get(face_count, 0.15))
+    columns = max(1, width // int(face_size * 1.4))
+    rows = -(-face_count // columns)
+    if rows * face_size * 1.4 > height:
+        raise ValueError(f"{face_count} faces of {face_size}px do not fit into {width}x{height}")
+
+    photo = np.full((height, width, 3), 200, dtype=np.uint8)
+    for index in range(face_count):
+        row, column = divmod(index, columns)
+        x = int(column * face_size * 1.4 + face_size * 0.2)
+        y = int(row * face_size * 1.4 + face_size * 0.2)
+        photo[y:y + face_size, x:x + face_size] = cv2.resize(crops[index % len(crops)], (face_size, face_size))
+    return photo
+
+
+def build_scenarios(crops) -> dict:
+    """
+    Encode every scenario as JPEG bytes.
+
+    Returns:
+        {scenario name: {"data": bytes, "faces": expected face count, "kind": "crop" | "photo"}}
+    """
+    scenarios = {}
+    for name, face_count, size in SCENARIOS:
+        img = cv2.resize(crops[0], (160, 160)) if size is None else build_photo(crops, face_count, size)
+        ok, encoded = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 92])
+        if not ok:
+            raise RuntimeError(f"Cannot encode scenario {name}")
+        scenarios[name] = {"data": encoded.tobytes(), "faces": face_count, "kind": "crop" if size is None else "photo"}
+    return scenarios
+
+
+def build_embeddings(count: int, identities: int, seed: int = 0) -> bytes:
+    """
+    A .npy matrix of unit embeddings drawn around `identities` random centres, for /cluster.
+    """
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((identities, 512))
+    embeddings = centres[rng.integers(0, identities, count)] + 0.3 * rng.standard_normal((count, 512))
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    buffer = io.BytesIO()
+    np.save(buffer, embeddings.astype(np.float32))
+    return buffer.getvalue()
+
+
+def run_stages(scenarios, repeat: int) -> dict:
+    """
+    Time each pipeline stage separately for every scenario.
+
+    Stages: decode (cv2.imdecode at full resolution), decode_reduced (the decode
+    /detect uses), detect, recognition (ArcFace get_feat on aligned faces),
+    genderage, emotion and serialize (rendering the /detect JSON response).
+
+    Returns:
+        {scenario: {stage: percentiles}}
+    """
+    from insightface.utils import face_align
+
+    from app import encoding, face_service
+    from app.decoding import decode_for_detection, decode_image
+    from app.models import registry
+
+    results = {}
+    for name, scenario in scenarios.items():
+        data = scenario["data"]
+        stages = {"decode": time_runs(lambda: decode_image(data), repeat)}
+        img = decode_image(data)
+
+        if scenario["kind"] == "crop":
+            face_img = face_service.preprocess_face_image(img)
+            stages["recognition"] = time_runs(lambda: face_service.embed_faces([face_img]), repeat)
+            stages["emotion"] = time_runs(lambda: face_service.get_emotions([face_service.to_rgb(img)]), repeat)
+            result = face_service._embed_decoded([(name, img)], include_attributes=False)[0]
+            stages["serialize"] = time_runs(lambda: encoding.render(result), repeat)
+            results[name] = {"faces": 1, "stages": stages}
+            _print_stages(name, 1, stages)
+            continue
+
+        stages["decode_reduced"] = time_runs(lambda: decode_for_detection(data), repeat)
+        detection_plan = frozenset({face_service.STAGE_DETECTION})
+        stages["detect"] = time_runs(lambda: face_service.detect_image_faces(img, detection_plan), repeat)
+
+        faces = face_service.detect_image_faces(img, detection_plan)
+        aligned = [
+            face_align.norm_crop(img, landmark=face.kps, image_size=registry.get("recognition").input_size[0])
+            for face in faces if face.kps is not None
+        ]
+        if aligned:
+            stages["recognition"] = time_runs(lambda: face_service.embed_faces(aligned), repeat)
+        if faces:
+            stages["genderage"] = time_runs(lambda: face_service.predict_genderage([(img, face) for face in faces]), repeat)
+            crops_rgb = [face_service.to_rgb(face_service.crop_face(img, face.bbox)) for face in faces]
+            stages["emotion"] = time_runs(lambda: face_service.get_emotions(crops_rgb), repeat)
+
+        plan = face_service.resolve_stages(None, include_embeddings=True)
+        result = face_service._detect_decoded([(name, decode_for_detection(data))], plan)[0]
+        stages["serialize"] = time_runs(lambda: encoding.render(result), repeat)
+        stages["total"] = time_runs(
+            lambda: face_service._detect_decoded([(name, decode_for_detection(data))], plan), repeat
+        )
+
+        results[name] = {"faces": len(faces), "expected_faces": scenario["faces"], "stages": stages}
+        _print_stages(name, len(faces), stages)
+
+    return results
+
+
+def _print_stages(name, face_count, stages):
+    print(f"{name:<12} {face_count:>3} face(s) " + " ".join(
+        f"{stage}={timing['p50_ms']:.1f}ms" for stage, timing in stages.items()
+    ))
+
+
+def process_tree_rss(pid: int) -> int:
+    """Resident memory in bytes of a process and all of its descendants (Linux /proc)."""
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    pending.extend(int(child) for child in f.read().split())
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+    return total
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(timeout: float = 300.0):
+    """
+    Start the service with uvicorn on a free port and wait until /ready returns 200.
+
+    The result cache is disabled so that repeated requests are measured, not cached.
+
+    Returns:
+        (subprocess.Popen, base URL)
+    """
+    import requests
+
+    port = _free_port()
+    env = dict(os.environ, CACHE_ENABLED="false")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port), "--workers", "1"],
+        env=env,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit("Server exited during startup")
+        try:
+            if requests.get(f"{url}/ready", timeout=2).status_code == 200:
+                return server, url
+        except requests.RequestException:
+            pass
+        time.sleep(1)
+    server.terminate()
+    raise SystemExit("Server did not become ready in time")
+
+
+def run_load(url: str, scenarios, concurrency_levels, requests_per_level: int, server_pid: int = None) -> dict:
+    """
+    Send concurrent requests to /detect (photo scenarios), /embed (crop) and
+    /cluster (synthetic embeddings) and measure latency.
+
+    A few random bytes are appended after the JPEG end marker of every image
+    request so that a result cache on the server never answers them. The first
+    request of each target must succeed, otherwise the run stops.
+
+    Returns:
+        {endpoint: {scenario: {concurrency: stats}}}
+    """
+    import threading
+
+    import requests
+
+    targets = [("embed", name) for name, s in scenarios.items() if s["kind"] == "crop"]
+    targets += [("detect", name) for name, s in scenarios.items() if s["kind"] == "photo"]
+    payloads = {name: s["data"] for name, s in scenarios.items()}
+
+    cluster_name, cluster_count, cluster_identities = CLUSTER_SCENARIO
+    targets.append(("cluster", cluster_name))
+    payloads[cluster_name] = build_embeddings(cluster_count, cluster_identities)
+    local = threading.local()
+
+    def call(endpoint, data):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        if endpoint == "cluster":
+            upload = ("bench.npy", data, "application/octet-stream")
+        else:
+            upload = ("bench.jpg", data + os.urandom(8), "image/jpeg")
+        started = time.perf_counter()
+        response = session.post(f"{url}/{endpoint}", files={"file": upload}, timeout=300)
+        elapsed = time.perf_counter() - started
+        body = response.json() if response.ok else {}
+        faces = len(body.get("faces", ())) if endpoint in ("detect", "cluster") else int("embedding" in body)
+        ok = response.ok and "error" not in body
+        if endpoint == "cluster":
+            ok = ok and faces == cluster_count and bool(body.get("clusters"))
+        return elapsed, faces, ok
+
+    results = {}
+    for endpoint, name in targets:
+        data = payloads[name]
+        if not call(endpoint, data)[2]:
+            raise SystemExit(f"/{endpoint} failed for scenario {name}")
+        for concurrency in concurrency_levels:
+            count = max(requests_per_level, concurrency)
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                outcomes = list(pool.map(lambda _: call(endpoint, data), range(count)))
+            wall = time.perf_counter() - started
+
+            stats = percentiles([elapsed for elapsed, _, _ in outcomes])
+            stats.update({
+                "requests_per_sec": count / wall,
+                "faces_per_sec": sum(faces for _, faces, _ in outcomes) / wall,
+                "errors": sum(1 for _, _, ok in outcomes if not ok),
+            })
+            if server_pid:
+                stats["server_rss_mb"] = process_tree_rss(server_pid) / 2**20
+            results.setdefault(endpoint, {}).setdefault(name, {})[str(concurrency)] = stats
+            print(f"/{endpoint:<6} {name:<12} c={concurrency:<3} p50={stats['p50_ms']:.1f}ms "
+                  f"p95={stats['p95_ms']:.1f}ms p99={stats['p99_ms']:.1f}ms "
+                  f"{stats['requests_per_sec']:.1f} req/s {stats['faces_per_sec']:.1f} faces/s")
+    return results
+
+
+def environment() -> dict:
+    """Host and build details recorded with every baseline."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    try:
+        import onnxruntime
+        onnxruntime_version = onnxruntime.__version__
+    except ImportError:
+        onnxruntime_version = None
+
+    settings = ("INFERENCE_PROCESSES", "INFERENCE_WORKERS", "ORT_INTRA_OP_THREADS", "MODEL_PRECISION",
+                "EMOTION_BACKEND", "EMBED_BATCH_MAX_SIZE", "EMOTION_BATCH_SIZE", "DECODE_TARGET_SIZE")
+    return {
+        "commit": commit or None,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": platform.node(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "onnxruntime": onnxruntime_version,
+        "env": {name: os.environ[name] for name in settings if name in os.environ},
+    }
+
+
+def _flatten(report, prefix=""):
+    """Yield (metric path, value) for every latency/throughput number of a report."""
+    for key, value in report.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            yield from _flatten(value, path)
+        elif key.endswith(("p50_ms", "p95_ms", "p99_ms", "_per_sec", "rss_mb")):
+            yield path, value
+
+
+def compare(base: dict, new: dict, fail_on_regression: float = None) -> bool:
+    """
+    Print the change of every metric between two baselines.
+
+    Latencies and memory regress when they grow, throughput when it drops.
+
+    Returns:
+        False if any metric regressed by more than fail_on_regression percent
+    """
+    base_metrics = dict(_flatten({key: base[key] for key in ("stages", "load", "memory") if key in base}))
+    new_metrics = dict(_flatten({key: new[key] for key in ("stages", "load", "memory") if key in new}))
+
+    print(f"base: {base.get('environment', {}).get('commit')}  new: {new.get('environment', {}).get('commit')}")
+    ok = True
+    for path in sorted(base_metrics.keys() & new_metrics.keys()):
+        before, after = base_metrics[path], new_metrics[path]
+        if not before:
+            continue
+        change = (after - before) / before * 100
+        higher_is_better = path.endswith("_per_sec")
+        regression = -change if higher_is_better else change
+        marker = ""
+        if fail_on_regression is not None and regression > fail_on_regression:
+            marker = "  REGRESSION"
+            ok = False
+        print(f"{path:<60} {before:>10.2f} {after:>10.2f} {change:>+8.1f}%{marker}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_common(sub):
+        sub.add_argument("--faces-dir", default=None, help="folder of face crops for the synthetic photos")
+        sub.add_argument("--output", default=None, help="write the results as JSON")
+
+    def add_load(sub):
+        sub.add_argument("--url", default=None, help="base URL of a running server")
+        sub.add_argument("--start-server", action="store_true", help="start uvicorn on a free port (cache disabled)")
+        sub.add_argument("--concurrency", default="1,4,16", help="comma-separated concurrency levels")
+        sub.add_argument("--requests", type=int, default=50, help="requests per endpoint, scenario and concurrency level")
+        sub.add_argument("--server-pid", type=int, default=None, help="pid of a running server, for RSS")
+
+    stages_parser = subparsers.add_parser("stages", help="time each pipeline stage in process")
+    add_common(stages_parser)
+    stages_parser.add_argument("--repeat", type=int, default=10, help="timed runs per stage")
+
+    load_parser = subparsers.add_parser("load", help="end-to-end load test of /detect, /embed and /cluster")
+    add_common(load_parser)
+    add_load(load_parser)
+
+    all_parser = subparsers.add_parser("all", help="stages and load test into one baseline")
+    add_common(all_parser)
+    add_load(all_parser)
+    all_parser.add_argument("--repeat", type=int, default=10, help="timed runs per stage")
+
+    compare_parser = subparsers.add_parser("compare", help="compare two baselines")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--fail-on-regression", type=float, default=None,
+                                help="exit with status 1 if a metric regresses by more than this many percent")
+
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        with open(args.base, encoding="utf-8") as f:
+            base = json.load(f)
+        with open(args.new, encoding="utf-8") as f:
+            new = json.load(f)
+        sys.exit(0 if compare(base, new, args.fail_on_regression) else 1)
+
+    scenarios = build_scenarios(load_face_crops(args.faces_dir))
+    report = {"environment": environment(), "scenarios": {name: len(s["data"]) for name, s in scenarios.items()}}
+
+    if args.command in ("stages", "all"):
+        report["stages"] = run_stages(scenarios, args.repeat)
+        report["memory"] = {"benchmark_peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+    if args.command in ("load", "all"):
+        server = None
+        url, server_pid = args.url, args.server_pid
+        if args.start_server:
+            server, url = start_server()
+            server_pid = server.pid
+        if not url:
+            raise SystemExit("Pass --url or --start-server for the load test")
+        try:
+            concurrency_levels = [int(value) for value in args.concurrency.split(",")]
+            report["load"] = run_load(url, scenarios, concurrency_levels, args.requests, server_pid)
+            if server_pid:
+                report.setdefault("memory", {})["server_rss_mb"] = process_tree_rss(server_pid) / 2**20
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait(timeout=30)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from app import admission
+from app.admission import BACKGROUND, INTERACTIVE, AdmissionController, Rejected
+
+
+async def _settle():
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+
+def test_unbounded_waiters_do_not_fill_the_queue():
+    async def scenario():
+        controller = AdmissionController(concurrency=2, queue_depth=8, background_depth=4)
+        await controller.acquire(INTERACTIVE)
+        await controller.acquire(INTERACTIVE)
+
+        ingest = [asyncio.ensure_future(controller.acquire(BACKGROUND, bounded=False)) for _ in range(12)]
+        await _settle()
+        assert controller.stats()["waiting"][BACKGROUND] == 12
+
+        # Interactive requests still queue and are served before the photos
+        interactive = asyncio.ensure_future(controller.acquire(INTERACTIVE))
+        await _settle()
+        assert not interactive.done()
+        controller.release()
+        await _settle()
+        assert interactive.done() and interactive.exception() is None
+        assert not any(waiter.done() for waiter in ingest)
+
+        # Bounded background requests keep their own limit
+        background = [asyncio.ensure_future(controller.acquire(BACKGROUND)) for _ in range(5)]
+        await _settle()
+        with pytest.raises(Rejected) as rejected:
+            background[-1].result()
+        assert rejected.value.reason == admission.REASON_BACKGROUND_LIMIT
+
+        for waiter in ingest + background[:-1]:
+            waiter.cancel()
+        await _settle()
+        assert controller.stats()["waiting"] == {INTERACTIVE: 0, BACKGROUND: 0}
+        assert controller.stats()["waiting_unbounded"] == {INTERACTIVE: 0, BACKGROUND: 0}
+
+    asyncio.run(scenario())
+
+
+def test_bounded_queue_is_still_limited():
+    async def scenario():
+        controller = AdmissionController(concurrency=1, queue_depth=2, background_depth=2)
+        await controller.acquire(INTERACTIVE)
+        waiters = [asyncio.ensure_future(controller.acquire(INTERACTIVE)) for _ in range(3)]
+        await _settle()
+        with pytest.raises(Rejected) as rejected:
+            waiters[-1].result()
+        assert rejected.value.status_code == 503
+        assert rejected.value.reason == admission.REASON_QUEUE_FULL
+
+        for waiter in waiters[:-1]:
+            waiter.cancel()
+        await _settle()
+
+    asyncio.run(scenario())